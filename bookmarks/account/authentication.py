@@ -1,14 +1,112 @@
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.functions import Lower
 from .models import Profile
 
+# Authenticated requests.
+#
+# AuthenticationMiddleware loads request.user on every request with the get_user() method of the backend that
+# logged the user in, and the templates then load request.user.profile: two queries per page. The user and the
+# profile are loaded together and their fields kept in the cache instead; signals.py deletes the cached copy when
+# the user or the profile is saved (after the commit), so the next request reads the new values.
+#
+# The password hash is not cached. The session check of every request only needs the session auth hash (an HMAC
+# of the password hash, also stored in the session), so that is cached instead; the password itself is a deferred
+# field, loaded from the database by the few views that use it (password change).
+
+CACHED_USER_FIELDS = [field.attname for field in User._meta.concrete_fields if field.attname != 'password']
+CACHED_PROFILE_FIELDS = [field.attname for field in Profile._meta.concrete_fields]
+
+
+def user_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def cached_session_auth_hash(user, session_auth_hash):
+    # once the password has been loaded or changed (set_password()), the hash is computed from it again
+    if 'password' in user.__dict__:
+        return User.get_session_auth_hash(user)
+    return session_auth_hash
+
+
+def user_from_cache(cached):
+    """
+    Build the user (and its profile) from the fields kept in the cache.
+    """
+    user = User.from_db('default', CACHED_USER_FIELDS, [cached['user'][name] for name in CACHED_USER_FIELDS])
+    user.get_session_auth_hash = partial(cached_session_auth_hash, user, cached['session_auth_hash'])
+    if cached['profile'] is not None:
+        user.profile = Profile.from_db(
+            'default', CACHED_PROFILE_FIELDS, [cached['profile'][name] for name in CACHED_PROFILE_FIELDS]
+        )
+    return user
+
+
+def get_cached_user(user_id):
+    """
+    Return the user with its profile already loaded, from the cache when possible, or None.
+    """
+    key = user_cache_key(user_id)
+    cached = cache.get(key)
+    if cached is not None:
+        return user_from_cache(cached)
+    user = User.objects.select_related('profile').filter(pk=user_id).first()
+    if user is None:
+        return None
+    try:
+        profile = user.profile
+    except Profile.DoesNotExist:
+        profile = None
+    cache.set(key, {
+        'user': {name: getattr(user, name) for name in CACHED_USER_FIELDS},
+        'session_auth_hash': user.get_session_auth_hash(),
+        'profile': {name: getattr(profile, name) for name in CACHED_PROFILE_FIELDS} if profile else None,
+    }, settings.AUTH_USER_CACHE_TIMEOUT)
+    return user
+
+
+def invalidate_user(user_id):
+    # The signals call this inside the transaction that saves the user. Until the commit, the other requests still
+    # read the old row: a key deleted right away could be cached again with the old is_active or session auth hash,
+    # so it is deleted once the transaction is committed (at once outside of a transaction).
+    transaction.on_commit(lambda: cache.delete(user_cache_key(user_id)))
+
+
+# Created by migration 0006 and again after every migrate (see signals.py)
+EMAIL_INDEX_SQL = 'CREATE INDEX IF NOT EXISTS account_user_email_lower ON auth_user (LOWER(email))'
+
+
+def users_with_email(email):
+    """
+    Users whose email matches, ignoring the case.
+    LOWER(email) = ... is answered by the account_user_email_lower index (migration 0006).
+    """
+    return User.objects.annotate(email_lower=Lower('email')).filter(email_lower=email.lower())
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend whose get_user() reads the cache (see above).
+    """
+    def get_user(self, user_id):
+        user = get_cached_user(user_id)
+        return user if self.user_can_authenticate(user) else None
+
 
 class EmailAuthBackend:
     """
     Authenticate users using email.
     """
     def authenticate(self, request, username=None, password=None):
+        if username is None:
+            return None
         try:
-            user = User.objects.get(email=username)
+            user = users_with_email(username).get()
             if user.check_password(password):
                 # This method handles the password hashing
                 # to compare the given password with the password stored in the database
@@ -21,10 +119,7 @@ class EmailAuthBackend:
             return None
 
     def get_user(self, user_id):
-        try:
-            return User.objects.get(pk=user_id)
-        except User.DoesNotExist:
-            return None
+        return get_cached_user(user_id)
 
 
 def create_profile(backend, user, *args, **kwargs):
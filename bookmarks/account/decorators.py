@@ -0,0 +1,17 @@
+from functools import wraps
+
+from django.contrib.auth.views import redirect_to_login
+
+
+def async_login_required(view):
+    """
+    login_required() for async views (login_required only wraps sync views before Django 5.1).
+    request.auser() loads the user without blocking the event loop.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.template.loader import render_to_string
+
+from bookmarks.pagination import keyset_paginate
+
+# People directory (user_list view).
+#
+# The directory is paginated with a cursor on date_joined and every rendered page is kept in the cache for
+# PEOPLE_CACHE_TIMEOUT seconds. The cache keys contain a version number that is incremented when a user
+# registers or a profile changes (see signals.py), so the pages cached before the change are not used anymore.
+
+PEOPLE_PER_PAGE = 24
+VERSION_KEY = 'people_directory:version'
+
+
+def get_version():
+    # add() only sets the key if it doesn't exist yet; the version never expires
+    cache.add(VERSION_KEY, 1, None)
+    return cache.get(VERSION_KEY, 1)
+
+
+def invalidate():
+    """
+    Make every cached page of the directory out of date, once the current transaction is committed.
+    """
+    transaction.on_commit(_increment_version)
+
+
+def _increment_version():
+    # before the commit, a page rendered with the new version would still show the old rows
+    cache.add(VERSION_KEY, 1, None)
+    cache.incr(VERSION_KEY)
+
+
+def get_page(cursor=None):
+    """
+    Return {'html': ..., 'next_cursor': ..., 'empty': ...} for the page of active users starting after cursor.
+    """
+    cache_key = f'people_directory:{get_version()}:{cursor or ""}'
+    page = cache.get(cache_key)
+    if page is None:
+        users = keyset_paginate(
+            get_user_model().objects.filter(is_active=True).select_related('profile'),
+            cursor, PEOPLE_PER_PAGE, field='date_joined'
+        )
+        page = {
+            'html': render_to_string('account/user/list_users.html', {'users': users}),
+            'next_cursor': users.next_cursor,
+            'empty': not users,
+        }
+        cache.set(cache_key, page, settings.PEOPLE_CACHE_TIMEOUT)
+    return page
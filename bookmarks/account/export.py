@@ -0,0 +1,206 @@
+import json
+import logging
+import zipfile
+
+from asgiref.sync import sync_to_async
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from actions.models import Action
+from images.models import Image
+from .models import Profile
+
+logger = logging.getLogger(__name__)
+
+# Export of the data of a user: their bookmarked images, their likes and their activity.
+#
+# An account can have hundreds of thousands of rows, so nothing is loaded at once. The rows are read with
+# .iterator(chunk_size=EXPORT_CHUNK_SIZE) (a server-side cursor on PostgreSQL, chunked fetches on SQLite) and
+# written out one line of JSON per row (NDJSON) as they are read, so the memory used doesn't depend on the size
+# of the account and the first bytes are sent right away.
+#
+# The ZIP export adds the original image files. zipfile can write to a stream it can't seek in (the sizes go in
+# a descriptor after each file), so the archive is produced while it is sent, like the NDJSON.
+#
+#   {"type": "user", "username": ..., "profile": {...}}
+#   {"type": "image", "id": ..., "title": ..., "url": ..., "file": "images/..."}    one per bookmarked image
+#   {"type": "like", "image_id": ..., "title": ..., "url": ...}                    one per liked image
+#   {"type": "action", "verb": ..., "created": ..., "target_type": ..., "target_id": ...}
+
+EXPORT_CHUNK_SIZE = 2000
+# bytes sent at once to the client (the rows are small, sending each one separately would cost a write each)
+STREAM_CHUNK_SIZE = 64 * 1024
+# name of the NDJSON file inside the ZIP export
+ZIP_DATA_NAME = 'bookmarks.ndjson'
+
+
+def user_record(user):
+    profile = Profile.objects.filter(user=user).values('date_of_birth', 'photo').first() or {}
+    return {
+        'type': 'user',
+        'username': user.username,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'email': user.email,
+        'date_joined': user.date_joined,
+        'profile': profile,
+    }
+
+
+def export_records(user, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield the records of the user one at a time (see above).
+    values() rows are plain dicts: no model instance is built for the rows that are only written out.
+    """
+    yield user_record(user)
+
+    images = Image.objects.filter(user=user).order_by('id').values(
+        'id', 'title', 'slug', 'url', 'description', 'created', 'image', 'total_likes', 'total_views'
+    )
+    for image in images.iterator(chunk_size=chunk_size):
+        image['file'] = image.pop('image')
+        yield {'type': 'image', **image}
+
+    likes = Image.users_like.through.objects.filter(user=user).order_by('id').values_list(
+        'image_id', 'image__title', 'image__url'
+    )
+    for image_id, title, url in likes.iterator(chunk_size=chunk_size):
+        yield {'type': 'like', 'image_id': image_id, 'title': title, 'url': url}
+
+    actions = Action.objects.filter(user=user).order_by('created', 'id').values_list(
+        'verb', 'created', 'target_ct_id', 'target_id'
+    )
+    for verb, created, target_ct_id, target_id in actions.iterator(chunk_size=chunk_size):
+        # get_for_id() is served from the ContentType cache after the first call
+        target_type = ContentType.objects.get_for_id(target_ct_id).natural_key() if target_ct_id else None
+        yield {
+            'type': 'action',
+            'verb': verb,
+            'created': created,
+            'target_type': '.'.join(target_type) if target_type else None,
+            'target_id': target_id,
+        }
+
+
+def ndjson_lines(records):
+    for record in records:
+        yield (json.dumps(record, cls=DjangoJSONEncoder) + '\n').encode()
+
+
+def buffered(parts, size=STREAM_CHUNK_SIZE):
+    """
+    Join small byte strings into chunks of about `size` bytes. The first part is sent alone, so the download
+    starts at once.
+    """
+    parts = iter(parts)
+    first = next(parts, None)
+    if first is None:
+        return
+    yield first
+    buffer = []
+    length = 0
+    for part in parts:
+        buffer.append(part)
+        length += len(part)
+        if length >= size:
+            yield b''.join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def export_ndjson(user, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield the NDJSON export of the user as byte strings.
+    """
+    return buffered(ndjson_lines(export_records(user, chunk_size)))
+
+
+class ZipStream:
+    """
+    The file object zipfile writes to: it keeps the bytes written until they are taken with read_written().
+    It has no seek() or tell(), so zipfile writes the archive in streaming mode.
+    """
+    def __init__(self):
+        self._buffer = []
+        self.size = 0
+
+    def write(self, data):
+        self._buffer.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def read_written(self):
+        data = b''.join(self._buffer)
+        self._buffer = []
+        self.size = 0
+        return data
+
+
+def media_files(user, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield the stored files of the user (profile photo, then images), each once.
+    """
+    photo = Profile.objects.filter(user=user).values_list('photo', flat=True).first()
+    if photo:
+        yield photo
+    # Images with the same content share the same file (images.models.Blob); sorted by name, the copies are
+    # next to each other, so they are skipped without keeping the names already written
+    names = Image.objects.filter(user=user).exclude(image='').order_by('image').values_list('image', flat=True)
+    previous = None
+    for name in names.iterator(chunk_size=chunk_size):
+        if name != previous:
+            yield name
+        previous = name
+
+
+def export_zip(user, chunk_size=EXPORT_CHUNK_SIZE, storage=None):
+    """
+    Yield a ZIP archive with the NDJSON export of the user and the original media files, as byte strings.
+    """
+    storage = storage or Image._meta.get_field('image').storage
+    stream = ZipStream()
+    date_time = timezone.localtime().timetuple()[:6]
+    with zipfile.ZipFile(stream, 'w') as archive:
+        data = zipfile.ZipInfo(ZIP_DATA_NAME, date_time=date_time)
+        data.compress_type = zipfile.ZIP_DEFLATED
+        # force_zip64: the size of an entry written as a stream isn't known in advance and may exceed 2 GB
+        with archive.open(data, 'w', force_zip64=True) as entry:
+            for line in ndjson_lines(export_records(user, chunk_size)):
+                entry.write(line)
+                if stream.size >= STREAM_CHUNK_SIZE:
+                    yield stream.read_written()
+
+        for name in media_files(user, chunk_size):
+            try:
+                source = storage.open(name, 'rb')
+            except OSError:
+                logger.warning('%s is missing from the storage, not exported', name)
+                continue
+            # the pictures are compressed already: they are stored as they are
+            info = zipfile.ZipInfo(f'media/{name}', date_time=date_time)
+            with source, archive.open(info, 'w', force_zip64=True) as entry:
+                for chunk in source.chunks(STREAM_CHUNK_SIZE):
+                    entry.write(chunk)
+                    if stream.size >= STREAM_CHUNK_SIZE:
+                        yield stream.read_written()
+            yield stream.read_written()
+    # the central directory, written when the archive is closed
+    yield stream.read_written()
+
+
+async def aiter_sync(parts):
+    """
+    Iterate a sync iterator from async code, one part at a time.
+    Under ASGI, StreamingHttpResponse reads a sync iterator into a list before sending it; this keeps it streaming.
+    The parts are produced in the thread of the sync code, which holds the database connection of the request.
+    """
+    parts = iter(parts)
+    done = object()
+    while (part := await sync_to_async(next)(parts, done)) is not done:
+        yield part
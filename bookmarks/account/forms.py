@@ -1,7 +1,7 @@
 from django import forms
 from django.contrib.auth import get_user_model
-from django.contrib.auth.models import User
 
+from .authentication import users_with_email
 from .models import Profile
 
 
@@ -29,7 +29,8 @@ class UserRegistrationForm(forms.ModelForm):
 
     def clean_email(self):
         cd = self.cleaned_data['email']
-        if User.objects.filter(email=cd).exists():
+        # addresses are compared without the case: Bob@example.com and bob@example.com are the same inbox
+        if users_with_email(cd).exists():
             raise forms.ValidationError("Email already exists.")
         return cd
 
@@ -44,9 +45,9 @@ class UserEditForm(forms.ModelForm):
     def clean_email(self):
         cd = self.cleaned_data['email']
         # Query the database for any users with this email, excluding the current user
-        qs = User.objects.exclude(
+        qs = users_with_email(cd).exclude(    # looks for users with the submitted email, ignoring the case
             id=self.instance.id     # prevents the current user from being counted in this check
-        ).filter(email=cd)          # looks for users with the submitted email
+        )
         if qs.exists():
             raise forms.ValidationError("Email already in use.")
         return cd       # if we get here, the email is unique, so return it
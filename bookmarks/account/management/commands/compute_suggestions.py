@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from account import suggestions
+
+
+class Command(BaseCommand):
+    help = 'Compute the "people you may know" suggestions of every user from the follow and like graphs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=suggestions.TOP_K,
+                            help='Number of suggestions stored per user.')
+        parser.add_argument('--block-size', type=int, default=suggestions.BLOCK_SIZE,
+                            help='Number of users scored at once.')
+        parser.add_argument('--like-weight', type=float, default=suggestions.LIKE_WEIGHT,
+                            help='Weight of a shared like compared to a mutual follow.')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        written = suggestions.compute_suggestions(
+            top_k=options['top_k'],
+            block_size=options['block_size'],
+            like_weight=options['like_weight'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {written} suggestions in {time.monotonic() - started:.1f}s.'
+        ))
@@ -0,0 +1,40 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from account import export
+
+
+class Command(BaseCommand):
+    help = "Export a user's bookmarks, likes and activity as NDJSON, or as a ZIP that includes the image files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--format', choices=['ndjson', 'zip'], default='ndjson')
+        parser.add_argument('--output', default='-', help='File to write (default: standard output).')
+        parser.add_argument('--chunk-size', type=int, default=export.EXPORT_CHUNK_SIZE,
+                            help='Number of rows read from the database at once.')
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options['username'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'There is no user {options["username"]}.')
+
+        if options['format'] == 'zip':
+            parts = export.export_zip(user, options['chunk_size'])
+        else:
+            parts = export.export_ndjson(user, options['chunk_size'])
+
+        output = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        written = 0
+        try:
+            for part in parts:
+                output.write(part)
+                written += len(part)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+        if options['output'] != '-':
+            self.stdout.write(self.style.SUCCESS(f'Wrote {written} bytes to {options["output"]}.'))
@@ -0,0 +1,36 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from bookmarks.routers import REPLICA
+
+
+class Command(BaseCommand):
+    help = 'Copy the SQLite database to the local replica stand-in (the "replica" database, see REPLICA_DATABASE).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=1000,
+                            help='Pages copied per step; the primary stays writable between the steps.')
+
+    def handle(self, *args, **options):
+        if REPLICA not in connections.settings:
+            raise CommandError('No replica database: set REPLICA_DATABASE.')
+        primary = connections['default']
+        replica = connections.settings[REPLICA]
+        if primary.vendor != 'sqlite' or replica['ENGINE'] != primary.settings_dict['ENGINE']:
+            raise CommandError('sync_replica only copies SQLite databases; use the replication of the database server.')
+
+        started = time.monotonic()
+        primary.ensure_connection()
+        # The online backup API copies a consistent snapshot page by page while the site keeps running;
+        # the readers of the replica see the old copy until the copy is complete.
+        target = sqlite3.connect(replica['NAME'])
+        try:
+            primary.connection.backup(target, pages=options['pages'])
+        finally:
+            target.close()
+        self.stdout.write(self.style.SUCCESS(
+            f'Copied {primary.settings_dict["NAME"]} to {replica["NAME"]} in {time.monotonic() - started:.1f}s.'
+        ))
@@ -0,0 +1,50 @@
+# Generated by Django 5.0.14 on 2026-10-18 17:57
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_contacts(apps, schema_editor):
+    # seed the counters of the existing profiles, from then on the Contact signals keep them up to date
+    Profile = apps.get_model('account', 'Profile')
+    Contact = apps.get_model('account', 'Contact')
+
+    def contact_count(field):
+        return Coalesce(Subquery(
+            Contact.objects.filter(
+                **{field: OuterRef('user_id')}
+            ).order_by().values(field).annotate(total=Count('id')).values('total')
+        ), 0)
+
+    Profile.objects.update(
+        followers_count=contact_count('user_to'),
+        following_count=contact_count('user_from'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0003_profile_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='contact',
+            index=models.Index(fields=['user_from', 'user_to'], name='account_con_user_fr_198df8_idx'),
+        ),
+        migrations.RunPython(count_contacts, migrations.RunPython.noop),
+    ]
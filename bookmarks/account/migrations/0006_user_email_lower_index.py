@@ -0,0 +1,21 @@
+# Generated by Django 5.0.14 on 2026-10-18 21:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # auth.User belongs to django.contrib.auth, so the index for the case-insensitive email lookups of
+    # EmailAuthBackend (WHERE LOWER(email) = ...) is created with SQL here. SQLite drops it when auth_user is
+    # rebuilt by a later migration, so signals.py creates it again after migrate if needed.
+
+    dependencies = [
+        ('account', '0005_followsuggestion'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS account_user_email_lower ON auth_user (LOWER(email));',
+            reverse_sql='DROP INDEX IF EXISTS account_user_email_lower;',
+        ),
+    ]
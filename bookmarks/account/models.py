@@ -10,10 +10,21 @@ class Profile(models.Model):
     # making your code more flexible and reusable.
     date_of_birth = models.DateField(blank=True, null=True)
     photo = models.ImageField(upload_to='users/%Y/%m/%d', blank=True)
+    # Incremented on every save; part of the key of the cached activity cards of the user (actions/fragments.py)
+    version = models.PositiveIntegerField(default=0)
+    # Denormalized counts of Contact rows, kept up to date by the Contact signals (signals.py)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f'Profile of {self.user.username}'
 
+    def save(self, *args, **kwargs):
+        self.version += 1
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        super().save(*args, **kwargs)
+
 
 # Intermediate model to build relationship between users.
 #
@@ -42,12 +53,63 @@ class Contact(models.Model):
     created = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        indexes = [models.Index(fields=['-created'])]
+        indexes = [
+            models.Index(fields=['-created']),
+            # "does A follow B" is a single index lookup (see is_following())
+            models.Index(fields=['user_from', 'user_to']),
+        ]
         ordering = ['-created']
 
     def __str__(self):
         return f'{self.user_from} follows {self.user_to}'
 
+    @staticmethod
+    def is_following(user_from, user_to):
+        """
+        Return True if user_from follows user_to, without loading any follower list.
+        """
+        if not user_from.is_authenticated:
+            return False
+        return Contact.objects.filter(user_from=user_from, user_to=user_to).exists()
+
+
+# "People you may know": the best suggestions of every user, written by `manage.py compute_suggestions`
+# (account/suggestions.py). Pages read them with a single query instead of exploring the follow graph.
+class FollowSuggestion(models.Model):
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name='follow_suggestions',
+        on_delete=models.CASCADE
+    )
+    suggested = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name='+',
+        on_delete=models.CASCADE
+    )
+    score = models.FloatField()
+    # number of users followed by user that follow suggested ("followed by 3 people you follow")
+    mutual_follows = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'suggested'], name='unique_follow_suggestion'),
+        ]
+        indexes = [models.Index(fields=['user', '-score'])]
+        ordering = ['-score']
+
+    def __str__(self):
+        return f'{self.suggested} suggested to {self.user}'
+
+    @classmethod
+    def for_user(cls, user, count=5):
+        """
+        Return the best `count` suggestions for user, with the suggested users and their profiles.
+        """
+        return list(
+            cls.objects.filter(user=user).select_related('suggested', 'suggested__profile')[:count]
+        )
+
 
 # Add the following field to User dynamically
 # add_to_class(name, value): A method that adds an attribute to an existing class after it's been defined.
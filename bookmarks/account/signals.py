@@ -1,13 +1,78 @@
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.contrib.auth import get_user_model
+from django.db import connections, router
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_migrate, post_save
 from django.dispatch import receiver
-from .models import Profile
+from .models import Contact, Profile
+from . import directory
+from .authentication import EMAIL_INDEX_SQL, invalidate_user
+from images.thumbnails import queue_thumbnails
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
-def create_profile_from_user(sender, instance, created, **kwargs):
+def create_profile_from_user(sender, instance, created, update_fields=None, **kwargs):
     if created:
         Profile.objects.create(user=instance)
+    # the next request of the user loads the new values (a new password also logs the other sessions out)
+    invalidate_user(instance.pk)
+    # A new user, a new name or a deactivated account changes the people directory.
+    # Logging in only writes last_login, which isn't shown there.
+    if update_fields is None or set(update_fields) != {'last_login'}:
+        directory.invalidate()
+
+
+@receiver(post_save, sender=Profile)
+def profile_saved(sender, instance, **kwargs):
+    # create the thumbnails of the profile photo in the background
+    queue_thumbnails(instance, 'photo')
+    # the directory shows the profile photo
+    directory.invalidate()
+    # request.user.profile comes from the cached user
+    invalidate_user(instance.user_id)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def user_deleted(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver(post_migrate)
+def create_email_index(sender, using, **kwargs):
+    # On SQLite, the auth migration adding User.following rebuilds the auth_user table after account 0006,
+    # which drops the LOWER(email) index
+    # (not on the replica, which gets its tables from the primary)
+    if sender.name == 'account' and router.allow_migrate_model(using, get_user_model()):
+        with connections[using].cursor() as cursor:
+            cursor.execute(EMAIL_INDEX_SQL)
+
+
+def update_follow_counts(contact, delta):
+    # UPDATE account_profile SET followers_count = MAX(followers_count + delta, 0) WHERE user_id = ...
+    # The database applies the delta atomically, no matter how many users follow at the same time.
+    Profile.objects.filter(user_id=contact.user_to_id).update(
+        followers_count=Greatest(F('followers_count') + delta, 0)
+    )
+    Profile.objects.filter(user_id=contact.user_from_id).update(
+        following_count=Greatest(F('following_count') + delta, 0)
+    )
+    # update() doesn't send post_save: the cached profiles would keep the old counts
+    invalidate_user(contact.user_to_id)
+    invalidate_user(contact.user_from_id)
+
+
+@receiver(post_save, sender=Contact)
+def contact_created(sender, instance, created, **kwargs):
+    if created:
+        update_follow_counts(instance, 1)
+
+
+# QuerySet.delete() also sends post_delete for every deleted Contact
+@receiver(post_delete, sender=Contact)
+def contact_deleted(sender, instance, **kwargs):
+    update_follow_counts(instance, -1)
+
 
 # The post_save signal is a built-in Django signal that is sent after a model’s save() method completes.
 #
@@ -0,0 +1,145 @@
+import itertools
+
+import numpy as np
+from scipy import sparse
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from images.models import Image
+from .models import Contact, FollowSuggestion
+
+# Follow suggestions ("people you may know").
+#
+# Exploring friends-of-friends with the ORM means one query per followed user. Instead, the batch job
+# (`manage.py compute_suggestions`) loads the whole graph once into sparse CSR matrices, indexed by row number:
+#
+#   F[a, b] = 1 if a follows b                      (users x users)
+#   L[a, i] = 1 if a likes image i                  (users x images)
+#
+# For a block of users the scores are then a couple of sparse matrix products:
+#
+#   F @ F      -> number of people a follows that follow c (second-degree connections)
+#   L @ L.T    -> images liked by both a and c, weighted so that very popular images count less
+#
+# and the best TOP_K users that a doesn't follow yet are stored in FollowSuggestion.
+
+TOP_K = 10
+BLOCK_SIZE = 1000       # users scored at once; bounds the size of the intermediate matrices
+LIKE_WEIGHT = 0.5       # weight of a shared like compared to a mutual follow
+
+
+def fetch_pairs(queryset, fields):
+    """
+    Return the values of two integer fields as an (n, 2) array without building a list of tuples.
+    """
+    values = queryset.order_by().values_list(*fields).iterator(chunk_size=10000)
+    return np.fromiter(itertools.chain.from_iterable(values), dtype=np.int64).reshape(-1, 2)
+
+
+def to_rows(user_ids, ids):
+    """
+    Return the row numbers of ids in the sorted user_ids array and a mask of the ids that were found.
+    """
+    rows = np.searchsorted(user_ids, ids)
+    found = rows < len(user_ids)
+    found[found] = user_ids[rows[found]] == ids[found]
+    return rows, found
+
+
+def load_graph():
+    """
+    Return (user_ids, F, L): the active user ids and the follow and like matrices described above.
+    """
+    user_ids = np.fromiter(
+        get_user_model().objects.filter(is_active=True).order_by('id').values_list('id', flat=True),
+        dtype=np.int64
+    )
+    n = len(user_ids)
+
+    edges = fetch_pairs(Contact.objects.all(), ['user_from_id', 'user_to_id'])
+    follower_rows, follower_found = to_rows(user_ids, edges[:, 0])
+    followed_rows, followed_found = to_rows(user_ids, edges[:, 1])
+    keep = follower_found & followed_found
+    follows = sparse.csr_matrix(
+        (np.ones(keep.sum(), dtype=np.float32), (follower_rows[keep], followed_rows[keep])), shape=(n, n)
+    )
+    # duplicated Contact rows are summed; a follow is a follow
+    follows.data[:] = 1
+
+    likes = fetch_pairs(Image.users_like.through.objects.all(), ['user_id', 'image_id'])
+    like_rows, like_found = to_rows(user_ids, likes[:, 0])
+    image_ids, image_cols = np.unique(likes[like_found, 1], return_inverse=True)
+    liked = sparse.csr_matrix(
+        (np.ones(like_found.sum(), dtype=np.float32), (like_rows[like_found], image_cols)),
+        shape=(n, len(image_ids))
+    )
+    # An image liked by thousands of users says little about two of them: weight it by 1 / log2(2 + likes)
+    weights = 1 / np.log2(2 + np.asarray(liked.sum(axis=0)).ravel())
+    liked = sparse.csr_matrix(liked.multiply(np.sqrt(weights)))
+    return user_ids, follows, liked
+
+
+def score_block(follows, liked, start, end, top_k, like_weight):
+    """
+    Yield (row, [(column, score, mutual_follows), ...]) for the users of rows start..end.
+    """
+    block = follows[start:end]
+    mutual = (block @ follows).tocsr()
+    mutual.sort_indices()
+    scores = (mutual + like_weight * (liked[start:end] @ liked.T)).tocsr()
+
+    for i in range(end - start):
+        row = start + i
+        columns = scores.indices[scores.indptr[i]:scores.indptr[i + 1]]
+        values = scores.data[scores.indptr[i]:scores.indptr[i + 1]]
+        # don't suggest the user itself or the users that are already followed
+        followed = block.indices[block.indptr[i]:block.indptr[i + 1]]
+        candidates = (columns != row) & ~np.isin(columns, followed) & (values > 0)
+        columns, values = columns[candidates], values[candidates]
+        if len(columns) > top_k:
+            best = np.argpartition(-values, top_k)[:top_k]
+            columns, values = columns[best], values[best]
+        order = np.argsort(-values, kind='stable')
+        columns, values = columns[order], values[order]
+
+        mutual_columns = mutual.indices[mutual.indptr[i]:mutual.indptr[i + 1]]
+        mutual_values = mutual.data[mutual.indptr[i]:mutual.indptr[i + 1]]
+        positions = np.searchsorted(mutual_columns, columns)
+        counts = np.zeros(len(columns), dtype=np.int64)
+        found = positions < len(mutual_columns)
+        found[found] = mutual_columns[positions[found]] == columns[found]
+        counts[found] = mutual_values[positions[found]]
+        yield row, list(zip(columns.tolist(), values.tolist(), counts.tolist()))
+
+
+def compute_suggestions(top_k=TOP_K, block_size=BLOCK_SIZE, like_weight=LIKE_WEIGHT):
+    """
+    Replace the stored suggestions of every active user. Return the number of suggestions written.
+    """
+    user_ids, follows, liked = load_graph()
+    written = 0
+    for start in range(0, len(user_ids), block_size):
+        end = min(start + block_size, len(user_ids))
+        suggestions = [
+            FollowSuggestion(
+                user_id=int(user_ids[row]),
+                suggested_id=int(user_ids[column]),
+                score=score,
+                mutual_follows=mutual_follows
+            )
+            for row, best in score_block(follows, liked, start, end, top_k, like_weight)
+            for column, score, mutual_follows in best
+        ]
+        # readers see either the old or the new suggestions of the block, never an empty list
+        with transaction.atomic():
+            # the id range (up to the first user of the next block) also clears the suggestions of
+            # deactivated users
+            stale = FollowSuggestion.objects.all()
+            if start > 0:
+                stale = stale.filter(user_id__gte=int(user_ids[start]))
+            if end < len(user_ids):
+                stale = stale.filter(user_id__lt=int(user_ids[end]))
+            stale.delete()
+            FollowSuggestion.objects.bulk_create(suggestions, batch_size=1000)
+        written += len(suggestions)
+    return written
@@ -0,0 +1,12 @@
+from django import template
+
+from account.models import Contact
+
+register = template.Library()
+
+
+# Usage: {% load follow %} {% if request.user|follows:user %}Unfollow{% else %}Follow{% endif %}
+# A single indexed lookup on Contact(user_from, user_to) instead of loading user.followers.all.
+@register.filter
+def follows(user_from, user_to):
+    return Contact.is_following(user_from, user_to)
@@ -1,3 +1,64 @@
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from bookmarks import redis_client
+from .authentication import user_cache_key
+
+
+class EmailLoginTests(TestCase):
+    def setUp(self):
+        redis_client.r.flushdb()
+        self.user = User.objects.create_user('alice', email='Alice@Example.com', password='sunset-over-the-sea')
+
+    def test_email_is_matched_without_case(self):
+        for email in ('Alice@Example.com', 'alice@example.com', 'ALICE@EXAMPLE.COM'):
+            self.assertEqual(authenticate(username=email, password='sunset-over-the-sea'), self.user)
+
+    def test_wrong_password(self):
+        self.assertIsNone(authenticate(username='alice@example.com', password='sunrise'))
+
+    def test_email_of_several_users(self):
+        # the same address with another case: the login can't tell which user it is
+        User.objects.create_user('alice2', email='alice@example.com', password='sunset-over-the-sea')
+        self.assertIsNone(authenticate(username='alice@example.com', password='sunset-over-the-sea'))
+
+    def test_login_page(self):
+        response = self.client.post(
+            reverse('login'), {'username': 'ALICE@example.com', 'password': 'sunset-over-the-sea'}
+        )
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+        self.assertEqual(int(self.client.session['_auth_user_id']), self.user.pk)
+
+
+class CachedUserTests(TestCase):
+    def setUp(self):
+        redis_client.r.flushdb()
+        cache.clear()
+        self.user = User.objects.create_user('alice', password='sunset-over-the-sea')
+        self.client.force_login(self.user)
+        # the first request caches the user
+        self.assertEqual(self.client.get(reverse('dashboard')).status_code, 200)
+
+    def save_user(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+            # until the commit, a request that cached the user again would keep the old values
+            self.assertIsNotNone(cache.get(user_cache_key(self.user.pk)))
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+
+    def assertLoggedOut(self):
+        response = self.client.get(reverse('dashboard'))
+        self.assertRedirects(response, f"{reverse('login')}?next={reverse('dashboard')}", fetch_redirect_response=False)
+
+    def test_deactivated_user_is_logged_out(self):
+        self.user.is_active = False
+        self.save_user()
+        self.assertLoggedOut()
+
+    def test_new_password_logs_the_sessions_out(self):
+        self.user.set_password('sunrise-over-the-hills')
+        self.save_user()
+        self.assertLoggedOut()
@@ -1,7 +1,11 @@
+from django.conf import settings
 from django.contrib.auth import views as auth_views
 from django.urls import path, include
 from . import views
 
+# Served by ASGI, following uses the async view (see bookmarks/asgi.py)
+user_follow = views.user_follow_async if settings.ASYNC_VIEWS else views.user_follow
+
 urlpatterns = [
     # previous login url
     # path('login/', views.user_login, name='login'),
@@ -27,9 +31,10 @@ urlpatterns = [
     path('', views.dashboard, name='dashboard'),
     path('register/', views.register, name='register'),
     path('edit/', views.edit, name='edit'),
+    path('export/', views.data_export, name='data_export'),
 
     path('users/', views.user_list, name='user_list'),
-    path('users/follow/', views.user_follow, name='user_follow'),
+    path('users/follow/', user_follow, name='user_follow'),
     path('users/<username>/', views.user_detail, name='user_detail'),
 
 ]
\ No newline at end of file
@@ -1,14 +1,24 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import authenticate, login, get_user_model
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse, JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from .forms import LoginForm, UserRegistrationForm, UserEditForm, ProfileEditForm
-from .models import Profile, Contact
+from .models import Profile, Contact, FollowSuggestion
+from . import directory, export
+from .decorators import async_login_required
 from django.contrib import messages
 from django.views.decorators.http import require_POST
 
-from actions.utils import create_action
+from actions.utils import create_action, acreate_action, flush_due_actions
+from actions import feed
 from actions.models import Action
+from actions.fragments import render_action_cards
+from actions.hydration import hydrate_actions
+from images.fragments import render_image_cards
+from bookmarks.pagination import keyset_paginate
+from bookmarks.redis_client import RedisUnavailable
+from bookmarks.routers import replica_reads
 
 def user_login(request):
     if request.method == 'POST':
@@ -38,26 +48,29 @@ def user_login(request):
 
 
 @login_required
+@replica_reads
 def dashboard(request):
-    # Display all actions by default
-    actions = Action.objects.exclude(user=request.user)
-
-    following_ids = request.user.following.values_list(
-        'id', flat=True
-    )
-    # when the code does request.user.following.values_list('id', flat=True), it's:
-    # Accessing the current user's "following" relationship
-    # Retrieving just the IDs of those followed users
-    # Getting them as a flat list (like [1, 5, 9]) rather than tuples (which would look like [(1,), (5,), (9,)])
-
-    if following_ids:
-        # If user is following others, retrieve only their actions
-        actions = actions.filter(user_id__in=following_ids)
+    # write the buffered actions that have waited too long, so the page doesn't miss them on a quiet site
+    # (the write pins the request to the primary, which has them)
+    flush_due_actions()
+    if request.user.following.exists():
+        # If user is following others, read their latest actions from the precomputed timeline.
+        # The timeline is filled by create_action() (fan-out-on-write), so this is a single
+        # ordered slice instead of a query over the whole Action table.
+        try:
+            action_ids = feed.get_feed(request.user, 10)
+            actions = Action.objects.filter(id__in=action_ids)
+        except RedisUnavailable:
+            # without Redis, the same actions come from the database (slower, but the page works)
+            actions = Action.objects.filter(user__in=request.user.following.all())
+    else:
+        # Display all actions by default
+        actions = Action.objects.exclude(user=request.user)
 
     # This restricts the results to just first 10 actions.
     # select_related('user', 'user__profile') → Reduces database hits for User and Profile.
-    # prefetch_related('target') → Efficiently loads generic foreign key targets (e.g., posts, images).
-    actions = actions.select_related('user', 'user__profile').prefetch_related('target')[:10]
+    # The generic foreign key targets (e.g., posts, images) are loaded by hydrate_actions(), one query per type.
+    actions = actions.select_related('user', 'user__profile')[:10]
     # The 'user__profile' part uses Django's double underscore notation to "traverse" relationships:
     # 'user' tells Django to follow the foreign key from Action to User
     # 'user__profile' tells Django to then follow the relationship from User to Profile
@@ -69,7 +82,11 @@ def dashboard(request):
     return render(
         request,
         'account/dashboard.html',
-        {'section': 'dashboard', 'actions': actions}
+        {
+            'section': 'dashboard',
+            'action_cards': render_action_cards(hydrate_actions(actions)),
+            'suggestions': FollowSuggestion.for_user(request.user),
+        }
     )
 
 
@@ -141,27 +158,65 @@ def edit(request):
                   )
 
 
+@login_required
+def data_export(request):
+    # The export is produced while it is sent (see account/export.py): a big account doesn't have to fit in
+    # memory and the download starts at once. ?format=zip adds the image files.
+    if request.GET.get('format') == 'zip':
+        parts, content_type, extension = export.export_zip(request.user), 'application/zip', 'zip'
+    else:
+        parts, content_type, extension = export.export_ndjson(request.user), 'application/x-ndjson', 'ndjson'
+    if isinstance(request, ASGIRequest):
+        parts = export.aiter_sync(parts)
+    response = StreamingHttpResponse(parts, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="bookmarks-{request.user.username}.{extension}"'
+    return response
+
+
 User = get_user_model()
 
-# The user_list view gets all active users.
+# The user_list view gets the active users, one page at a time.
 @login_required
+@replica_reads
 def user_list(request):
-    users = User.objects.filter(is_active=True)
+    # The rendered page comes from the cache; it is rendered again after a registration or a profile edit.
+    page = directory.get_page(request.GET.get('cursor'))
+    if request.GET.get('users_only'):
+        if page['empty']:
+            return HttpResponse('')
+        response = HttpResponse(page['html'])
+        # the infinite scroll script reads the cursor of the next page from this header
+        response['X-Next-Cursor'] = page['next_cursor'] or ''
+        return response
     return render(
         request,
         'account/user/list.html',
-        {'section': 'people', 'users': users}
+        {'section': 'people', 'page': page, 'suggestions': FollowSuggestion.for_user(request.user)}
     )
 
 
 @login_required
+@replica_reads
 def user_detail(request, username):
     # to retrieve the active user with the given username.
-    user = get_object_or_404(User, username=username, is_active=True)
+    # The profile holds the follower count, so it is loaded in the same query.
+    user = get_object_or_404(User.objects.select_related('profile'), username=username, is_active=True)
+    # The gallery is paginated with a cursor like the image list, so profiles with thousands of
+    # images cost the same as the others.
+    images = keyset_paginate(user.images_created.all(), request.GET.get('cursor'), 12)
+    # the image cards are rendered once and then served from the cache
+    image_cards = render_image_cards(images)
+    if request.GET.get('images_only'):
+        if not images:
+            return HttpResponse('')
+        response = render(request, 'images/image/list_images.html', {'image_cards': image_cards})
+        # the infinite scroll script reads the cursor of the next page from this header
+        response['X-Next-Cursor'] = images.next_cursor or ''
+        return response
     return render(
         request,
         'account/user/detail.html',
-        {'section': 'people', 'user': user}
+        {'section': 'people', 'user': user, 'images': images, 'image_cards': image_cards}
     )
 
 # Adding user follow/unfollow actions with JavaScript
@@ -179,6 +234,10 @@ def user_follow(request):
 
             if action == 'follow':
                 Contact.objects.get_or_create(user_from=request.user, user_to=user)
+                # don't suggest a user that is already followed until the suggestions are computed again
+                FollowSuggestion.objects.filter(user=request.user, suggested=user).delete()
+                # show the latest actions of the followed user on the dashboard right away
+                feed.follow(request.user, user)
                 create_action(request.user, 'is following', user)
                 # When a user follows another user, the relationship is created (or removed, in the case of
                 # unfollowing). In the case of following, the action is following is logged to record that the
@@ -186,7 +245,35 @@ def user_follow(request):
 
             else:
                 Contact.objects.filter(user_from=request.user, user_to=user).delete()
+                feed.unfollow(request.user, user)
             return JsonResponse({'status':'ok'})
         except User.DoesNotExist:
             return JsonResponse({'status':'error'})
-    return JsonResponse({'status':'error'})
\ No newline at end of file
+    return JsonResponse({'status':'error'})
+
+
+# Async version of user_follow, used when the site is served by ASGI (see images/views.py)
+@async_login_required
+@require_POST
+async def user_follow_async(request):
+    user_id = request.POST.get('id')
+    action = request.POST.get('action')
+    if user_id and action:
+        try:
+            user = await User.objects.aget(id=user_id)
+            current_user = await request.auser()
+            if user == current_user:
+                return JsonResponse({'status': 'error', 'message': 'You cannot follow yourself.'})
+
+            if action == 'follow':
+                await Contact.objects.aget_or_create(user_from=current_user, user_to=user)
+                await FollowSuggestion.objects.filter(user=current_user, suggested=user).adelete()
+                await feed.afollow(current_user, user)
+                await acreate_action(current_user, 'is following', user)
+            else:
+                await Contact.objects.filter(user_from=current_user, user_to=user).adelete()
+                await feed.aunfollow(current_user, user)
+            return JsonResponse({'status': 'ok'})
+        except User.DoesNotExist:
+            return JsonResponse({'status': 'error'})
+    return JsonResponse({'status': 'error'})
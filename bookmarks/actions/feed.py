@@ -0,0 +1,168 @@
+import logging
+
+from django.conf import settings
+
+from account.models import Contact, Profile
+from bookmarks import redis_client
+from bookmarks.redis_client import RedisUnavailable
+from .models import Action
+
+logger = logging.getLogger(__name__)
+
+# Every follower has a timeline stored as a Redis sorted set:
+#   feed:<user_id>  ->  {action_id: created_timestamp, ...}
+# The score is the timestamp of the action, so ZREVRANGE returns the newest actions first
+# and the dashboard can read a ready-ordered slice without touching the Action table.
+#
+# Users with a very large audience are not fanned out (writing one action into 100k timelines
+# is too expensive). Their ids are kept in the PULL_USERS_KEY set and their actions are merged
+# into the timeline at read time instead (fan-out-on-read).
+#
+# The timelines live in the shared Redis client (bookmarks/redis_client.py). They are a copy of the Action table:
+# while Redis is unavailable the dashboard reads the actions from the database, and a timeline that missed
+# some updates can be rebuilt with `manage.py backfill_feeds`.
+PULL_USERS_KEY = 'feed:pull_users'
+
+
+def feed_key(user_id):
+    return f'feed:{user_id}'
+
+
+def _score(action):
+    return action.created.timestamp()
+
+
+def add_to_timeline(pipe, follower_id, actions):
+    """
+    Add actions to a follower timeline and trim it to FEED_MAX_LENGTH entries.
+    """
+    key = feed_key(follower_id)
+    pipe.zadd(key, {action.id: _score(action) for action in actions})
+    # ranks are ascending, so removing 0..-(max+1) drops the oldest entries
+    pipe.zremrangebyrank(key, 0, -settings.FEED_MAX_LENGTH - 1)
+
+
+def uses_fanout_on_read(user_id):
+    """
+    Return True if the user has too many followers to push actions into every timeline.
+    """
+    # the denormalized counter avoids a COUNT(*) over the followers on every new action
+    followers = Profile.objects.filter(user_id=user_id).values_list('followers_count', flat=True).first()
+    return (followers or 0) > settings.FEED_FANOUT_MAX_FOLLOWERS
+
+
+def push_action(action):
+    """
+    Fan-out-on-write: push a new action into the timeline of every follower of its user.
+    """
+    push_actions(action.user_id, [action])
+
+
+def push_actions(user_id, actions):
+    """
+    Push new actions of the same user into the timeline of every follower, with one ZADD per follower.
+    """
+    try:
+        if uses_fanout_on_read(user_id):
+            redis_client.r.sadd(PULL_USERS_KEY, user_id)
+            return
+        redis_client.r.srem(PULL_USERS_KEY, user_id)
+
+        follower_ids = Contact.objects.filter(
+            user_to_id=user_id
+        ).values_list('user_from_id', flat=True)
+        # the batch sends the ZADD commands every PIPELINE_BATCH_SIZE commands
+        with redis_client.batch() as pipe:
+            for follower_id in follower_ids.iterator(chunk_size=redis_client.PIPELINE_BATCH_SIZE):
+                add_to_timeline(pipe, follower_id, actions)
+    except RedisUnavailable:
+        # the actions are saved: the dashboards read them from the database until Redis is back
+        logger.warning('Actions of user %s not pushed to the timelines: Redis is unavailable', user_id)
+
+
+def follow(user_from, user_to):
+    """
+    Seed the follower timeline with the latest actions of the user that was just followed.
+    """
+    actions = list(
+        Action.objects.filter(user=user_to).only('id', 'created')[:settings.FEED_MAX_LENGTH]
+    )
+    if not actions:
+        return
+    try:
+        pipe = redis_client.r.pipeline(transaction=False)
+        add_to_timeline(pipe, user_from.id, actions)
+        pipe.execute()
+    except RedisUnavailable:
+        # the follow is saved; the timeline gets the next actions of user_to, or a backfill_feeds run
+        logger.warning('Timeline of user %s not seeded: Redis is unavailable', user_from.id)
+
+
+async def afollow(user_from, user_to):
+    """
+    Async version of follow() for the async user_follow view.
+    """
+    actions = [
+        action async for action in Action.objects.filter(user=user_to).only('id', 'created')[:settings.FEED_MAX_LENGTH]
+    ]
+    if not actions:
+        return
+    try:
+        pipe = redis_client.get_async_client().pipeline(transaction=False)
+        add_to_timeline(pipe, user_from.id, actions)
+        await pipe.execute()
+    except RedisUnavailable:
+        logger.warning('Timeline of user %s not seeded: Redis is unavailable', user_from.id)
+
+
+def unfollow(user_from, user_to):
+    """
+    Remove the actions of a user that is no longer followed from the follower timeline.
+    """
+    action_ids = list(
+        Action.objects.filter(user=user_to).values_list('id', flat=True)[:settings.FEED_MAX_LENGTH]
+    )
+    if not action_ids:
+        return
+    try:
+        redis_client.r.zrem(feed_key(user_from.id), *action_ids)
+    except RedisUnavailable:
+        logger.warning('Timeline of user %s not cleaned: Redis is unavailable', user_from.id)
+
+
+async def aunfollow(user_from, user_to):
+    """
+    Async version of unfollow().
+    """
+    action_ids = [
+        action_id async for action_id in
+        Action.objects.filter(user=user_to).values_list('id', flat=True)[:settings.FEED_MAX_LENGTH]
+    ]
+    if not action_ids:
+        return
+    try:
+        await redis_client.get_async_client().zrem(feed_key(user_from.id), *action_ids)
+    except RedisUnavailable:
+        logger.warning('Timeline of user %s not cleaned: Redis is unavailable', user_from.id)
+
+
+def get_feed(user, count):
+    """
+    Return the ids of the latest `count` actions from the users followed by `user`, newest first.
+    """
+    entries = redis_client.r.zrevrange(feed_key(user.id), 0, count - 1, withscores=True)
+    entries = [(int(action_id), score) for action_id, score in entries]
+
+    # Merge in the actions of followed users that are not fanned out (fan-out-on-read).
+    pull_user_ids = [int(user_id) for user_id in redis_client.r.smembers(PULL_USERS_KEY)]
+    if pull_user_ids:
+        followed_pull_ids = Contact.objects.filter(
+            user_from=user, user_to_id__in=pull_user_ids
+        ).values_list('user_to_id', flat=True)
+        pulled = Action.objects.filter(
+            user_id__in=list(followed_pull_ids)
+        ).values_list('id', 'created')[:count]
+        entries += [(action_id, created.timestamp()) for action_id, created in pulled]
+        entries = sorted(set(entries), key=lambda entry: entry[1], reverse=True)[:count]
+
+    return [action_id for action_id, score in entries]
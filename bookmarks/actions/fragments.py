@@ -0,0 +1,28 @@
+from django.template.loader import render_to_string
+
+from bookmarks.fragments import cached_fragments
+
+
+def action_card_key(item):
+    # The card shows the user, the profile photo and the target. Profile.version changes when the profile is
+    # edited and Image.version when the image changes (see hydration.py for the version of each target).
+    profile_version = item.profile.version if item.profile else 0
+    target_version = item.target.version if item.target else 0
+    return f'fragment:action_card:{item.id}:{profile_version}:{target_version}'
+
+
+def render_action_card(item):
+    # the relative date ("5 minutes ago") is left out, it is rendered on every request
+    context = {'action': item}
+    return {
+        'images': render_to_string('actions/action/card_images.html', context),
+        'info': render_to_string('actions/action/card_info.html', context),
+    }
+
+
+def render_action_cards(items):
+    """
+    Return a list of (item, card) tuples for the FeedItems returned by hydrate_actions().
+    The cards come from the cache when possible.
+    """
+    return list(zip(items, cached_fragments(items, action_card_key, render_action_card)))
@@ -0,0 +1,93 @@
+from django.contrib.contenttypes.models import ContentType
+
+# Feed hydration.
+#
+# Action.target is a GenericForeignKey: resolving it for every card (even with prefetch_related('target'))
+# loads the targets without their related rows, and the templates then fetch them one by one.
+# hydrate_actions() groups the actions by target_ct and loads every type of target in a single query with the
+# joins its card needs, then returns plain FeedItem objects that the templates can use without touching the
+# database. A page costs 1 query for the actions + 1 query per type of target, whatever its length.
+
+
+class FeedTarget:
+    """
+    What an activity card shows of the target of an action.
+    """
+    __slots__ = ('name', 'url', 'image', 'version')
+
+    def __init__(self, name, url, image=None, version=0):
+        self.name = name
+        self.url = url
+        self.image = image      # FieldFile of the target image, if any
+        self.version = version  # part of the key of the cached card (actions/fragments.py)
+
+    def __str__(self):
+        return self.name
+
+
+class FeedItem:
+    """
+    An action with its user, profile and target already loaded.
+    """
+    __slots__ = ('id', 'verb', 'created', 'user', 'profile', 'target')
+
+    def __init__(self, action, target):
+        self.id = action.id
+        self.verb = action.verb
+        self.created = action.created
+        self.user = action.user
+        # users created in the admin site may not have a profile
+        self.profile = getattr(action.user, 'profile', None)
+        self.target = target
+
+
+def _image_target(image):
+    return FeedTarget(str(image), image.get_absolute_url(), image.image, image.version)
+
+
+def _user_target(user):
+    profile = getattr(user, 'profile', None)
+    return FeedTarget(str(user), user.get_absolute_url(), version=profile.version if profile else 0)
+
+
+def _default_target(obj):
+    return FeedTarget(str(obj), obj.get_absolute_url())
+
+
+# For every type of target: the related objects to join and how to build its FeedTarget
+TARGET_LOADERS = {
+    'images.image': ([], _image_target),
+    'auth.user': (['profile'], _user_target),
+}
+
+
+def load_targets(actions):
+    """
+    Return {(target_ct_id, target_id): FeedTarget} with one query per type of target.
+    """
+    ids_by_ct = {}
+    for action in actions:
+        if action.target_ct_id and action.target_id:
+            ids_by_ct.setdefault(action.target_ct_id, set()).add(action.target_id)
+
+    targets = {}
+    for ct_id, ids in ids_by_ct.items():
+        # get_for_id() is served from the ContentType cache
+        model = ContentType.objects.get_for_id(ct_id).model_class()
+        if model is None:
+            continue
+        related, build = TARGET_LOADERS.get(model._meta.label_lower, ([], _default_target))
+        for pk, obj in model._default_manager.select_related(*related).in_bulk(ids).items():
+            targets[ct_id, pk] = build(obj)
+    return targets
+
+
+def hydrate_actions(actions):
+    """
+    Return a FeedItem for every action.
+    Load the actions with select_related('user', 'user__profile') to keep it to one query per type of target.
+    """
+    actions = list(actions)
+    targets = load_targets(actions)
+    # a deleted target leaves the action without target, as the GenericForeignKey would
+    return [FeedItem(action, targets.get((action.target_ct_id, action.target_id))) for action in actions]
@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from account.models import Contact, Profile
+from actions import feed
+from bookmarks import redis_client
+from actions.models import Action
+
+
+class Command(BaseCommand):
+    help = 'Fill the follower timelines used by the dashboard from the existing Action rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Delete the existing timelines before filling them again.'
+        )
+
+    def handle(self, *args, **options):
+        # Users with too many followers are read at request time instead of being fanned out.
+        pull_user_ids = set(
+            Profile.objects.filter(
+                followers_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS
+            ).values_list('user_id', flat=True)
+        )
+        redis_client.r.delete(feed.PULL_USERS_KEY)
+        if pull_user_ids:
+            redis_client.r.sadd(feed.PULL_USERS_KEY, *pull_user_ids)
+
+        follower_ids = Contact.objects.order_by().values_list(
+            'user_from_id', flat=True
+        ).distinct()
+        total = 0
+        # the timelines of many followers go to Redis in each round trip
+        with redis_client.batch() as pipe:
+            for follower_id in follower_ids.iterator():
+                following_ids = Contact.objects.filter(
+                    user_from_id=follower_id
+                ).exclude(
+                    user_to_id__in=pull_user_ids
+                ).values_list('user_to_id', flat=True)
+                actions = list(
+                    Action.objects.filter(
+                        user_id__in=list(following_ids)
+                    ).only('id', 'created')[:settings.FEED_MAX_LENGTH]
+                )
+                if options['clear']:
+                    pipe.delete(feed.feed_key(follower_id))
+                if actions:
+                    feed.add_to_timeline(pipe, follower_id, actions)
+                total += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Filled {total} timelines ({len(pull_user_ids)} users read on demand).'
+        ))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from actions.utils import flush_actions
+
+
+class Command(BaseCommand):
+    help = 'Write the actions buffered by create_action() to the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float,
+            help='Keep running and flush every INTERVAL seconds instead of flushing once.'
+        )
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            written = flush_actions()
+            if written or not interval:
+                self.stdout.write(f'Wrote {written} actions.')
+            if not interval:
+                return
+            time.sleep(interval)
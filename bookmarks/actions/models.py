@@ -2,6 +2,7 @@ from django.db import models
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
 
 
 class Action(models.Model):
@@ -9,7 +10,8 @@ class Action(models.Model):
                              on_delete=models.CASCADE
                              )
     verb = models.CharField(max_length=255)
-    created = models.DateTimeField(auto_now_add=True)
+    # not auto_now_add: buffered actions keep the time create_action() was called, not the time they were flushed
+    created = models.DateTimeField(default=timezone.now)
     target_ct = models.ForeignKey(
         ContentType,
         blank=True, null=True,
@@ -1,3 +1,173 @@
-from django.test import TestCase
+import json
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from account.models import Contact
+from bookmarks import redis_client
+from images.models import Image
+from .models import Action
+from . import feed, utils
+
+
+def make_image(user, title='Sunset'):
+    return Image.objects.create(user=user, title=title, url='https://example.com/picture.jpg')
+
+
+class ActionTests(TestCase):
+    def setUp(self):
+        redis_client.r.flushdb()
+        self.user = User.objects.create_user('alice')
+        self.image = make_image(self.user)
+
+    def test_same_action_is_recorded_once_per_window(self):
+        self.assertTrue(utils.create_action(self.user, 'likes', self.image))
+        self.assertFalse(utils.create_action(self.user, 'likes', self.image))
+        self.assertTrue(utils.create_action(self.user, 'likes', make_image(self.user, 'Beach')))
+        self.assertEqual(Action.objects.filter(user=self.user).count(), 2)
+
+
+@override_settings(ACTIONS_BUFFERED=True, ACTIONS_BUFFER_SIZE=100, ACTIONS_FLUSH_INTERVAL=3600)
+class BufferedActionTests(TestCase):
+    def setUp(self):
+        redis_client.r.flushdb()
+        self.user = User.objects.create_user('alice')
+        self.images = [make_image(self.user, f'Image {number}') for number in range(5)]
+
+    def buffered_verbs(self):
+        return [json.loads(item)['verb'] for item in redis_client.r.lrange(utils.BUFFER_KEY, 0, -1)]
+
+    def test_actions_wait_in_the_buffer(self):
+        self.assertTrue(utils.create_action(self.user, 'likes', self.images[0]))
+        self.assertFalse(Action.objects.exists())
+        self.assertEqual(self.buffered_verbs(), ['likes'])
+
+    def test_same_action_is_recorded_once_per_window(self):
+        self.assertTrue(utils.create_action(self.user, 'likes', self.images[0]))
+        self.assertFalse(utils.create_action(self.user, 'likes', self.images[0]))
+        self.assertTrue(utils.create_action(self.user, 'likes', self.images[1]))
+        self.assertEqual(len(self.buffered_verbs()), 2)
+
+    def test_same_action_is_recorded_again_after_the_window(self):
+        utils.create_action(self.user, 'likes', self.images[0])
+        [dedup_key] = redis_client.r.keys('action:dedup:*')
+        self.assertTrue(0 < redis_client.r.ttl(dedup_key) <= 60)
+        # the key expires at the end of the window
+        redis_client.r.delete(dedup_key)
+        self.assertTrue(utils.create_action(self.user, 'likes', self.images[0]))
+
+    def test_flush_writes_every_action_in_batches(self):
+        for image in self.images:
+            utils.create_action(self.user, f'likes {image.title}', image)
+        self.assertEqual(utils.flush_actions(batch_size=2), 5)
+        self.assertEqual(self.buffered_verbs(), [])
+        self.assertEqual(
+            set(Action.objects.values_list('verb', 'target_id')),
+            {(f'likes {image.title}', image.id) for image in self.images}
+        )
+        self.assertEqual(utils.flush_actions(), 0)
+
+    def test_flush_pushes_the_actions_of_a_user_at_once(self):
+        follower = User.objects.create_user('bob')
+        Contact.objects.create(user_from=follower, user_to=self.user)
+        for image in self.images:
+            utils.create_action(self.user, 'likes', image)
+        with mock.patch.object(feed, 'push_actions', wraps=feed.push_actions) as push_actions:
+            self.assertEqual(utils.flush_actions(), 5)
+        push_actions.assert_called_once()
+        self.assertEqual(len(feed.get_feed(follower, 10)), 5)
+
+    @override_settings(ACTIONS_BUFFER_SIZE=3)
+    def test_full_buffer_is_flushed(self):
+        for image in self.images[:3]:
+            utils.create_action(self.user, 'likes', image)
+        self.assertEqual(Action.objects.count(), 3)
+        self.assertEqual(self.buffered_verbs(), [])
+
+    def test_failed_flush_keeps_the_actions(self):
+        for image in self.images[:3]:
+            utils.create_action(self.user, f'likes {image.title}', image)
+        with mock.patch.object(Action.objects, 'bulk_create', side_effect=RuntimeError('database is down')):
+            with self.assertRaises(RuntimeError):
+                utils.flush_actions(batch_size=2)
+        # back at the head of the buffer, in their order
+        self.assertEqual(self.buffered_verbs(), ['likes Image 0', 'likes Image 1', 'likes Image 2'])
+        self.assertEqual(redis_client.r.zcard(utils.FLUSHING_KEY), 0)
+        self.assertEqual(utils.flush_actions(), 3)
+
+    def test_batch_of_a_dead_flush_is_written_after_the_timeout(self):
+        for image in self.images[:2]:
+            utils.create_action(self.user, 'likes', image)
+        # a flush that took the batch and never finished
+        utils._take_batch(10)
+        self.assertEqual(utils.flush_actions(), 0)
+        with override_settings(ACTIONS_FLUSH_TIMEOUT=0):
+            self.assertEqual(utils.flush_actions(), 2)
+
+    def test_actions_of_deleted_users_are_skipped(self):
+        other = User.objects.create_user('bob')
+        utils.create_action(other, 'likes', self.images[0])
+        utils.create_action(self.user, 'likes', self.images[0])
+        other.delete()
+        self.assertEqual(utils.flush_actions(), 1)
+
+    def test_action_that_waited_too_long_is_flushed(self):
+        utils.create_action(self.user, 'likes', self.images[0])
+        self.assertEqual(utils.flush_due_actions(), 0)
+        with override_settings(ACTIONS_FLUSH_INTERVAL=0):
+            self.assertEqual(utils.flush_due_actions(), 1)
+            # the next action finds the buffer due too
+            utils.create_action(self.user, 'likes', self.images[1])
+        self.assertEqual(Action.objects.count(), 2)
+
+
+class FeedTests(TestCase):
+    def setUp(self):
+        redis_client.r.flushdb()
+        # the cached users are deleted after the commit, which a TestCase never reaches
+        cache.clear()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.image = make_image(self.alice)
+
+    def follow(self, action):
+        self.client.force_login(self.bob)
+        response = self.client.post(reverse('user_follow'), {'id': self.alice.id, 'action': action})
+        self.assertEqual(response.json()['status'], 'ok')
+
+    def test_new_action_is_pushed_to_the_followers(self):
+        Contact.objects.create(user_from=self.bob, user_to=self.alice)
+        utils.create_action(self.alice, 'likes', self.image)
+        action = Action.objects.get(user=self.alice)
+        self.assertEqual(feed.get_feed(self.bob, 10), [action.id])
+        # alice doesn't follow anybody
+        self.assertEqual(feed.get_feed(self.alice, 10), [])
+
+    def test_follow_seeds_the_timeline(self):
+        utils.create_action(self.alice, 'likes', self.image)
+        utils.create_action(self.alice, 'bookmarked image', self.image)
+        expected = list(Action.objects.filter(user=self.alice).values_list('id', flat=True))
+        self.follow('follow')
+        self.assertEqual(feed.get_feed(self.bob, 10), expected)
+
+    def test_unfollow_removes_the_actions(self):
+        self.follow('follow')
+        utils.create_action(self.alice, 'likes', self.image)
+        self.assertEqual(len(feed.get_feed(self.bob, 10)), 1)
+        self.follow('unfollow')
+        self.assertEqual(feed.get_feed(self.bob, 10), [])
+        # and the next actions of alice don't reach bob
+        utils.create_action(self.alice, 'bookmarked image', self.image)
+        self.assertEqual(feed.get_feed(self.bob, 10), [])
+
+    @override_settings(FEED_FANOUT_MAX_FOLLOWERS=0)
+    def test_actions_of_popular_users_are_merged_when_read(self):
+        self.follow('follow')
+        utils.create_action(self.alice, 'likes', self.image)
+        action = Action.objects.get(user=self.alice)
+        # not pushed to the timeline, read from the database
+        self.assertEqual(redis_client.r.zcard(feed.feed_key(self.bob.id)), 0)
+        self.assertEqual(feed.get_feed(self.bob, 10), [action.id])
@@ -1,7 +1,23 @@
 import datetime
+import json
+import time
+import uuid
+from collections import defaultdict
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from bookmarks import redis_client
+from bookmarks.redis_client import RedisUnavailable
 from .models import Action
+from . import feed
+
+# New actions are appended to this Redis list and written to the database in batches by flush_actions()
+BUFFER_KEY = 'actions:buffer'
+# The batches being written (see flush_actions()), with the time they were taken from the buffer
+FLUSHING_KEY = 'actions:flushing'
 
 
 # The create_action() function allows you to create actions that optionally include a target object.
@@ -10,30 +26,114 @@ from .models import Action
 # verb: A string describing what the user did (e.g., "liked", "commented on")
 # target: Optional object that received the action (e.g., a photo that was liked)
 def create_action(user, verb, target=None):
+    # get_for_model() is served from the ContentType cache after the first call
+    target_ct = ContentType.objects.get_for_model(target) if target else None
+    target_id = target.id if target else None
+
+    if not settings.ACTIONS_BUFFERED:
+        return create_action_now(user, verb, target_ct, target_id)
+
+    # check for any similar action made in the last minute:
+    # SET ... NX EX 60 only succeeds if the key doesn't exist, so the first call in the window
+    # creates the key (and the action) and every similar call within 60 seconds is ignored.
+    # This is a single atomic Redis command instead of a SELECT on the Action table.
+    dedup_key = _dedup_key(user, verb, target_ct, target_id)
+    try:
+        if not redis_client.r.set(dedup_key, 1, nx=True, ex=settings.ACTIONS_DEDUP_WINDOW):
+            return False
+
+        # Queue the action instead of inserting it right away; flush_actions() writes it with bulk_create().
+        # The oldest buffered action comes back in the same round trip, to check how long it has waited.
+        pipe = redis_client.r.pipeline(transaction=False)
+        pipe.rpush(BUFFER_KEY, _buffered_action(user, verb, target_ct, target_id))
+        pipe.lindex(BUFFER_KEY, 0)
+        buffered, oldest = pipe.execute()
+    except RedisUnavailable:
+        # without Redis the action is written right away, deduplicated by the database
+        return create_action_now(user, verb, target_ct, target_id)
+    if buffered >= settings.ACTIONS_BUFFER_SIZE or _flush_due(oldest):
+        # the buffer is full, or its first action has waited long enough: write it now
+        flush_actions()
+    return True
+
+
+def _dedup_key(user, verb, target_ct, target_id):
+    return f'action:dedup:{user.id}:{verb}:{target_ct.id if target_ct else ""}:{target_id or ""}'
+
+
+def _buffered_action(user, verb, target_ct, target_id):
+    return json.dumps({
+        'user_id': user.id,
+        'verb': verb,
+        'target_ct_id': target_ct.id if target_ct else None,
+        'target_id': target_id,
+        'created': timezone.now().isoformat(),
+    })
+
+
+def _flush_due(oldest):
+    # On a quiet site the buffer takes hours to fill: an action that waited ACTIONS_FLUSH_INTERVAL seconds
+    # is written with the next action (or the next dashboard, see flush_due_actions()) instead
+    if oldest is None:
+        return False
+    waited = timezone.now() - parse_datetime(json.loads(oldest)['created'])
+    return waited >= datetime.timedelta(seconds=settings.ACTIONS_FLUSH_INTERVAL)
+
+
+async def acreate_action(user, verb, target=None):
+    """
+    Async version of create_action() for the async views: the dedup key and the buffer use the async Redis client.
+    """
+    target_ct = await sync_to_async(ContentType.objects.get_for_model)(target) if target else None
+    target_id = target.id if target else None
+
+    if not settings.ACTIONS_BUFFERED:
+        return await sync_to_async(create_action_now)(user, verb, target_ct, target_id)
+
+    client = redis_client.get_async_client()
+    try:
+        if not await client.set(
+            _dedup_key(user, verb, target_ct, target_id), 1, nx=True, ex=settings.ACTIONS_DEDUP_WINDOW
+        ):
+            return False
+        pipe = client.pipeline(transaction=False)
+        pipe.rpush(BUFFER_KEY, _buffered_action(user, verb, target_ct, target_id))
+        pipe.lindex(BUFFER_KEY, 0)
+        buffered, oldest = await pipe.execute()
+    except RedisUnavailable:
+        return await sync_to_async(create_action_now)(user, verb, target_ct, target_id)
+    if buffered >= settings.ACTIONS_BUFFER_SIZE or _flush_due(oldest):
+        await sync_to_async(flush_actions)()
+    return True
+
+
+def create_action_now(user, verb, target_ct=None, target_id=None):
+    """
+    Synchronous version of create_action() used when ACTIONS_BUFFERED is False (for example in tests).
+    """
     # check for any similar action made in the last minute
     now = timezone.now()
-    last_minute = now - datetime.timedelta(seconds=60)
+    last_minute = now - datetime.timedelta(seconds=settings.ACTIONS_DEDUP_WINDOW)
     similar_actions = Action.objects.filter(
         user_id=user.id,
         verb=verb,
+        target_ct=target_ct,
+        target_id=target_id,
         created__gte=last_minute
         # created__gte=last_minute:
         # This part of the query is using Django’s ORM lookup syntax. The __gte stands for "greater than or equal to."
         # It means that the query will return all Action records whose created timestamp is later than or equal to last_minute.
     )
-    if target:
-        target_ct = ContentType.objects.get_for_model(target)
-        similar_actions = similar_actions.filter(
-            target_ct=target_ct,
-            target_id=target.id
-        )
-    if not similar_actions:
+    if not similar_actions.exists():
         # no existing actions found
-        action = Action(user=user, verb=verb, target=target)
+        action = Action(user=user, verb=verb, target_ct=target_ct, target_id=target_id)
         action.save()
+        # push the new action into the timeline of every follower
+        feed.push_action(action)
         return True
     return False
 
+
 # Explanation of the above code:
 # The previous click is recorded and remains in the database.
 # Every time the function is called, it checks if there's any Action record in the last minute that matches the user,
@@ -46,6 +146,107 @@ def create_action(user, verb, target=None):
 # After the one-minute window, even if the action details (user, verb, target) are the same, the new record is treated
 # as a separate event because its timestamp is outside the window of the previous record.
 #
+# With ACTIONS_BUFFERED the same one-minute window is enforced by the expiry of the Redis dedup key.
+#
 # This mechanism helps to prevent accidental multiple clicks (like double-clicks) from creating duplicate actions,
 # while still allowing a new action to be recorded if enough time has passed.
 
+
+# A batch is never removed from Redis before it is in the database. flush_actions() moves it to a list of its own
+# (LMOVE, one MULTI/EXEC transaction, so two flushing processes never take the same action) and deletes that list
+# only after bulk_create(). If the insert fails, the batch goes back to the head of the buffer; if the process
+# dies, the next flush puts it back once it has been taken for ACTIONS_FLUSH_TIMEOUT seconds.
+# (A process that dies between bulk_create() and the delete has its batch written twice: better than lost.)
+
+def _take_batch(batch_size):
+    batch_key = f'{BUFFER_KEY}:batch:{uuid.uuid4().hex}'
+    pipe = redis_client.r.pipeline()
+    pipe.zadd(FLUSHING_KEY, {batch_key: time.time()})
+    for _ in range(batch_size):
+        pipe.lmove(BUFFER_KEY, batch_key, 'LEFT', 'RIGHT')
+    pipe.lrange(batch_key, 0, -1)
+    items = pipe.execute()[-1]
+    if not items:
+        redis_client.r.zrem(FLUSHING_KEY, batch_key)
+    return batch_key, items
+
+
+def _requeue_batch(batch_key):
+    # moved from the tail of the batch to the head of the buffer one by one, so the order is kept
+    pipe = redis_client.r.pipeline()
+    for _ in range(redis_client.r.llen(batch_key)):
+        pipe.lmove(batch_key, BUFFER_KEY, 'RIGHT', 'LEFT')
+    pipe.delete(batch_key)
+    pipe.zrem(FLUSHING_KEY, batch_key)
+    pipe.execute()
+
+
+def _requeue_stale_batches():
+    stale = redis_client.r.zrangebyscore(FLUSHING_KEY, 0, time.time() - settings.ACTIONS_FLUSH_TIMEOUT)
+    for batch_key in stale:
+        _requeue_batch(batch_key)
+
+
+def flush_actions(batch_size=None):
+    """
+    Write the buffered actions to the database in batches and return how many were written.
+    """
+    batch_size = batch_size or settings.ACTIONS_BUFFER_SIZE
+    _requeue_stale_batches()
+    total = 0
+    while True:
+        batch_key, items = _take_batch(batch_size)
+        if not items:
+            return total
+
+        try:
+            actions = _write_batch([json.loads(item) for item in items])
+        except Exception:
+            _requeue_batch(batch_key)
+            raise
+        pipe = redis_client.r.pipeline()
+        pipe.delete(batch_key)
+        pipe.zrem(FLUSHING_KEY, batch_key)
+        pipe.execute()
+
+        # one push per user: its follower query and ZADDs are shared by all the actions of the user in the batch
+        by_user = defaultdict(list)
+        for action in actions:
+            by_user[action.user_id].append(action)
+        for user_id, user_actions in by_user.items():
+            feed.push_actions(user_id, user_actions)
+        total += len(actions)
+        if len(items) < batch_size:
+            return total
+
+
+def _write_batch(items):
+    # skip the actions of users deleted while the action was waiting in the buffer
+    user_ids = set(get_user_model().objects.filter(
+        id__in={item['user_id'] for item in items}
+    ).values_list('id', flat=True))
+    return Action.objects.bulk_create([
+        Action(
+            user_id=item['user_id'],
+            verb=item['verb'],
+            target_ct_id=item['target_ct_id'],
+            target_id=item['target_id'],
+            created=parse_datetime(item['created']),
+        )
+        for item in items if item['user_id'] in user_ids
+    ])
+
+
+def flush_due_actions():
+    """
+    Flush the buffer if its oldest action has waited ACTIONS_FLUSH_INTERVAL seconds. Called by the dashboard, so
+    the last actions of a quiet site show up even when nothing else flushes the buffer.
+    """
+    if not settings.ACTIONS_BUFFERED:
+        return 0
+    try:
+        if _flush_due(redis_client.r.lindex(BUFFER_KEY, 0)):
+            return flush_actions()
+    except RedisUnavailable:
+        pass
+    return 0
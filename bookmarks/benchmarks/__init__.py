@@ -0,0 +1,117 @@
+"""
+Benchmarks for the bookmarks project.
+
+Run them from the directory that contains manage.py, for example:
+
+    python -m benchmarks.slugs --count 5000
+
+    python -m benchmarks.load --users 10000 --requests 500 --concurrency 8
+
+    python -m benchmarks.asgi --users 2000 --threads 4 --concurrency 32 --redis-latency 1
+
+Every benchmark runs against a throw-away test database, never against db.sqlite3.
+"""
+import os
+import threading
+
+
+def setup_django(database_name=None, keepdb=False):
+    """
+    Configure Django and create an empty test database for the benchmark.
+    database_name stores the test database in a file (needed when requests run in several threads);
+    with keepdb=True an existing file is reused and kept, so big data sets are generated only once.
+    Returns a function that destroys the test database.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bookmarks.settings')
+    # measure the production middleware: without DEBUG the debug toolbar isn't installed (see settings.py)
+    os.environ.setdefault('DEBUG', 'False')
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    # DEBUG=False: no query log in the measurements
+    setup_test_environment(debug=False)
+    old_name = connection.settings_dict['NAME']
+    if database_name:
+        connection.settings_dict['TEST']['NAME'] = database_name
+    connection.creation.create_test_db(verbosity=0, keepdb=keepdb)
+
+    def teardown():
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+
+    return teardown
+
+
+def use_fake_redis():
+    """
+    Point the shared Redis client of the project to a single in-memory fakeredis server and replace the cache
+    with a local-memory cache, so the benchmarks don't need (or touch) a Redis server.
+    """
+    try:
+        import fakeredis
+    except ImportError:
+        raise SystemExit('The fake Redis server needs fakeredis: pip install -r requirements-dev.txt')
+    from django.test.utils import override_settings
+
+    from bookmarks import redis_client
+
+    server = fakeredis.FakeServer()
+    # the clients of bookmarks/redis_client.py (circuit breaker included) on the connections of fakeredis
+    redis_client.r = redis_client.Redis(connection_pool=fakeredis.FakeRedis(server=server).connection_pool)
+    # the async views see the same data through an async client of the same fake server
+    redis_client.connect_async = lambda: redis_client.AsyncRedis(
+        connection_pool=fakeredis.FakeAsyncRedis(server=server).connection_pool
+    )
+    override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    }).enable()
+    return redis_client.r
+
+
+class QueryCounter:
+    """
+    Count the SQL queries sent through a connection (use with connection.execute_wrapper()).
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class RedisCounter:
+    """
+    Count the round trips to Redis made by the current thread: one per command, one per pipeline.
+    """
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+    def add(self):
+        self._local.count = self.count + 1
+
+    def install(self):
+        from redis.client import Pipeline, Redis
+
+        counter = self
+        execute_command = Redis.execute_command
+        execute_pipeline = Pipeline.execute
+
+        def counted_command(self, *args, **options):
+            counter.add()
+            return execute_command(self, *args, **options)
+
+        def counted_pipeline(self, *args, **options):
+            if self.command_stack:
+                counter.add()
+            return execute_pipeline(self, *args, **options)
+
+        Redis.execute_command = counted_command
+        Pipeline.execute = counted_pipeline
+
@@ -0,0 +1,173 @@
+"""
+Requests per second of one worker serving the hot endpoints through WSGI and through ASGI.
+
+    python -m benchmarks.asgi --users 2000 --requests 500 --threads 4 --concurrency 32 --redis-latency 1
+
+WSGI: the sync views, served by a pool of --threads threads (like a gunicorn gthread worker).
+ASGI: the async views (ASYNC_VIEWS, see bookmarks/asgi.py), served by one event loop with --concurrency requests
+in flight (like a uvicorn worker).
+
+The fake Redis server answers in microseconds, so --redis-latency adds a delay to every round trip, like the
+network between the web servers and Redis does in production. That wait is what the async views overlap.
+"""
+import argparse
+import asyncio
+import importlib
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from . import RedisCounter, setup_django, use_fake_redis
+from . import data
+from .load import Scenario, run_endpoint
+
+ENDPOINTS = ['image_detail', 'image_like', 'image_ranking', 'user_follow']
+
+
+def add_redis_latency(seconds):
+    """
+    Make every Redis command and pipeline of the sync and async clients wait `seconds` first.
+    """
+    from redis.asyncio.client import Pipeline as AsyncPipeline, Redis as AsyncRedis
+    from redis.client import Pipeline, Redis
+
+    execute_command = Redis.execute_command
+    execute_pipeline = Pipeline.execute
+    async_execute_command = AsyncRedis.execute_command
+    async_execute_pipeline = AsyncPipeline.execute
+
+    def slow_command(self, *args, **options):
+        time.sleep(seconds)
+        return execute_command(self, *args, **options)
+
+    def slow_pipeline(self, *args, **options):
+        time.sleep(seconds)
+        return execute_pipeline(self, *args, **options)
+
+    async def slow_async_command(self, *args, **options):
+        await asyncio.sleep(seconds)
+        return await async_execute_command(self, *args, **options)
+
+    async def slow_async_pipeline(self, *args, **options):
+        await asyncio.sleep(seconds)
+        return await async_execute_pipeline(self, *args, **options)
+
+    Redis.execute_command = slow_command
+    Pipeline.execute = slow_pipeline
+    AsyncRedis.execute_command = slow_async_command
+    AsyncPipeline.execute = slow_async_pipeline
+
+
+def use_async_views(enabled):
+    """
+    Switch the URLs between the sync and the async views in this process.
+    The URL modules read ASYNC_VIEWS when they are imported, so they are imported again.
+    """
+    from django.test.utils import override_settings
+    from django.urls import clear_url_caches
+
+    override_settings(ASYNC_VIEWS=enabled).enable()
+    for name in ['images.urls', 'account.urls', 'bookmarks.urls']:
+        importlib.reload(importlib.import_module(name))
+    clear_url_caches()
+
+
+async def async_worker(scenario, endpoint, count, warmup, seed, results):
+    from django.contrib.auth import get_user_model
+    from django.test import AsyncClient
+
+    rnd = random.Random(seed)
+    client = AsyncClient()
+    await client.aforce_login(await get_user_model().objects.aget(id=rnd.choice(scenario.user_ids)))
+    for i in range(warmup + count):
+        started = time.perf_counter()
+        try:
+            response = await scenario.request(endpoint, client, rnd)
+            failed = response.status_code >= 400
+        except Exception:
+            failed = True
+        if i >= warmup:
+            results.append((time.perf_counter() - started, failed))
+
+
+async def run_async_endpoint(scenario, endpoint, requests, concurrency, warmup):
+    results = []
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        async_worker(scenario, endpoint, requests // concurrency + (i < requests % concurrency), warmup, i, results)
+        for i in range(concurrency)
+    ])
+    wall = time.perf_counter() - started
+
+    latencies = [elapsed * 1000 for elapsed, failed in results]
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {
+        'requests': len(results),
+        'errors': sum(failed for elapsed, failed in results),
+        'p50': percentiles[49],
+        'p95': percentiles[94],
+        # warmup requests are included in the wall time, so this is slightly pessimistic
+        'rps': len(results) / wall if wall else 0,
+    }
+
+
+def print_report(wsgi, asgi):
+    print(f'{"endpoint":<14} {"WSGI req/s":>10} {"ASGI req/s":>10} {"speedup":>8} '
+          f'{"WSGI p95":>9} {"ASGI p95":>9} {"errors":>8}')
+    for endpoint in wsgi:
+        w, a = wsgi[endpoint], asgi[endpoint]
+        speedup = a['rps'] / w['rps'] if w['rps'] else 0
+        print(f'{endpoint:<14} {w["rps"]:>10.1f} {a["rps"]:>10.1f} {speedup:>7.2f}x '
+              f'{w["p95"]:>9.1f} {a["p95"]:>9.1f} {w["errors"]:>3}/{a["errors"]:<4}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    data.add_arguments(parser)
+    parser.add_argument('--database', help='SQLite file of a data set kept by a previous run (or to keep)')
+    parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=ENDPOINTS)
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per endpoint and server')
+    parser.add_argument('--warmup', type=int, default=2, help='unmeasured requests per thread/task and endpoint')
+    parser.add_argument('--threads', type=int, default=4, help='threads of the WSGI worker')
+    parser.add_argument('--concurrency', type=int, default=32, help='requests in flight in the ASGI worker')
+    parser.add_argument('--redis-latency', type=float, default=1.0, help='milliseconds added to every Redis round trip')
+    args = parser.parse_args()
+
+    # the threads need a database file: an in-memory SQLite database is private to one connection
+    tmp_dir = None
+    database = args.database
+    if not database:
+        tmp_dir = tempfile.TemporaryDirectory()
+        database = os.path.join(tmp_dir.name, 'benchmark.sqlite3')
+    teardown = setup_django(database, keepdb=bool(args.database))
+    try:
+        use_fake_redis()
+        data.generate_from_args(args)
+        if args.redis_latency:
+            add_redis_latency(args.redis_latency / 1000)
+        scenario = Scenario()
+
+        use_async_views(False)
+        redis_counter = RedisCounter()
+        wsgi = {
+            endpoint: run_endpoint(scenario, endpoint, args.requests, args.threads, args.warmup, redis_counter)
+            for endpoint in args.endpoints
+        }
+
+        use_async_views(True)
+        asgi = {}
+        for endpoint in args.endpoints:
+            asgi[endpoint] = asyncio.run(
+                run_async_endpoint(scenario, endpoint, args.requests, args.concurrency, args.warmup)
+            )
+        print_report(wsgi, asgi)
+    finally:
+        teardown()
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
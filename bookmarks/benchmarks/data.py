@@ -0,0 +1,220 @@
+"""
+Synthetic data for the benchmarks: users, profiles, contacts, images, likes, actions, feeds and views.
+
+Rows are written with bulk_create() in batches and explicit ids, so millions of rows take minutes, not hours.
+bulk_create() doesn't send signals, so the values the signals normally maintain (profiles, follow counts,
+like counts, the search index, feeds) are computed afterwards in bulk.
+
+    python -m benchmarks.data --users 1000000 --database /tmp/bench.sqlite3
+
+With --database the data is kept in that file and `python -m benchmarks.load --database ...` reuses it.
+"""
+import argparse
+import datetime
+import io
+import random
+import time
+
+from . import setup_django, use_fake_redis
+
+PASSWORD = 'benchmark'
+
+
+def batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def insert(model, rows, batch_size):
+    total = 0
+    for batch in batched(rows, batch_size):
+        model.objects.bulk_create(batch, batch_size=batch_size)
+        total += len(batch)
+    return total
+
+
+def next_id(model):
+    from django.db.models import Max
+    return (model.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+
+
+def random_moment(now, days=30):
+    return now - datetime.timedelta(seconds=random.randrange(days * 24 * 3600))
+
+
+def generate(users=1000, images_per_user=5, follows_per_user=20, likes_per_image=10, actions_per_user=10,
+             batch_size=5000, seed=42, log=print):
+    """
+    Add a synthetic data set to the database and return the number of rows created per table.
+    """
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.hashers import make_password
+    from django.contrib.contenttypes.models import ContentType
+    from django.core.management import call_command
+    from django.db import transaction
+    from django.db.models import Count, OuterRef, Subquery
+    from django.db.models.functions import Coalesce
+    from django.utils import timezone
+
+    from account.models import Contact, Profile
+    from actions.models import Action
+    from images import search
+    from images.models import Image
+
+    User = get_user_model()
+    random.seed(seed)
+    now = timezone.now()
+    # hashing a password takes ~100ms on purpose, so every user gets the same hash
+    password = make_password(PASSWORD)
+    created = {}
+
+    def step(name, function):
+        started = time.perf_counter()
+        with transaction.atomic():
+            created[name] = function()
+        log(f'{name:>10}: {created[name]:>10} rows in {time.perf_counter() - started:.1f}s')
+
+    first_user = next_id(User)
+    user_ids = range(first_user, first_user + users)
+    step('users', lambda: insert(User, (
+        User(id=user_id, username=f'user{user_id}', first_name=f'User {user_id}', password=password,
+             email=f'user{user_id}@example.com', date_joined=random_moment(now, 365))
+        for user_id in user_ids
+    ), batch_size))
+    step('profiles', lambda: insert(Profile, (Profile(user_id=user_id) for user_id in user_ids), batch_size))
+
+    def contacts():
+        for user_id in user_ids:
+            # one extra user in case the sample contains the user itself
+            sample = random.sample(user_ids, min(follows_per_user + 1, users))
+            for followed in [followed for followed in sample if followed != user_id][:follows_per_user]:
+                yield Contact(user_from_id=user_id, user_to_id=followed, created=random_moment(now))
+    step('contacts', lambda: insert(Contact, contacts(), batch_size))
+
+    first_image = next_id(Image)
+    image_ids = range(first_image, first_image + users * images_per_user)
+    step('images', lambda: insert(Image, (
+        Image(id=image_id, user_id=user_ids[(image_id - first_image) % users], title=f'Image {image_id}',
+              slug=f'image-{image_id}', url=f'https://example.com/{image_id}.jpg',
+              description=random.choice(['sunset over the sea', 'city at night', 'mountain trail', '']))
+        for image_id in image_ids
+    ), batch_size))
+
+    Like = Image.users_like.through
+
+    def likes():
+        for image_id in image_ids:
+            for user_id in random.sample(user_ids, min(likes_per_image, users)):
+                yield Like(image_id=image_id, user_id=user_id)
+    step('likes', lambda: insert(Like, likes(), batch_size))
+
+    image_ct = ContentType.objects.get_for_model(Image)
+    user_ct = ContentType.objects.get_for_model(User)
+
+    def actions():
+        for user_id in user_ids:
+            for _ in range(actions_per_user):
+                if random.random() < 0.2:
+                    yield Action(user_id=user_id, verb='is following', created=random_moment(now),
+                                 target_ct=user_ct, target_id=random.choice(user_ids))
+                else:
+                    verb = random.choice(['bookmarked image', 'likes'])
+                    yield Action(user_id=user_id, verb=verb, created=random_moment(now),
+                                 target_ct=image_ct, target_id=random.choice(image_ids))
+    step('actions', lambda: insert(Action, actions(), batch_size))
+
+    # the counters the signals keep up to date
+    def counters():
+        def contact_count(field):
+            return Coalesce(Subquery(
+                Contact.objects.filter(**{field: OuterRef('user_id')}).order_by().values(field).annotate(
+                    total=Count('id')
+                ).values('total')
+            ), 0)
+        Profile.objects.filter(user_id__gte=first_user).update(
+            followers_count=contact_count('user_to'), following_count=contact_count('user_from')
+        )
+        call_command('reconcile_likes', stdout=io.StringIO())
+        return users
+    step('counters', counters)
+    step('search', lambda: search.get_backend().rebuild())
+    return created
+
+
+def generate_redis(views=10000, feeds=True, seed=42, log=print):
+    """
+    Fill the Redis data of the rows in the database: follower timelines and view leaderboards.
+    The fake Redis server lives in memory, so this runs again every time a kept database is reused.
+    """
+    from django.core.management import call_command
+
+    from bookmarks import redis_client
+    from images import ranking
+    from images.models import Image
+
+    random.seed(seed)
+    if feeds:
+        started = time.perf_counter()
+        call_command('backfill_feeds', stdout=io.StringIO())
+        log(f'{"feeds":>10}: built in {time.perf_counter() - started:.1f}s')
+
+    image_ids = list(Image.objects.values_list('id', flat=True))
+    if not image_ids:
+        return
+    # half of the views go to 1% of the images
+    hot_ids = image_ids[:max(len(image_ids) // 100, 1)]
+    with redis_client.batch(5000) as pipe:
+        for i in range(views):
+            ranking.add_view(pipe, random.choice(hot_ids if i % 2 else image_ids))
+    log(f'{"views":>10}: {views:>10} recorded')
+
+
+def add_arguments(parser):
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--images-per-user', type=int, default=5)
+    parser.add_argument('--follows-per-user', type=int, default=20)
+    parser.add_argument('--likes-per-image', type=int, default=10)
+    parser.add_argument('--actions-per-user', type=int, default=10)
+    parser.add_argument('--views', type=int, default=10000, help='views recorded in the Redis leaderboards')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--skip-feeds', action='store_true', help="don't build the follower timelines")
+    parser.add_argument('--seed', type=int, default=42)
+
+
+def generate_from_args(args):
+    """
+    Generate the rows unless the database already has users (a kept database), then the Redis data.
+    """
+    from django.contrib.auth import get_user_model
+
+    if not get_user_model().objects.exists():
+        generate(
+            users=args.users, images_per_user=args.images_per_user, follows_per_user=args.follows_per_user,
+            likes_per_image=args.likes_per_image, actions_per_user=args.actions_per_user,
+            batch_size=args.batch_size, seed=args.seed,
+        )
+    generate_redis(views=args.views, feeds=not args.skip_feeds, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    parser.add_argument('--database', help='SQLite file to keep the data in')
+    args = parser.parse_args()
+
+    teardown = setup_django(args.database, keepdb=bool(args.database))
+    try:
+        use_fake_redis()
+        generate_from_args(args)
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
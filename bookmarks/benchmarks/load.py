@@ -0,0 +1,204 @@
+"""
+Load test of the hot endpoints: latency percentiles, throughput and SQL/Redis round trips per request.
+
+    python -m benchmarks.load --users 2000 --requests 500 --concurrency 8
+    python -m benchmarks.load --save-baseline benchmarks/baseline.json
+    python -m benchmarks.load --baseline benchmarks/baseline.json --tolerance 0.25
+
+The requests go through the Django test client from several threads, against a synthetic data set
+(benchmarks/data.py) in an SQLite test database and an in-memory fake Redis server. With --baseline the run
+fails (exit code 1) when an endpoint got slower than the baseline p95 by more than --tolerance, or when it
+makes more SQL queries or Redis round trips per request.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from . import QueryCounter, RedisCounter, setup_django, use_fake_redis
+from . import data
+
+ENDPOINTS = ['image_detail', 'image_like', 'image_list', 'image_ranking', 'dashboard', 'user_follow']
+
+
+class Scenario:
+    """
+    The ids the requests pick from, loaded once before the run.
+    """
+    def __init__(self, sample_size=10000):
+        from django.contrib.auth import get_user_model
+        from images.models import Image
+
+        self.user_ids = list(
+            get_user_model().objects.order_by('?').values_list('id', flat=True)[:sample_size]
+        )
+        self.images = list(Image.objects.order_by('?').values_list('id', 'slug')[:sample_size])
+
+    def request(self, endpoint, client, rnd):
+        from django.urls import reverse
+
+        if endpoint == 'image_detail':
+            image_id, slug = rnd.choice(self.images)
+            return client.get(reverse('images:detail', args=[image_id, slug]))
+        if endpoint == 'image_like':
+            image_id, slug = rnd.choice(self.images)
+            return client.post(reverse('images:like'), {'id': image_id, 'action': rnd.choice(['like', 'unlike'])})
+        if endpoint == 'image_list':
+            return client.get(reverse('images:list'))
+        if endpoint == 'image_ranking':
+            return client.get(reverse('images:ranking'), {'window': rnd.choice(['day', 'week', 'all'])})
+        if endpoint == 'dashboard':
+            return client.get(reverse('dashboard'))
+        if endpoint == 'user_follow':
+            return client.post(
+                reverse('user_follow'), {'id': rnd.choice(self.user_ids), 'action': rnd.choice(['follow', 'unfollow'])}
+            )
+        raise ValueError(f'Unknown endpoint {endpoint}')
+
+
+def worker(scenario, endpoint, count, warmup, seed, redis_counter, results):
+    from django.contrib.auth import get_user_model
+    from django.db import connection
+    from django.test import Client
+
+    rnd = random.Random(seed)
+    client = Client()
+    client.force_login(get_user_model().objects.get(id=rnd.choice(scenario.user_ids)))
+    for i in range(warmup + count):
+        queries = QueryCounter()
+        redis_calls = redis_counter.count
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(queries):
+                response = scenario.request(endpoint, client, rnd)
+            failed = response.status_code >= 400
+        except Exception:
+            failed = True
+        elapsed = time.perf_counter() - started
+        if i >= warmup:
+            results.append((elapsed, queries.count, redis_counter.count - redis_calls, failed))
+    # every thread has its own database connection
+    connection.close()
+
+
+def run_endpoint(scenario, endpoint, requests, concurrency, warmup, redis_counter):
+    results = []
+    threads = [
+        threading.Thread(
+            target=worker,
+            args=(scenario, endpoint, requests // concurrency + (i < requests % concurrency), warmup, i,
+                  redis_counter, results)
+        )
+        for i in range(concurrency)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies = [elapsed * 1000 for elapsed, queries, redis_calls, failed in results]
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {
+        'requests': len(results),
+        'errors': sum(failed for elapsed, queries, redis_calls, failed in results),
+        'p50': percentiles[49],
+        'p95': percentiles[94],
+        'p99': percentiles[98],
+        # warmup requests are included in the wall time, so this is slightly pessimistic
+        'rps': len(results) / wall if wall else 0,
+        'queries': statistics.mean(queries for elapsed, queries, redis_calls, failed in results),
+        'redis': statistics.mean(redis_calls for elapsed, queries, redis_calls, failed in results),
+    }
+
+
+def print_report(report):
+    print(f'{"endpoint":<14} {"requests":>8} {"errors":>6} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} '
+          f'{"req/s":>8} {"SQL/req":>8} {"Redis/req":>9}')
+    for endpoint, stats in report.items():
+        print(f'{endpoint:<14} {stats["requests"]:>8} {stats["errors"]:>6} {stats["p50"]:>8.1f} '
+              f'{stats["p95"]:>8.1f} {stats["p99"]:>8.1f} {stats["rps"]:>8.1f} {stats["queries"]:>8.1f} '
+              f'{stats["redis"]:>9.1f}')
+
+
+def compare(report, baseline, tolerance):
+    """
+    Return the list of regressions of report compared to baseline.
+    """
+    regressions = []
+    for endpoint, stats in report.items():
+        base = baseline.get(endpoint)
+        if base is None:
+            continue
+        if stats['p95'] > base['p95'] * (1 + tolerance):
+            regressions.append(f'{endpoint}: p95 {stats["p95"]:.1f}ms > baseline {base["p95"]:.1f}ms')
+        # the counts vary a little between requests (like/unlike, follow/unfollow), hence the half query
+        for key, label in [('queries', 'SQL queries'), ('redis', 'Redis round trips')]:
+            if stats[key] > base[key] + 0.5:
+                regressions.append(f'{endpoint}: {stats[key]:.1f} {label}/request > baseline {base[key]:.1f}')
+        if stats['errors'] > base.get('errors', 0):
+            regressions.append(f'{endpoint}: {stats["errors"]} errors > baseline {base.get("errors", 0)}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    data.add_arguments(parser)
+    parser.add_argument('--database', help='SQLite file of a data set kept by a previous run (or to keep)')
+    parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=ENDPOINTS)
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=5, help='unmeasured requests per thread and endpoint')
+    parser.add_argument('--concurrency', type=int, default=4, help='threads sending requests')
+    parser.add_argument('--baseline', help='JSON report to compare the run with')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p95 slowdown, 0.25 = 25%%')
+    parser.add_argument('--save-baseline', help='write the JSON report of this run to this file')
+    args = parser.parse_args()
+
+    # the threads need a database file: an in-memory SQLite database is private to one connection
+    tmp_dir = None
+    database = args.database
+    if not database:
+        tmp_dir = tempfile.TemporaryDirectory()
+        database = os.path.join(tmp_dir.name, 'benchmark.sqlite3')
+    teardown = setup_django(database, keepdb=bool(args.database))
+    try:
+        use_fake_redis()
+        redis_counter = RedisCounter()
+        redis_counter.install()
+        data.generate_from_args(args)
+
+        scenario = Scenario()
+        report = {}
+        for endpoint in args.endpoints:
+            report[endpoint] = run_endpoint(
+                scenario, endpoint, args.requests, args.concurrency, args.warmup, redis_counter
+            )
+        print_report(report)
+    finally:
+        teardown()
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f'Saved the baseline to {args.save_baseline}.')
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print('Regressions:')
+            for regression in regressions:
+                print(f'  {regression}')
+            sys.exit(1)
+        print('No regression compared to the baseline.')
+
+
+if __name__ == '__main__':
+    main()
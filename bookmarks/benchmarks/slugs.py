@@ -0,0 +1,66 @@
+"""
+Insert thousands of images with the same title and report how the cost of a save() grows.
+
+    python -m benchmarks.slugs --count 5000
+    python -m benchmarks.slugs --count 1000 --legacy    # the old one-query-per-suffix loop
+"""
+import argparse
+import time
+
+from . import QueryCounter, setup_django, use_fake_redis
+
+
+def legacy_slug(Image, title):
+    # The slug loop Image.save() used before ImageSlugCounter: one query per taken suffix.
+    from django.utils.text import slugify
+
+    base_slug = slugify(title)
+    counter = 1
+    while Image.objects.filter(slug=base_slug).exists():
+        base_slug = f'{base_slug}-{counter}'
+        counter += 1
+    return base_slug
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=5000, help='number of images to insert')
+    parser.add_argument('--report-every', type=int, default=1000)
+    parser.add_argument('--legacy', action='store_true', help='use the old slug loop for comparison')
+    args = parser.parse_args()
+
+    teardown = setup_django()
+    try:
+        use_fake_redis()
+        from django.contrib.auth import get_user_model
+        from django.db import connection
+        from images.models import Image
+
+        user = get_user_model().objects.create_user('benchmark')
+        counter = QueryCounter()
+        started = batch_started = time.perf_counter()
+        batch_queries = 0
+        with connection.execute_wrapper(counter):
+            for i in range(1, args.count + 1):
+                image = Image(user=user, title='Same title', url='https://example.com/image.jpg')
+                if args.legacy:
+                    image.slug = legacy_slug(Image, image.title)
+                image.save()
+                if i % args.report_every == 0 or i == args.count:
+                    elapsed = time.perf_counter() - batch_started
+                    inserted = (i - 1) % args.report_every + 1
+                    print(
+                        f'{i:>8} images  {inserted / elapsed:>9.1f} inserts/s  '
+                        f'{(counter.count - batch_queries) / inserted:>7.1f} queries/insert  '
+                        f'last slug: {image.slug[:40]}'
+                    )
+                    batch_started = time.perf_counter()
+                    batch_queries = counter.count
+        total = time.perf_counter() - started
+        print(f'Inserted {args.count} images in {total:.2f}s ({counter.count} queries).')
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
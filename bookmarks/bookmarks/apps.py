@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class BookmarksConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'bookmarks'
+
+    def ready(self):
+        # connect the SQLite setup of every new database connection (WAL, see routers.py) before the other
+        # apps open one
+        import bookmarks.routers
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.cache import cache
+
+
+# Fragment cache.
+#
+# Cards that look the same for every user (image thumbnails, activity cards) are rendered once and the HTML is
+# kept in the cache. The cache key contains the id and the version of the objects shown on the card, so
+# when an object changes its version goes up and the old HTML is simply not used anymore (it expires on its own).
+# A whole page of cards is read with a single get_many() call.
+
+
+def cached_fragments(objects, key_func, render_func, timeout=None):
+    """
+    Return [render_func(obj) for obj in objects], reusing the fragments stored in the cache.
+    key_func(obj) must change whenever the output of render_func(obj) would change.
+    """
+    objects = list(objects)
+    keys = [key_func(obj) for obj in objects]
+    cached = cache.get_many(keys)
+
+    fragments = []
+    missing = {}
+    for key, obj in zip(keys, objects):
+        fragment = cached.get(key)
+        if fragment is None:
+            fragment = missing[key] = render_func(obj)
+        fragments.append(fragment)
+
+    if missing:
+        cache.set_many(missing, timeout or settings.FRAGMENT_CACHE_TIMEOUT)
+    return fragments
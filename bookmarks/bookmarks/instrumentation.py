@@ -0,0 +1,330 @@
+import contextvars
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+
+# Request instrumentation.
+#
+# InstrumentationMiddleware measures the requests in production, where the debug toolbar is not available:
+#
+#   - every request: its total duration, per view
+#   - a sample of the requests (INSTRUMENTATION_SAMPLE_RATE): the SQL queries, the Redis round trips and the
+#     template rendering time, per view, plus a Server-Timing header that the browser devtools display
+#
+# The database connections, the Redis clients and the template rendering are wrapped once per process, and the
+# wrappers only measure when the request is sampled: the other requests cost a context variable lookup per query,
+# Redis command or template, plus two perf_counter() calls and a histogram update.
+#
+# The histograms are kept in the memory of the process and exposed in the Prometheus text format at /metrics/.
+# With several worker processes every process has its own histograms; Prometheus scrapes each of them (or the
+# sums are done in the queries).
+
+# upper bounds of the histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+# the timings of the sampled request being processed (None when the request is not sampled)
+_current = contextvars.ContextVar('instrumentation', default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.redis_count = 0
+        self.redis_time = 0.0
+        self.render_time = 0.0
+        # templates rendered from a template (nested render_to_string()) are not counted twice
+        self.render_depth = 0
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # view name -> [count per bucket..., count, sum]
+        self._values = {}
+
+    def observe(self, view, value):
+        with self._lock:
+            values = self._values.get(view)
+            if values is None:
+                values = self._values[view] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[i] += 1
+                    break
+            values[-2] += 1
+            values[-1] += value
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def expose(self):
+        """
+        Return the lines of the histogram in the Prometheus text format (the buckets are cumulative).
+        """
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            values = {view: list(counts) for view, counts in self._values.items()}
+        for view, counts in sorted(values.items()):
+            label = view.replace('\\', '\\\\').replace('"', '\\"')
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{view="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{view="{label}",le="+Inf"}} {counts[-2]}')
+            lines.append(f'{self.name}_sum{{view="{label}"}} {counts[-1]}')
+            lines.append(f'{self.name}_count{{view="{label}"}} {counts[-2]}')
+        return lines
+
+
+REQUEST_DURATION = Histogram(
+    'bookmarks_request_duration_seconds', 'Time spent processing the request.', DURATION_BUCKETS
+)
+SQL_QUERIES = Histogram('bookmarks_request_sql_queries', 'SQL queries per sampled request.', COUNT_BUCKETS)
+SQL_DURATION = Histogram(
+    'bookmarks_request_sql_seconds', 'Time spent in SQL queries per sampled request.', DURATION_BUCKETS
+)
+REDIS_COMMANDS = Histogram(
+    'bookmarks_request_redis_commands', 'Redis round trips per sampled request.', COUNT_BUCKETS
+)
+REDIS_DURATION = Histogram(
+    'bookmarks_request_redis_seconds', 'Time spent waiting for Redis per sampled request.', DURATION_BUCKETS
+)
+RENDER_DURATION = Histogram(
+    'bookmarks_request_render_seconds', 'Time spent rendering templates per sampled request.', DURATION_BUCKETS
+)
+HISTOGRAMS = [REQUEST_DURATION, SQL_QUERIES, SQL_DURATION, REDIS_COMMANDS, REDIS_DURATION, RENDER_DURATION]
+
+
+def time_sql(execute, sql, params, many, context):
+    """
+    Execute wrapper of every database connection (see wrap_connection()) that adds the query to the timings of
+    the current request.
+    """
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.sql_count += 1
+        timings.sql_time += time.perf_counter() - started
+
+
+def wrap_connection(sender, connection, **kwargs):
+    """
+    connection_created receiver installing time_sql() on every new database connection.
+    The connections are per thread: under ASGI the queries of a request run in the thread of sync_to_async(), not
+    in the thread of the middleware, so the wrapper has to be on the connection itself. The context variable of
+    the request follows it into that thread.
+    """
+    # connection_created is sent again when the same connection object reconnects
+    if time_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_sql)
+
+
+_installed = False
+
+
+def install():
+    """
+    Wrap the Redis clients and the template rendering once per process. The wrappers only measure when the
+    current request is sampled; otherwise they cost a context variable lookup.
+    """
+    global _installed
+    if _installed:
+        return
+    _installed = True
+
+    from django.db.backends.signals import connection_created
+    from django.template.backends.django import Template
+    from redis.asyncio.client import Pipeline as AsyncPipeline, Redis as AsyncRedis
+    from redis.client import Pipeline, Redis
+
+    execute_command = Redis.execute_command
+    execute_pipeline = Pipeline.execute
+    render = Template.render
+
+    # Redis.execute_command() is a round trip for every client (the module clients, the cache, the sessions);
+    # the commands of a pipeline are sent together by Pipeline.execute()
+    def timed_command(self, *args, **options):
+        timings = _current.get()
+        if timings is None:
+            return execute_command(self, *args, **options)
+        started = time.perf_counter()
+        try:
+            return execute_command(self, *args, **options)
+        finally:
+            timings.redis_count += 1
+            timings.redis_time += time.perf_counter() - started
+
+    def timed_pipeline(self, *args, **options):
+        timings = _current.get()
+        if timings is None or not self.command_stack:
+            return execute_pipeline(self, *args, **options)
+        started = time.perf_counter()
+        try:
+            return execute_pipeline(self, *args, **options)
+        finally:
+            timings.redis_count += 1
+            timings.redis_time += time.perf_counter() - started
+
+    # render(), render_to_string() and the fragment cache all go through the template backend
+    def timed_render(self, *args, **kwargs):
+        timings = _current.get()
+        if timings is None:
+            return render(self, *args, **kwargs)
+        timings.render_depth += 1
+        started = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            timings.render_depth -= 1
+            if not timings.render_depth:
+                timings.render_time += time.perf_counter() - started
+
+    # the async client of the async views (see bookmarks/redis_client.py)
+    async_execute_command = AsyncRedis.execute_command
+    async_execute_pipeline = AsyncPipeline.execute
+
+    async def timed_async_command(self, *args, **options):
+        timings = _current.get()
+        if timings is None:
+            return await async_execute_command(self, *args, **options)
+        started = time.perf_counter()
+        try:
+            return await async_execute_command(self, *args, **options)
+        finally:
+            timings.redis_count += 1
+            timings.redis_time += time.perf_counter() - started
+
+    async def timed_async_pipeline(self, *args, **options):
+        timings = _current.get()
+        if timings is None or not self.command_stack:
+            return await async_execute_pipeline(self, *args, **options)
+        started = time.perf_counter()
+        try:
+            return await async_execute_pipeline(self, *args, **options)
+        finally:
+            timings.redis_count += 1
+            timings.redis_time += time.perf_counter() - started
+
+    Redis.execute_command = timed_command
+    Pipeline.execute = timed_pipeline
+    AsyncRedis.execute_command = timed_async_command
+    AsyncPipeline.execute = timed_async_pipeline
+    Template.render = timed_render
+
+    connection_created.connect(wrap_connection)
+    # the connections of this thread opened before the middleware was loaded
+    for connection in connections.all(initialized_only=True):
+        wrap_connection(None, connection)
+
+
+def server_timing(timings, total):
+    """
+    Return the Server-Timing header value of a sampled request (durations in milliseconds).
+    """
+    return ', '.join([
+        f'db;dur={timings.sql_time * 1000:.1f};desc="{timings.sql_count} queries"',
+        f'redis;dur={timings.redis_time * 1000:.1f};desc="{timings.redis_count} commands"',
+        f'render;dur={timings.render_time * 1000:.1f}',
+        f'total;dur={total * 1000:.1f}',
+    ])
+
+
+class InstrumentationMiddleware:
+    """
+    Measure every request and sample some of them in detail (see above).
+    Put it first in MIDDLEWARE so the time spent in the other middleware is included.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'INSTRUMENTATION_SAMPLE_RATE', 0.01)
+        # under ASGI the middleware must be async too, or Django runs the async views in a thread
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        install()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        if random.random() >= self.sample_rate:
+            response = self.get_response(request)
+            REQUEST_DURATION.observe(view_name(request), time.perf_counter() - started)
+            return response
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        if random.random() >= self.sample_rate:
+            response = await self.get_response(request)
+            REQUEST_DURATION.observe(view_name(request), time.perf_counter() - started)
+            return response
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - started)
+
+    def finish(self, request, response, timings, total):
+        view = view_name(request)
+        REQUEST_DURATION.observe(view, total)
+        SQL_QUERIES.observe(view, timings.sql_count)
+        SQL_DURATION.observe(view, timings.sql_time)
+        REDIS_COMMANDS.observe(view, timings.redis_count)
+        REDIS_DURATION.observe(view, timings.redis_time)
+        RENDER_DURATION.observe(view, timings.render_time)
+        # keep the metrics set by the view or by the debug toolbar
+        metrics = server_timing(timings, total)
+        if response.has_header('Server-Timing'):
+            metrics = f'{response["Server-Timing"]}, {metrics}'
+        response['Server-Timing'] = metrics
+        return response
+
+
+def view_name(request):
+    # resolver_match is set once the URL has been resolved; 404s of unknown URLs are grouped together
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>'
+    return match.view_name
+
+
+def metrics(request):
+    """
+    The histograms in the Prometheus text format, for the addresses in INSTRUMENTATION_METRICS_IPS.
+    """
+    if request.META.get('REMOTE_ADDR') not in settings.INSTRUMENTATION_METRICS_IPS:
+        return HttpResponseForbidden()
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.expose())
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,87 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+# Keyset (cursor) pagination.
+#
+# Instead of asking the database for "page N" (COUNT(*) + OFFSET, which gets slower the deeper you go),
+# every page remembers the sort key of its last row and the next page starts right after it:
+#
+#   WHERE created < :created OR (created = :created AND id < :id) ORDER BY created DESC, id DESC LIMIT :n
+#
+# This uses the index on the sort field, so every page costs the same no matter how deep it is.
+# The position is handed to the client as an opaque cursor string.
+
+
+def _cursor_value(value):
+    # isoformat() keeps the microseconds, so the cursor points to the exact row
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def encode_cursor(values):
+    data = json.dumps([_cursor_value(value) for value in values]).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Return the values stored in a cursor or None if the cursor is missing or invalid.
+    """
+    if not cursor:
+        return None
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except (ValueError, binascii.Error):
+        return None
+    if not isinstance(values, list) or len(values) != 2:
+        return None
+    return values
+
+
+class KeysetPage:
+    """
+    A page of results and the cursor pointing to the next page (None on the last page).
+    """
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def keyset_paginate(queryset, cursor, per_page, field='created'):
+    """
+    Return the KeysetPage of `queryset` that starts after `cursor`, newest `field` first.
+    An invalid cursor returns the first page.
+    """
+    queryset = queryset.order_by(f'-{field}', '-id')
+    values = decode_cursor(cursor)
+    if values:
+        value, pk = values
+        try:
+            queryset = queryset.filter(
+                Q(**{f'{field}__lt': value}) | Q(**{field: value, 'id__lt': pk})
+            )
+        except (ValidationError, ValueError, TypeError):
+            # a tampered cursor that does not match the field type
+            pass
+    # fetch one extra row to know if there is a next page without counting
+    object_list = list(queryset[:per_page + 1])
+    next_cursor = None
+    if len(object_list) > per_page:
+        object_list = object_list[:per_page]
+        last = object_list[-1]
+        next_cursor = encode_cursor([getattr(last, field), last.pk])
+    return KeysetPage(object_list, next_cursor)
@@ -0,0 +1,480 @@
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from collections import Counter, defaultdict
+
+import redis
+import redis.asyncio
+from django.conf import settings
+from django.core.cache.backends.redis import RedisCache as BaseRedisCache, RedisCacheClient
+
+logger = logging.getLogger(__name__)
+
+# The Redis client shared by every app (feeds, actions, view counters, rankings, the cache).
+#
+#   r                     the client of the sync code, with a pool of REDIS_MAX_CONNECTIONS connections
+#   get_async_client()    the client of the async views (one per event loop, see below)
+#   batch()               a pipeline that sends its commands every PIPELINE_BATCH_SIZE commands
+#   buffer                the counter updates waiting for Redis to come back
+#
+# Every connection has short socket timeouts (REDIS_SOCKET_TIMEOUT), so a slow Redis costs a request a fraction
+# of a second instead of hanging it. After REDIS_BREAKER_FAILURES failures in a row the circuit breaker opens:
+# for REDIS_BREAKER_RESET_TIMEOUT seconds every command fails at once with RedisUnavailable, without touching
+# the network. Then a single command is let through to check if Redis is back.
+#
+# The callers decide what to do without Redis: the view counters keep counting in `buffer` and replay it
+# later, the ranking falls back to the database, the cache behaves as if it were empty and sends its deletes
+# again once Redis is back.
+
+PIPELINE_BATCH_SIZE = 500
+
+# errors meaning that Redis can't be reached; redis.asyncio raises the same exceptions
+ERRORS = (redis.ConnectionError, redis.TimeoutError)
+
+
+class RedisUnavailable(redis.ConnectionError):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        """
+        Return True if a command may be sent. While open, one trial command is allowed every reset_timeout.
+        """
+        if self.opened_at is None:
+            return True
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            # the next trial comes reset_timeout after this one, even if this one never finishes
+            self.opened_at = time.monotonic()
+            return True
+
+    def success(self):
+        if self.failures:
+            with self._lock:
+                if self.opened_at is not None:
+                    logger.warning('Redis is available again')
+                self.failures = 0
+                self.opened_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning('Redis is unavailable, failing fast for %ss', self.reset_timeout)
+                self.opened_at = time.monotonic()
+
+
+breaker = CircuitBreaker(settings.REDIS_BREAKER_FAILURES, settings.REDIS_BREAKER_RESET_TIMEOUT)
+
+
+def guarded(function, *args, **kwargs):
+    if not breaker.allow():
+        raise RedisUnavailable('Redis is unavailable (circuit breaker open)')
+    try:
+        result = function(*args, **kwargs)
+    except ERRORS as e:
+        breaker.failure()
+        raise RedisUnavailable(str(e)) from e
+    except redis.RedisError:
+        # Redis answered, with an error
+        breaker.success()
+        raise
+    breaker.success()
+    return result
+
+
+async def aguarded(function, *args, **kwargs):
+    if not breaker.allow():
+        raise RedisUnavailable('Redis is unavailable (circuit breaker open)')
+    try:
+        result = await function(*args, **kwargs)
+    except ERRORS as e:
+        breaker.failure()
+        raise RedisUnavailable(str(e)) from e
+    except redis.RedisError:
+        breaker.success()
+        raise
+    breaker.success()
+    return result
+
+
+class Redis(redis.Redis):
+    """
+    redis.Redis whose commands and pipelines go through the circuit breaker.
+    """
+    def execute_command(self, *args, **options):
+        return guarded(super().execute_command, *args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return Pipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class Pipeline(redis.client.Pipeline):
+    def execute(self, raise_on_error=True):
+        if not self.command_stack:
+            return []
+        return guarded(super().execute, raise_on_error)
+
+
+class AsyncRedis(redis.asyncio.Redis):
+    async def execute_command(self, *args, **options):
+        return await aguarded(super().execute_command, *args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return AsyncPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class AsyncPipeline(redis.asyncio.client.Pipeline):
+    async def execute(self, raise_on_error=True):
+        if not self.command_stack:
+            return []
+        return await aguarded(super().execute, raise_on_error)
+
+
+def pool_options():
+    return {
+        'host': settings.REDIS_HOST,
+        'port': settings.REDIS_PORT,
+        'db': settings.REDIS_DB,
+        'max_connections': settings.REDIS_MAX_CONNECTIONS,
+        # seconds a command waits for a free connection of the pool
+        'timeout': settings.REDIS_POOL_TIMEOUT,
+        'socket_timeout': settings.REDIS_SOCKET_TIMEOUT,
+        'socket_connect_timeout': settings.REDIS_CONNECT_TIMEOUT,
+        # check idle connections before using them again, so a restarted Redis doesn't fail the first commands
+        'health_check_interval': 30,
+    }
+
+
+def connect():
+    # A blocking pool makes a command wait for a free connection instead of failing when all are in use
+    return Redis(connection_pool=redis.BlockingConnectionPool(**pool_options()))
+
+
+def connect_async():
+    return AsyncRedis(connection_pool=redis.asyncio.BlockingConnectionPool(**pool_options()))
+
+
+r = connect()
+
+# A redis.asyncio connection belongs to the event loop that opened it. Under ASGI a worker process runs a single
+# loop, so every async view shares one client and its pool. Code that runs an async view from sync code
+# (async_to_sync, the test client) gets a new loop each time, and with it a client of its own.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """
+    Return the async Redis client of the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = connect_async()
+    return client
+
+
+class Batch:
+    """
+    Pipeline (without MULTI/EXEC) that sends its commands every batch_size commands and at the end of the with
+    block, so a loop over thousands of items makes a few round trips without keeping every command in memory.
+
+        with redis_client.batch() as pipe:
+            for follower_id in follower_ids:
+                pipe.zadd(feed_key(follower_id), {...})
+    """
+    def __init__(self, client=None, batch_size=PIPELINE_BATCH_SIZE):
+        self._pipe = (client or r).pipeline(transaction=False)
+        self.batch_size = batch_size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+        else:
+            self._pipe.reset()
+
+    def __getattr__(self, name):
+        command = getattr(self._pipe, name)
+
+        def queue(*args, **kwargs):
+            command(*args, **kwargs)
+            if len(self._pipe) >= self.batch_size:
+                self.execute()
+            return self
+        return queue
+
+    def execute(self):
+        return self._pipe.execute()
+
+
+def batch(batch_size=PIPELINE_BATCH_SIZE):
+    return Batch(batch_size=batch_size)
+
+
+class CounterBuffer:
+    """
+    Counter updates that couldn't be sent to Redis, added up in memory and replayed once Redis is back.
+    It takes the pipeline commands of the counters (incr, zincrby, sadd, expire), so the code that queues
+    them on a pipeline can queue them here instead. Each process has its own buffer: the updates of a process
+    that stops before Redis comes back are lost, like with any in-memory counter.
+    """
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self._incr = Counter()
+        self._zincr = Counter()
+        self._sets = defaultdict(set)
+        self._expire = {}
+
+    def __len__(self):
+        return len(self._incr) + len(self._zincr) + len(self._sets)
+
+    def _full(self, key, values):
+        # past max_keys only the keys already buffered are counted, so an outage can't exhaust the memory
+        return len(self) >= self.max_keys and key not in values
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            if not self._full(key, self._incr):
+                self._incr[key] += amount
+        return self
+
+    def zincrby(self, key, amount, member):
+        with self._lock:
+            if not self._full((key, member), self._zincr):
+                self._zincr[key, member] += amount
+        return self
+
+    def sadd(self, key, *values):
+        with self._lock:
+            if not self._full(key, self._sets):
+                self._sets[key].update(values)
+        return self
+
+    def expire(self, key, time):
+        with self._lock:
+            self._expire[key] = time
+        return self
+
+    def get(self, key):
+        """
+        The increments of the key waiting to be sent.
+        """
+        return self._incr.get(key, 0)
+
+    def _take(self):
+        with self._lock:
+            taken = self._incr, self._zincr, self._sets, self._expire
+            self._clear()
+        return taken
+
+    def _restore(self, taken):
+        incr, zincr, sets, expire = taken
+        with self._lock:
+            self._incr.update(incr)
+            self._zincr.update(zincr)
+            for key, values in sets.items():
+                self._sets[key].update(values)
+            self._expire.update(expire)
+
+    def _queue(self, pipe, taken):
+        incr, zincr, sets, expire = taken
+        for key, amount in incr.items():
+            pipe.incrby(key, amount)
+        for (key, member), amount in zincr.items():
+            pipe.zincrby(key, amount, member)
+        for key, values in sets.items():
+            pipe.sadd(key, *values)
+        for key, seconds in expire.items():
+            pipe.expire(key, seconds)
+
+    def replay(self):
+        """
+        Send the buffered updates to Redis in one round trip. They stay buffered if Redis is still unavailable.
+        """
+        if not len(self):
+            return
+        taken = self._take()
+        pipe = r.pipeline(transaction=False)
+        self._queue(pipe, taken)
+        try:
+            pipe.execute()
+        except RedisUnavailable:
+            self._restore(taken)
+
+    async def areplay(self):
+        if not len(self):
+            return
+        taken = self._take()
+        pipe = get_async_client().pipeline(transaction=False)
+        self._queue(pipe, taken)
+        try:
+            await pipe.execute()
+        except RedisUnavailable:
+            self._restore(taken)
+
+
+buffer = CounterBuffer(settings.REDIS_BUFFER_MAX_KEYS)
+
+
+class PendingInvalidations:
+    """
+    Cache invalidations (delete, incr) that couldn't be sent to Redis, sent again by the next cache command that
+    reaches it. Skipping them like the writes would let Redis serve the old value once it is back, until its
+    timeout: a cached user that was deactivated, the directory pages of its old version. Until they are sent,
+    the reads of the deleted keys are misses. Like CounterBuffer, each process keeps its own.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._delete = set()
+        self._incr = Counter()
+
+    def __len__(self):
+        return len(self._delete) + len(self._incr)
+
+    def delete(self, *keys):
+        with self._lock:
+            self._delete.update(keys)
+
+    def incr(self, key, delta):
+        with self._lock:
+            self._incr[key] += delta
+
+    def replay(self, cache_client):
+        # the deleted keys stay pending until Redis has deleted them, so a concurrent read can't get them meanwhile
+        with self._lock:
+            delete = list(self._delete)
+            incr, self._incr = self._incr, Counter()
+        try:
+            if delete:
+                cache_client.get_client(write=True).delete(*delete)
+                with self._lock:
+                    self._delete.difference_update(delete)
+            for key in list(incr):
+                try:
+                    RedisCacheClient.incr(cache_client, key, incr[key])
+                except ValueError:
+                    # the key has expired meanwhile, there is nothing to increment
+                    pass
+                del incr[key]
+        except RedisUnavailable:
+            with self._lock:
+                self._incr.update(incr)
+            raise
+
+
+invalidations = PendingInvalidations()
+
+
+class ResilientRedisCacheClient(RedisCacheClient):
+    """
+    Django's Redis cache client on the guarded client: without Redis, reads are misses and writes are skipped.
+    The invalidations are kept and sent again (see PendingInvalidations).
+    """
+    def __init__(self, servers, **options):
+        super().__init__(servers, **options)
+        self._client = Redis
+
+    def replay_invalidations(self):
+        # called first by every command: a read must not get a value that is waiting to be deleted
+        if len(invalidations):
+            invalidations.replay(self)
+
+    def get(self, key, default):
+        try:
+            self.replay_invalidations()
+            return super().get(key, default)
+        except RedisUnavailable:
+            return default
+
+    def get_many(self, keys):
+        try:
+            self.replay_invalidations()
+            return super().get_many(keys)
+        except RedisUnavailable:
+            return {}
+
+    def has_key(self, key):
+        try:
+            self.replay_invalidations()
+            return super().has_key(key)
+        except RedisUnavailable:
+            return False
+
+    def delete(self, key):
+        try:
+            self.replay_invalidations()
+            return super().delete(key)
+        except RedisUnavailable:
+            logger.warning('Could not delete %s from the cache, it will be deleted when Redis is back', key)
+            invalidations.delete(key)
+            return False
+
+    def delete_many(self, keys):
+        try:
+            self.replay_invalidations()
+            super().delete_many(keys)
+        except RedisUnavailable:
+            logger.warning('Could not delete %s keys from the cache, they will be deleted when Redis is back',
+                           len(keys))
+            invalidations.delete(*keys)
+
+    def incr(self, key, delta):
+        try:
+            self.replay_invalidations()
+            return super().incr(key, delta)
+        except RedisUnavailable:
+            logger.warning('Could not increment %s in the cache, it will be incremented when Redis is back', key)
+            invalidations.incr(key, delta)
+            return 0
+
+
+def _skipped_without_redis(name, result):
+    method = getattr(RedisCacheClient, name)
+
+    def skip(self, *args, **kwargs):
+        try:
+            self.replay_invalidations()
+            return method(self, *args, **kwargs)
+        except RedisUnavailable:
+            return result
+    skip.__name__ = name
+    return skip
+
+
+# the writes are skipped: the value is simply not cached
+for _name, _result in [('add', False), ('set', None), ('touch', False), ('set_many', []), ('clear', False)]:
+    setattr(ResilientRedisCacheClient, _name, _skipped_without_redis(_name, _result))
+
+
+class RedisCache(BaseRedisCache):
+    """
+    CACHES backend using ResilientRedisCacheClient. Its OPTIONS go to the connection pool (timeouts, size).
+    """
+    def __init__(self, server, params):
+        super().__init__(server, params)
+        self._class = ResilientRedisCacheClient
@@ -0,0 +1,154 @@
+import contextvars
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+# Primary/replica database routing.
+#
+# Writes always go to the 'default' database. When a 'replica' database is configured (REPLICA_DATABASE), the
+# views decorated with @replica_reads read from it instead, so the read-heavy pages (image list, ranking,
+# dashboard, people) don't wait behind the writes of likes, follows and actions.
+#
+# A replica lags a little behind the primary, so reads go back to the primary:
+#   - for the rest of the request after its first write (the view reads what it just wrote)
+#   - inside transaction.atomic() blocks (the transaction only exists on the primary)
+#   - for DATABASE_REPLICA_PIN_SECONDS after a request of the same browser wrote something (a cookie set by
+#     ReplicaRoutingMiddleware), so a user sees their own like or follow on the next page
+#
+# Locally the replica is a second SQLite file copied from db.sqlite3 by `manage.py sync_replica`; the tests use
+# a second test database filled the same way (see test_settings.py).
+
+REPLICA = 'replica'
+PIN_COOKIE = 'db_pinned'
+
+
+# connected when the project app is loaded (see apps.py)
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    # WAL lets the readers go on while a write is committed (the default journal blocks them), and
+    # synchronous=NORMAL is safe in WAL mode and saves an fsync per transaction. journal_mode is stored in
+    # the database file, synchronous has to be set on every connection.
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+
+
+class RoutingState:
+    def __init__(self, pinned=False):
+        self.replica_reads = False
+        self.pinned = pinned
+        self.wrote = False
+
+
+# the routing state of the request being processed (None outside of requests: commands, workers, shell)
+_state = contextvars.ContextVar('db_routing', default=None)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if (state is not None and state.replica_reads and not state.pinned and REPLICA in settings.DATABASES
+                and not connections['default'].in_atomic_block):
+            return REPLICA
+        # Without this, the reads of related objects would follow the instance they start from to the replica
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica is a copy of the primary: objects from both are the same rows
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replica gets its tables from the primary
+        return db != REPLICA
+
+
+def replica_reads(view):
+    """
+    Let the view (sync or async) read from the replica until it writes something.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            state = _state.get()
+            if state is None:
+                return await view(request, *args, **kwargs)
+            state.replica_reads = True
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                state.replica_reads = False
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        state = _state.get()
+        if state is None:
+            return view(request, *args, **kwargs)
+        state.replica_reads = True
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            state.replica_reads = False
+    return wrapper
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Keep the routing state of each request and pin the browser to the primary for a while after a write.
+    Put it before SessionMiddleware, so the session writes are seen too.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # under ASGI the middleware must be async too, or Django runs the async views in a thread
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        state = self.start(request)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(state, response)
+
+    async def __acall__(self, request):
+        state = self.start(request)
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(state, response)
+
+    def start(self, request):
+        pinned_until = request.COOKIES.get(PIN_COOKIE, '')
+        return RoutingState(pinned=pinned_until.isdigit() and int(pinned_until) > time.time())
+
+    def finish(self, state, response):
+        if state.wrote and REPLICA in settings.DATABASES:
+            pin_seconds = settings.DATABASE_REPLICA_PIN_SECONDS
+            response.set_cookie(
+                PIN_COOKIE, str(int(time.time()) + pin_seconds), max_age=pin_seconds, httponly=True, samesite='Lax'
+            )
+        return response
+
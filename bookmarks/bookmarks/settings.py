@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
 from pathlib import Path
+from decouple import config
 from django.urls import reverse_lazy
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -27,7 +28,7 @@ MEDIA_ROOT = BASE_DIR / 'media'
 SECRET_KEY = 'django-insecure-1)+zl4&b)0)3_5^3ju132ih$ii@p*2r74q8wg!dfq1)18u@$^4'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = config('DEBUG', default=True, cast=bool)
 
 ALLOWED_HOSTS = [
     'myblog.com', 'localhost', '127.0.0.1',
@@ -37,6 +38,8 @@ ALLOWED_HOSTS = [
 # Application definition
 
 INSTALLED_APPS = [
+    # the project package itself: the database setup of bookmarks/routers.py (see bookmarks/apps.py)
+    'bookmarks.apps.BookmarksConfig',
     'account.apps.AccountConfig',
     'django.contrib.admin',
     'django.contrib.auth',
@@ -49,12 +52,11 @@ INSTALLED_APPS = [
     'images.apps.ImagesConfig',
     'easy_thumbnails',
     'actions.apps.ActionsConfig',
-    'debug_toolbar',
-
 ]
 
 MIDDLEWARE = [
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'bookmarks.instrumentation.InstrumentationMiddleware',
+    'bookmarks.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -64,6 +66,12 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# The debug toolbar is a development tool: it slows every request down and shows the SQL queries,
+# so it is only installed with DEBUG (production requests are measured by bookmarks/instrumentation.py).
+if DEBUG:
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.insert(1, 'debug_toolbar.middleware.DebugToolbarMiddleware')
+
 ROOT_URLCONF = 'bookmarks.urls'
 
 TEMPLATES = [
@@ -92,9 +100,26 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep the connection of each worker thread for 10 minutes instead of opening one per request,
+        # and check that it still works before reusing it.
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        # seconds a write waits for the lock of another writer before "database is locked"
+        'OPTIONS': {'timeout': 20},
     }
 }
 
+# Read replica (see bookmarks/routers.py). Locally, a second SQLite file filled by `manage.py sync_replica`:
+#   REPLICA_DATABASE=replica.sqlite3 python manage.py sync_replica
+REPLICA_DATABASE = config('REPLICA_DATABASE', default='')
+if REPLICA_DATABASE:
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': BASE_DIR / REPLICA_DATABASE,
+    }
+DATABASE_ROUTERS = ['bookmarks.routers.PrimaryReplicaRouter']
+DATABASE_REPLICA_PIN_SECONDS = 10   # reads stay on the primary this long after a write of the same browser
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -155,14 +180,17 @@ EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
 # Custom Authentication Backend
 AUTHENTICATION_BACKENDS = [
-    'django.contrib.auth.backends.ModelBackend',
+    'account.authentication.CachedModelBackend',
     'account.authentication.EmailAuthBackend',
     'social_core.backends.google.GoogleOAuth2',
 ]
 # The user credentials will be checked using ModelBackend, and if no user is returned, the credentials
 # will be checked using EmailAuthBackend.
+# CachedModelBackend is ModelBackend reading the logged-in user from the cache (see account/authentication.py).
+AUTH_USER_CACHE_TIMEOUT = 3600  # seconds a user and its profile are cached; saving them deletes the copy
 
-from decouple import config
+# The session is read from the cache and written to both the cache and the database.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
 
 SOCIAL_AUTH_GOOGLE_OAUTH2_KEY = config('GOOGLE_OAUTH2_KEY')
 SOCIAL_AUTH_GOOGLE_OAUTH2_SECRET = config('GOOGLE_OAUTH2_SECRET')
@@ -203,8 +231,92 @@ ABSOLUTE_URL_OVERRIDES = {
 # For django_debug_toolbar
 INTERNAL_IPS = ['127.0.0.1']
 
+# Request instrumentation (see bookmarks/instrumentation.py)
+INSTRUMENTATION_SAMPLE_RATE = 0.01          # share of the requests whose queries are counted and timed
+INSTRUMENTATION_METRICS_IPS = ['127.0.0.1']  # addresses allowed to read /metrics/
+
 # Integrate Redis into project
 REDIS_HOST = 'localhost'
 REDIS_PORT = 6000   # have used this port no. instead of default port no. 6379
 REDIS_DB = 0
-
+# Shared Redis client of every app (see bookmarks/redis_client.py)
+REDIS_MAX_CONNECTIONS = 50          # connections per process (and per event loop for the async views)
+REDIS_POOL_TIMEOUT = 1              # seconds a command waits for a free connection
+REDIS_SOCKET_TIMEOUT = 0.5          # seconds a command waits for its reply
+REDIS_CONNECT_TIMEOUT = 0.2         # seconds to open a connection
+REDIS_BREAKER_FAILURES = 5          # failures in a row that make the client fail fast...
+REDIS_BREAKER_RESET_TIMEOUT = 10    # ...for this many seconds, then one command checks if Redis is back
+REDIS_BUFFER_MAX_KEYS = 10000       # counters kept in memory while Redis is unavailable
+
+# True: image_detail, image_like, image_ranking and user_follow are served by their async versions.
+# bookmarks/asgi.py turns it on; under WSGI the sync views avoid running an event loop per request.
+ASYNC_VIEWS = config('ASYNC_VIEWS', default=False, cast=bool)
+
+
+# Activity feed timelines (actions/feed.py)
+FEED_MAX_LENGTH = 500   # number of action ids kept in each follower timeline
+FEED_FANOUT_MAX_FOLLOWERS = 10000
+# Users with more followers than this are not fanned out on write; their actions are
+# merged into the timelines of their followers when the dashboard is read.
+
+# Background image ingestion (images/ingest.py, manage.py run_ingest_workers)
+INGEST_CONCURRENCY = 4          # parallel downloads per worker process
+INGEST_TIMEOUT = (5, 30)        # (connect, read) timeout in seconds for each download
+INGEST_MAX_BYTES = 10 * 1024 * 1024
+INGEST_MAX_ATTEMPTS = 5
+INGEST_RETRY_DELAY = 30         # seconds before the first retry, doubled on every attempt
+INGEST_JOB_TIMEOUT = 600        # a job running for longer than this is claimed again
+
+# Activity stream writes (actions/utils.py)
+ACTIONS_BUFFERED = True         # False writes every action immediately (used by tests)
+ACTIONS_BUFFER_SIZE = 100       # actions written per bulk_create()
+ACTIONS_DEDUP_WINDOW = 60       # seconds during which the same action is not recorded twice
+ACTIONS_FLUSH_INTERVAL = 10     # seconds an action waits in the buffer at most (while actions or dashboards come)
+ACTIONS_FLUSH_TIMEOUT = 300     # a batch taken by a flush for longer than this goes back to the buffer
+
+# Cache (ranking, fragments, ...) stored in the same Redis server
+CACHES = {
+    'default': {
+        # Django's Redis cache behind the circuit breaker: a miss instead of an error when Redis is down
+        'BACKEND': 'bookmarks.redis_client.RedisCache',
+        'LOCATION': f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}',
+        'KEY_PREFIX': 'cache',
+        'OPTIONS': {
+            'pool_class': 'redis.BlockingConnectionPool',
+            'max_connections': REDIS_MAX_CONNECTIONS,
+            'timeout': REDIS_POOL_TIMEOUT,
+            'socket_timeout': REDIS_SOCKET_TIMEOUT,
+            'socket_connect_timeout': REDIS_CONNECT_TIMEOUT,
+        },
+    }
+}
+RANKING_CACHE_TIMEOUT = 30      # seconds the hydrated image ranking is cached
+FRAGMENT_CACHE_TIMEOUT = 3600   # seconds a rendered card is kept (see bookmarks/fragments.py)
+PEOPLE_CACHE_TIMEOUT = 60       # seconds a page of the people directory is kept (see account/directory.py)
+
+# Image search backend (see images/search.py). SQLiteFTSBackend needs the FTS5 table created by the
+# images migrations on SQLite; use 'images.search.DatabaseSearchBackend' on other databases.
+IMAGE_SEARCH_BACKEND = 'images.search.SQLiteFTSBackend'
+
+# Images whose perceptual hashes differ in at most this many bits are the same picture (see images/dedup.py).
+# images/dedup.py finds them with 4 exact chunk lookups, which only works up to 3 bits.
+DUPLICATE_MAX_DISTANCE = 3
+DUPLICATE_MAX_CANDIDATES = 2000   # images sharing a chunk that are compared at most, per lookup
+
+# Thumbnail sizes used by the templates (see images/thumbnails.py).
+# They are generated right after an image or a profile photo is saved.
+THUMBNAIL_ALIASES = {
+    'images.Image.image': {
+        'grid': {'size': (300, 300), 'crop': 'smart'},     # image lists
+        'detail': {'size': (300, 0)},                       # image detail page
+        'small': {'size': (80, 80), 'crop': '100%'},        # activity stream
+    },
+    'account.Profile.photo': {
+        'small': {'size': (80, 80), 'crop': '100%'},        # activity stream
+        'profile': {'size': (180, 180)},                    # people list and profile page
+    },
+}
+THUMBNAIL_WORKERS = 2   # processes generating thumbnails in the background
+# PNG thumbnails stay PNG (with or without transparency), every other file gets a JPEG thumbnail, so the name of
+# a thumbnail only depends on the name of its source (see thumbnail_url())
+THUMBNAIL_PRESERVE_EXTENSIONS = ('png',)
@@ -0,0 +1,20 @@
+import fakeredis
+from django.test.runner import DiscoverRunner
+
+from bookmarks import redis_client
+
+
+class FakeRedisTestRunner(DiscoverRunner):
+    """
+    Django's test runner with the shared Redis clients (bookmarks/redis_client.py) on an in-memory fakeredis
+    server, so the tests don't need a Redis server and never touch the data of the real one.
+    The server is shared by every test: call redis_client.r.flushdb() in setUp() to start from an empty one.
+    """
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        server = fakeredis.FakeServer()
+        redis_client.r = redis_client.Redis(connection_pool=fakeredis.FakeRedis(server=server).connection_pool)
+        # the async views get a client of the same server for their event loop
+        redis_client.connect_async = lambda: redis_client.AsyncRedis(
+            connection_pool=fakeredis.FakeAsyncRedis(server=server).connection_pool
+        )
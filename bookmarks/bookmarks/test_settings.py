@@ -0,0 +1,39 @@
+"""
+Settings of the test suite. `python manage.py test` uses them unless DJANGO_SETTINGS_MODULE is set (see manage.py).
+"""
+import os
+import tempfile
+
+# settings.py reads these from the environment (or .env); the tests never log in with Google
+os.environ.setdefault('GOOGLE_OAUTH2_KEY', 'test')
+os.environ.setdefault('GOOGLE_OAUTH2_SECRET', 'test')
+# test the production middleware: without DEBUG the debug toolbar isn't installed
+os.environ.setdefault('DEBUG', 'False')
+
+from .settings import *     # noqa: E402,F401,F403
+
+# Redis is replaced by an in-memory fakeredis server (see bookmarks/test_runner.py), the cache by a local one
+TEST_RUNNER = 'bookmarks.test_runner.FakeRedisTestRunner'
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+}
+
+# the files saved by the tests don't end up in media/
+MEDIA_ROOT = os.path.join(tempfile.gettempdir(), 'bookmarks-test-media')
+
+# hashing the passwords of the test users with the real hasher takes most of the test run
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+# actions are written right away; the tests of the Redis buffer turn it on with override_settings()
+ACTIONS_BUFFERED = False
+# no request is instrumented unless a test asks for it
+INSTRUMENTATION_SAMPLE_RATE = 0
+
+# The replica (see bookmarks/routers.py) is a second test database, in a file so `manage.py sync_replica` can
+# copy the primary into it. Only the tests that list it in `databases` create it; the views decorated with
+# @replica_reads read from it, so those tests run sync_replica after writing their data.
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'NAME': BASE_DIR / 'replica.sqlite3',
+    'TEST': {'NAME': os.path.join(tempfile.gettempdir(), 'bookmarks-test-replica.sqlite3')},
+}
@@ -0,0 +1,147 @@
+import re
+from io import StringIO
+from unittest import mock
+
+import fakeredis
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from images.models import Image
+from . import instrumentation, redis_client, routers
+
+
+@override_settings(INSTRUMENTATION_SAMPLE_RATE=1)
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        redis_client.r.flushdb()
+        user = User.objects.create_user('alice')
+        self.image = Image.objects.create(user=user, title='Sunset', url='https://example.com/sunset.jpg')
+
+    def sql_count(self, response):
+        return int(re.search(r'db;dur=[\d.]+;desc="(\d+) queries"', response['Server-Timing'])[1])
+
+    def test_queries_are_counted(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.image.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.sql_count(response), len(queries))
+
+    async def test_queries_are_counted_under_asgi(self):
+        # the middleware runs in the event loop, the sync view and its queries in the thread of sync_to_async()
+        response = await self.async_client.get(self.image.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(self.sql_count(response), 0)
+
+    def test_requests_that_are_not_sampled_are_not_measured(self):
+        with override_settings(INSTRUMENTATION_SAMPLE_RATE=0):
+            response = self.client.get(self.image.get_absolute_url())
+        self.assertFalse(response.has_header('Server-Timing'))
+        # the wrapper stays on the connection, but counts nothing outside of a sampled request
+        self.assertIn(instrumentation.time_sql, connection.execute_wrappers)
+
+
+class ResilientCacheTests(SimpleTestCase):
+    def setUp(self):
+        # the cache of settings.py, on a fakeredis server
+        self.cache = redis_client.RedisCache('redis://localhost:6000/0', {
+            'KEY_PREFIX': 'cache',
+            'OPTIONS': {'connection_class': fakeredis.FakeConnection, 'server': fakeredis.FakeServer()},
+        })
+        self.cache.set('auth:user:1', {'is_active': True})
+        self.cache.set('people_directory:version', 1, None)
+
+    def redis_down(self):
+        # the circuit breaker is open: every command fails at once
+        return mock.patch.object(redis_client.breaker, 'allow', return_value=False)
+
+    def test_reads_and_writes_are_skipped_without_redis(self):
+        with self.redis_down():
+            self.assertIsNone(self.cache.get('auth:user:1'))
+            self.assertFalse(self.cache.add('new', 1))
+            self.cache.set('auth:user:1', {'is_active': False})
+        self.assertEqual(self.cache.get('auth:user:1'), {'is_active': True})
+
+    def test_invalidations_are_sent_when_redis_is_back(self):
+        with self.redis_down(), self.assertLogs('bookmarks.redis_client', 'WARNING'):
+            self.cache.delete('auth:user:1')
+            self.cache.incr('people_directory:version')
+        self.assertEqual(len(redis_client.invalidations), 2)
+        # the first command that reaches Redis sends them before its own
+        self.assertIsNone(self.cache.get('auth:user:1'))
+        self.assertEqual(self.cache.get('people_directory:version'), 2)
+        self.assertEqual(len(redis_client.invalidations), 0)
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    # the replica is a second SQLite file, copied from the primary by sync_replica (see test_settings.py)
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        redis_client.r.flushdb()
+        cache.clear()
+        self.user = User.objects.create_user('alice')
+        self.client.force_login(self.user)
+        Image.objects.create(user=self.user, title='Copied to the replica', url='https://example.com/a.jpg')
+        call_command('sync_replica', stdout=StringIO())
+        # written after the copy: only the primary has it
+        self.image = Image.objects.create(user=self.user, title='Only on the primary', url='https://example.com/b.jpg')
+
+    def get_list(self):
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            response = self.client.get(reverse('images:list'), {'images_only': 1})
+        self.assertEqual(response.status_code, 200)
+        return response, len(replica_queries)
+
+    def test_replica_reads_view_reads_from_the_replica(self):
+        response, replica_queries = self.get_list()
+        self.assertGreater(replica_queries, 0)
+        self.assertContains(response, 'Copied to the replica')
+        self.assertNotContains(response, 'Only on the primary')
+
+    def test_other_views_read_from_the_primary(self):
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            response = self.client.get(self.image.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(replica_queries), 0)
+
+    def test_write_pins_the_request_to_the_primary(self):
+        state = routers.RoutingState()
+        state.replica_reads = True
+        token = routers._state.set(state)
+        try:
+            router = routers.PrimaryReplicaRouter()
+            self.assertEqual(router.db_for_read(Image), routers.REPLICA)
+            with transaction.atomic():
+                # the transaction only exists on the primary
+                self.assertEqual(router.db_for_read(Image), 'default')
+            self.image.users_like.add(self.user)
+            self.assertEqual(router.db_for_read(Image), 'default')
+            self.assertTrue(state.wrote)
+        finally:
+            routers._state.reset(token)
+
+    def test_pin_cookie_keeps_the_next_reads_on_the_primary(self):
+        response = self.client.post(reverse('images:like'), {'id': self.image.id, 'action': 'like'})
+        self.assertEqual(response.json()['status'], 'ok')
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+
+        response, replica_queries = self.get_list()
+        self.assertEqual(replica_queries, 0)
+        self.assertContains(response, 'Only on the primary')
+
+        # once the cookie has expired, the reads go back to the replica
+        self.client.cookies[routers.PIN_COOKIE] = '0'
+        response, replica_queries = self.get_list()
+        self.assertGreater(replica_queries, 0)
+        self.assertNotContains(response, 'Only on the primary')
+
+    def test_reads_without_a_request_use_the_primary(self):
+        # commands, workers and the shell never read from the replica
+        self.assertEqual(Image.objects.get(pk=self.image.pk).title, 'Only on the primary')
+        self.assertEqual(Image.objects.all().db, 'default')
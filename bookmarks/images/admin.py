@@ -1,8 +1,15 @@
 from django.contrib import admin
-from .models import Image
+from .models import Image, ImageIngestJob
 
 
 @admin.register(Image)
 class ImageAdmin(admin.ModelAdmin):
-    list_display = ['title', 'slug', 'image', 'created']
-    list_filter = ['created']
+    list_display = ['title', 'slug', 'image', 'status', 'created']
+    list_filter = ['created', 'status']
+
+
+@admin.register(ImageIngestJob)
+class ImageIngestJobAdmin(admin.ModelAdmin):
+    list_display = ['image', 'status', 'attempts', 'run_after', 'last_error']
+    list_filter = ['status']
+    raw_id_fields = ['image']
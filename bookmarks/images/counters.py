@@ -0,0 +1,132 @@
+from bookmarks import redis_client
+from bookmarks.redis_client import RedisUnavailable
+from .models import Image
+from . import ranking
+
+# Ids of the images viewed since the last sync_views() run
+VIEWS_DIRTY_KEY = 'image_views:dirty'
+
+
+def views_key(image_id):
+    return f'image:{image_id}:views'
+
+
+def merge_views(redis_views, db_views):
+    """
+    Combine the Redis counter with the copy stored in the database.
+    The Redis counter only goes down if Redis lost its data; in that case it counts the views since the data
+    was lost, which come on top of the last copy saved in the database.
+    """
+    if redis_views < db_views:
+        return db_views + redis_views
+    return redis_views
+
+
+def queue_view(pipe, image_id):
+    # increment total image views by 1
+    pipe.incr(views_key(image_id))
+    # increment image ranking by 1 (all-time, daily and weekly leaderboards)
+    ranking.add_view(pipe, image_id)
+    # remember that the counter of this image must be saved to the database
+    pipe.sadd(VIEWS_DIRTY_KEY, image_id)
+
+
+def buffer_view(image):
+    """
+    Count a view of the image while Redis is unavailable and return an estimate of its total views.
+    The view is replayed to Redis by the first record_view() that reaches it.
+    """
+    queue_view(redis_client.buffer, image.id)
+    return image.total_views + redis_client.buffer.get(views_key(image.id))
+
+
+def record_view(image):
+    """
+    Count a view of the image and return its total views, in a single round trip to Redis.
+    """
+    # A pipeline sends all the commands together and reads all the replies together.
+    # transaction=False: no MULTI/EXEC is needed, the commands are independent.
+    pipe = redis_client.r.pipeline(transaction=False)
+    queue_view(pipe, image.id)
+    try:
+        total_views = pipe.execute()[0]
+    except RedisUnavailable:
+        return buffer_view(image)
+    # Redis is back: send the views counted without it
+    redis_client.buffer.replay()
+    return merge_views(total_views, image.total_views)
+
+
+async def arecord_view(image):
+    """
+    Async version of record_view() for the async views: the event loop serves other requests during the round trip.
+    """
+    pipe = redis_client.get_async_client().pipeline(transaction=False)
+    queue_view(pipe, image.id)
+    try:
+        total_views = (await pipe.execute())[0]
+    except RedisUnavailable:
+        return buffer_view(image)
+    await redis_client.buffer.areplay()
+    return merge_views(total_views, image.total_views)
+
+
+def sync_views(batch_size=1000):
+    """
+    Save the Redis view counters of the images viewed since the last run into Image.total_views.
+    Return the number of images updated.
+    """
+    updated = 0
+    while True:
+        image_ids = [int(image_id) for image_id in redis_client.r.spop(VIEWS_DIRTY_KEY, batch_size)]
+        if not image_ids:
+            return updated
+        counts = redis_client.r.mget([views_key(image_id) for image_id in image_ids])
+        redis_views = {image_id: int(count or 0) for image_id, count in zip(image_ids, counts)}
+
+        images = list(Image.objects.filter(id__in=image_ids).only('id', 'total_views'))
+        pipe = redis_client.r.pipeline(transaction=False)
+        for image in images:
+            views = merge_views(redis_views[image.id], image.total_views)
+            if views != redis_views[image.id]:
+                # Redis lost the counter: put back the views it doesn't know about
+                missing = views - redis_views[image.id]
+                pipe.incrby(views_key(image.id), missing)
+                pipe.zincrby(ranking.ALL_TIME_KEY, missing, image.id)
+            image.total_views = views
+        # images deleted since they were viewed
+        deleted_ids = set(image_ids) - {image.id for image in images}
+        for image_id in deleted_ids:
+            pipe.delete(views_key(image_id))
+            pipe.zrem(ranking.ALL_TIME_KEY, image_id)
+        pipe.execute()
+
+        updated += Image.objects.bulk_update(images, ['total_views'])
+
+
+def prune_ranking(batch_size=1000):
+    """
+    Remove the images that don't exist anymore from the ranking. Return the number of images removed.
+    """
+    removed = 0
+    ranked_ids = []
+    # ZSCAN walks the sorted set in small steps instead of loading it at once
+    for member, score in redis_client.r.zscan_iter(ranking.ALL_TIME_KEY, count=batch_size):
+        ranked_ids.append(int(member))
+        if len(ranked_ids) >= batch_size:
+            removed += _remove_deleted(ranked_ids)
+            ranked_ids = []
+    if ranked_ids:
+        removed += _remove_deleted(ranked_ids)
+    return removed
+
+
+def _remove_deleted(image_ids):
+    existing_ids = set(Image.objects.filter(id__in=image_ids).values_list('id', flat=True))
+    deleted_ids = [image_id for image_id in image_ids if image_id not in existing_ids]
+    if deleted_ids:
+        pipe = redis_client.r.pipeline(transaction=False)
+        pipe.zrem(ranking.ALL_TIME_KEY, *deleted_ids)
+        pipe.delete(*[views_key(image_id) for image_id in deleted_ids])
+        pipe.execute()
+    return len(deleted_ids)
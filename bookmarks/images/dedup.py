@@ -0,0 +1,116 @@
+import heapq
+
+from django.conf import settings
+from django.db.models import Q
+from PIL import Image as PILImage
+
+from .models import Image, UrlFetch
+
+# Near-duplicate detection.
+#
+# The dHash of a picture is a 64-bit fingerprint of its gradients: the picture is reduced to 9x8 grey pixels
+# and every bit tells if a pixel is brighter than its right neighbour. Resized or recompressed copies of a
+# picture get the same hash or one that differs in a few bits (small Hamming distance).
+#
+# Comparing the hash with every image would scan the whole table, so the hash is also stored as four 16-bit
+# chunks (Image.dhash_0..dhash_3), each one indexed. If two hashes differ in at most 3 bits, at least one of
+# their four chunks is identical, so the candidates are the images sharing a chunk (4 index lookups) and
+# only those are compared bit by bit ("multi-index hashing").
+
+HASH_SIZE = 8
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+
+
+def dhash(fileobj):
+    """
+    Return the 64-bit difference hash of an image file as an unsigned integer.
+    """
+    with PILImage.open(fileobj) as picture:
+        picture = picture.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), PILImage.LANCZOS)
+        pixels = list(picture.getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        for column in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + column]
+            right = pixels[row * (HASH_SIZE + 1) + column + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def to_signed(value):
+    # BigIntegerField is a signed 64-bit integer
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def chunks(value):
+    value &= (1 << 64) - 1
+    return [(value >> (CHUNK_BITS * i)) & ((1 << CHUNK_BITS) - 1) for i in range(CHUNKS)]
+
+
+def hash_fields(value):
+    """
+    Return the values of the Image hash fields for an unsigned hash.
+    """
+    fields = {'dhash': to_signed(value)}
+    for i, chunk in enumerate(chunks(value)):
+        fields[f'dhash_{i}'] = chunk
+    return fields
+
+
+def distance(a, b):
+    return bin((a ^ b) & ((1 << 64) - 1)).count('1')
+
+
+def find_duplicates(value, exclude_id=None, limit=5):
+    """
+    Return the images whose hash is within DUPLICATE_MAX_DISTANCE bits of value, closest first.
+    """
+    lookup = Q()
+    for i, chunk in enumerate(chunks(value)):
+        lookup |= Q(**{f'dhash_{i}': chunk})
+    candidates = Image.objects.filter(lookup)
+    if exclude_id is not None:
+        candidates = candidates.exclude(id=exclude_id)
+    # A common chunk (blank or uniform pictures, a URL bookmarked many times) can match a large part of the table:
+    # only the ids and hashes of at most DUPLICATE_MAX_CANDIDATES candidates are read (order_by() drops the
+    # default ordering, which would sort them all first), and only the closest images are loaded.
+    rows = candidates.order_by().values_list('id', 'dhash')[:settings.DUPLICATE_MAX_CANDIDATES]
+    matches = []
+    for image_id, candidate in rows.iterator():
+        bits = distance(value, candidate)
+        if bits <= settings.DUPLICATE_MAX_DISTANCE:
+            matches.append((bits, image_id))
+    closest = [image_id for bits, image_id in heapq.nsmallest(limit, matches)]
+    images = Image.objects.select_related('user').in_bulk(closest)
+    return [images[image_id] for image_id in closest if image_id in images]
+
+
+def duplicates_for_url(url, limit=5):
+    """
+    Return the images that look like the picture at url, if the URL has already been downloaded.
+    """
+    fetch = UrlFetch.objects.filter(url_hash=UrlFetch.hash_url(url)).first()
+    if fetch is None:
+        return []
+    value = Image.objects.filter(
+        blob_id=fetch.blob_id, dhash__isnull=False
+    ).values_list('dhash', flat=True).first()
+    if value is None:
+        return []
+    return find_duplicates(value, limit=limit)
+
+
+def compute_image_hash(pk):
+    """
+    Compute and return (pk, hash fields) of an image, or (pk, None) if its file can't be read.
+    Runs in the worker processes of `manage.py backfill_dhash`.
+    """
+    image = Image.objects.filter(pk=pk).only('image').first()
+    if image is None or not image.image:
+        return pk, None
+    try:
+        with image.image.open('rb') as fileobj:
+            return pk, hash_fields(dhash(fileobj))
+    except Exception:
+        return pk, None
@@ -1,8 +1,5 @@
 from django import forms
 from .models import Image
-import requests
-from django.core.files.base import ContentFile
-from django.utils.text import slugify
 
 
 class ImageCreateForm(forms.ModelForm):
@@ -16,7 +13,7 @@ class ImageCreateForm(forms.ModelForm):
     def clean_url(self):
         url = self.cleaned_data['url']
         valid_extensions = ['jpg', 'jpeg', 'png']
-        extension = url.rsplit('.', 1)[1].lower()
+        extension = url.rsplit('.', 1)[-1].lower()
         # The rsplit() method splits the URL from the right side on the last dot to get the file extension.
         # For example, "http://example.com/photo.jpg" becomes "jpg".
         if extension not in valid_extensions:
@@ -28,22 +25,10 @@ class ImageCreateForm(forms.ModelForm):
         # it creates an image object but doesn't save it to the database yet
         image = super().save(commit=False)
 
-        # processes the image URL and creates a filename
-        image_url = self.cleaned_data['url']
-        name = slugify(image.title)
-        extension = image_url.rsplit('.', 1)[1].lower()
-        image_name = f'{name}.{extension}'
-
-        #  The Requests Python library is used to download the image by sending an HTTP GET request
-        # using the image URL. The response is stored in the response object.
-        # The requests.get() downloads the image content, and ContentFile wraps the binary content
-        # so Django can save it as a file. The image is saved to your configured media storage
-        # using the generated filename.
-        response = requests.get(image_url)
-        # only save the image file, not the whole model, to counterpart the integrity error
-        image.image.save(image_name, ContentFile(response.content), save=False)
-        # The first 'image' refers to model instance
-        # The second 'image' refers to the ImageField attribute in your model
+        # The file is not downloaded here: the image is saved as pending and the view queues
+        # a background job (images/ingest.py) that downloads it with a timeout and retries.
+        # This keeps slow third-party hosts out of the request/response cycle.
+        image.status = Image.Status.PENDING
 
         # let the view handle the final save
         if commit:
@@ -0,0 +1,19 @@
+from django.template.loader import render_to_string
+
+from bookmarks.fragments import cached_fragments
+
+
+def image_card_key(image):
+    # Image.version changes on Image.save() and on every like, see Image.save() and signals.py
+    return f'fragment:image_card:{image.id}:{image.version}'
+
+
+def render_image_card(image):
+    return render_to_string('images/image/image_card.html', {'image': image})
+
+
+def render_image_cards(images):
+    """
+    Return the HTML of the cards of the images, from the cache when possible.
+    """
+    return cached_fragments(images, image_card_key, render_image_card)
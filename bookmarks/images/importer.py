@@ -0,0 +1,225 @@
+import csv
+import json
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import close_old_connections, transaction
+from django.utils.text import slugify
+
+from actions import feed
+from actions.models import Action
+from .forms import ImageCreateForm
+from .models import SLUG_BASE_MAX_LENGTH, Blob, Image, ImageIngestJob, ImageSlugCounter
+from .thumbnails import queue_thumbnails
+from . import ingest, search
+
+# Bulk import of an existing collection (`manage.py import_bookmarks`).
+#
+# Going through image_create for every row would cost a slug reservation, an INSERT, a job and an action per
+# image, one request at a time. The importer reads the file as a stream and handles it in chunks:
+#
+#   - the rows are validated with ImageCreateForm, like the bookmarklet form
+#   - the files are downloaded by a bounded pool of threads; the threads keep their requests.Session
+#     (images/ingest.py) for the whole import, so the connections to a host are reused between downloads
+#   - the slugs of a chunk are reserved with one ImageSlugCounter update per title
+#   - the images, their actions and the jobs of the failed downloads are written with bulk_create(),
+#     in one transaction per chunk
+#
+# bulk_create() sends no post_save signal, so the importer does what the signal receivers do itself: it
+# indexes the images for the search and queues their thumbnails.
+#
+# A download that fails doesn't fail the import: the image is created as pending with an ImageIngestJob and
+# the ingestion workers (manage.py run_ingest_workers) retry it with backoff.
+#
+# After every chunk the number of rows read is saved in a checkpoint file, so an interrupted import resumes
+# after the last committed chunk. URLs the user already bookmarked are skipped, so a chunk committed just
+# before a crash (and before its checkpoint) isn't imported twice.
+
+
+def read_rows(path, format=None):
+    """
+    Yield the rows of a CSV file (with a title,url,description header) or of a JSON Lines file as dicts.
+    """
+    format = format or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    with open(path, newline='', encoding='utf-8') as f:
+        if format == 'csv':
+            yield from csv.DictReader(f)
+            return
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            # an invalid line is still a row, so the row numbers of the checkpoint don't depend on its content
+            yield row if isinstance(row, dict) else {}
+
+
+def read_checkpoint(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_checkpoint(path, state):
+    # written next to the checkpoint and renamed, so a crash never leaves half a file
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+class ImportStats:
+    def __init__(self, rows=0, imported=0, pending=0, invalid=0, duplicates=0):
+        self.rows = rows                # rows read, including those of the previous runs
+        self.imported = imported        # images created
+        self.pending = pending          # images created whose download failed (queued for the workers)
+        self.invalid = invalid          # rows rejected by ImageCreateForm
+        self.duplicates = duplicates    # URLs the user had already bookmarked
+        self.started = time.perf_counter()
+        self.rows_at_start = rows
+
+    def as_dict(self):
+        return {
+            'rows': self.rows, 'imported': self.imported, 'pending': self.pending,
+            'invalid': self.invalid, 'duplicates': self.duplicates,
+        }
+
+    def rate(self):
+        """
+        Rows per second handled by this run.
+        """
+        elapsed = time.perf_counter() - self.started
+        return (self.rows - self.rows_at_start) / elapsed if elapsed else 0
+
+
+def chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def fetch(url):
+    """
+    Download url (if it was never fetched) in a worker thread. Return (blob, error).
+    """
+    try:
+        return ingest.acquire_blob(url), None
+    except Exception as e:
+        return None, e
+    finally:
+        # the worker threads open their own database connections; don't let them go stale
+        close_old_connections()
+
+
+def build_images(user, chunk, stats):
+    """
+    Validate the rows of a chunk and return the new (unsaved) images, without the URLs already bookmarked.
+    """
+    images = []
+    for row in chunk:
+        form = ImageCreateForm(data={key: row.get(key) or '' for key in ('title', 'url', 'description')})
+        if not form.is_valid():
+            stats.invalid += 1
+            continue
+        image = form.save(commit=False)
+        image.user = user
+        images.append(image)
+
+    # one query for the whole chunk instead of one per row
+    bookmarked = set(
+        Image.objects.filter(user=user, url__in={image.url for image in images}).values_list('url', flat=True)
+    )
+    new_images = []
+    for image in images:
+        if image.url in bookmarked:
+            stats.duplicates += 1
+            continue
+        # the same URL twice in the file counts once
+        bookmarked.add(image.url)
+        new_images.append(image)
+    return new_images
+
+
+def reserve_slugs(images):
+    """
+    Set the slug of every image, reserving the slugs of all the images with the same title at once.
+    """
+    by_base = defaultdict(list)
+    for image in images:
+        by_base[slugify(image.title)[:SLUG_BASE_MAX_LENGTH].strip('-') or 'image'].append(image)
+    for base, same_base in by_base.items():
+        for image, slug in zip(same_base, ImageSlugCounter.reserve(base, len(same_base))):
+            image.slug = slug
+
+
+def import_chunk(user, chunk, executor, stats):
+    images = build_images(user, chunk, stats)
+    if not images:
+        return
+    jobs = []
+    for image, (blob, error) in zip(images, executor.map(fetch, [image.url for image in images])):
+        if blob is not None:
+            ingest.attach_blob(image, blob)
+        else:
+            # image_create does the same for every image: the workers download the file later
+            image.status = Image.Status.PENDING
+            jobs.append(ImageIngestJob(image=image, last_error=str(error)))
+        # what Image.save() does for a new image
+        image.version = 1
+    target_ct = ContentType.objects.get_for_model(Image)
+    try:
+        reserve_slugs(images)
+        with transaction.atomic():
+            # on SQLite and PostgreSQL bulk_create() sets the primary keys of the new images
+            Image.objects.bulk_create(images)
+            ImageIngestJob.objects.bulk_create(jobs)
+            actions = Action.objects.bulk_create([
+                Action(user=user, verb='bookmarked image', target_ct=target_ct, target_id=image.id)
+                for image in images
+            ])
+            # the work of the post_save receivers of images/signals.py
+            search.get_backend().index_many(images)
+            for image in images:
+                queue_thumbnails(image, 'image')
+    except Exception:
+        # the images weren't created: give back the references acquire_blob() took for them
+        for image in images:
+            if image.blob_id:
+                Blob.release(image.blob_id)
+        raise
+    feed.push_actions(user.id, actions)
+
+    stats.imported += len(images)
+    stats.pending += len(jobs)
+
+
+def import_bookmarks(user, rows, chunk_size=500, concurrency=None, stats=None, on_chunk=None):
+    """
+    Import the rows (dicts with title, url and description) as images of the user, skipping the first
+    stats.rows rows (already imported by a previous run). on_chunk(stats) is called after every committed chunk.
+    """
+    stats = stats or ImportStats()
+    rows = iter(rows)
+    for _ in range(stats.rows):
+        if next(rows, None) is None:
+            break
+    with ThreadPoolExecutor(max_workers=concurrency or settings.INGEST_CONCURRENCY) as executor:
+        for chunk in chunked(rows, chunk_size):
+            import_chunk(user, chunk, executor, stats)
+            stats.rows += len(chunk)
+            if on_chunk is not None:
+                on_chunk(stats)
+    return stats
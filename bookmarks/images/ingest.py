@@ -0,0 +1,227 @@
+import datetime
+import hashlib
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Blob, Image, ImageIngestJob, UrlFetch
+from . import dedup
+
+# Background image ingestion.
+#
+# image_create() only stores a pending Image and queues an ImageIngestJob, so the web request never waits
+# for a third-party host. The workers started by `manage.py run_ingest_workers` claim queued jobs,
+# download the files with pooled HTTP sessions and retry failed downloads with exponential backoff.
+#
+# Files are stored once per content (Blob) and every URL remembers the blob it was downloaded to (UrlFetch):
+# bookmarking a URL that was already fetched doesn't download anything, and two URLs serving the same
+# bytes share the same file.
+
+# One requests.Session per worker thread: sessions keep TCP/TLS connections alive between downloads,
+# but they are not guaranteed to be thread-safe, so they are not shared between threads.
+_local = threading.local()
+
+
+def get_session():
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=settings.INGEST_CONCURRENCY,
+            pool_maxsize=settings.INGEST_CONCURRENCY,
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _local.session = session
+    return session
+
+
+def enqueue(image):
+    """
+    Queue the download of a pending image.
+    """
+    return ImageIngestJob.objects.create(image=image)
+
+
+def download(url, fileobj):
+    """
+    Download a file into fileobj with a timeout and a size limit.
+    The content is hashed while it is written, so it is read only once. Return (sha256, size).
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with get_session().get(url, timeout=settings.INGEST_TIMEOUT, stream=True) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            size += len(chunk)
+            if size > settings.INGEST_MAX_BYTES:
+                raise ValueError(f'The image is larger than {settings.INGEST_MAX_BYTES} bytes.')
+            digest.update(chunk)
+            fileobj.write(chunk)
+    return digest.hexdigest(), size
+
+
+def store_blob(url):
+    """
+    Download url and return the Blob with its content, storing the file only if the content is new.
+    """
+    # small files stay in memory, larger ones are written to a temporary file
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as tmp:
+        sha256, size = download(url, tmp)
+        blob = Blob.objects.filter(sha256=sha256).first()
+        if blob is not None:
+            return blob
+        blob = Blob(sha256=sha256, size=size)
+        tmp.seek(0)
+        extension = url.rsplit('.', 1)[1].lower()
+        blob.file.save(f'{sha256}.{extension}', File(tmp), save=False)
+    try:
+        with transaction.atomic():
+            blob.save()
+    except IntegrityError:
+        # another worker stored the same content in the meantime
+        blob.file.delete(save=False)
+        blob = Blob.objects.get(sha256=sha256)
+    return blob
+
+
+def acquire_blob(url):
+    """
+    Return the Blob with the content of url, with a reference added for the image that is going to use it.
+    The file is only downloaded if the URL was never fetched before.
+    """
+    key = UrlFetch.hash_url(url)
+    fetch = UrlFetch.objects.filter(url_hash=key).select_related('blob').first()
+    blob = fetch.blob if fetch is not None else None
+    # acquire() fails if `manage.py gc_blobs` deleted the blob since it was read; download it again then
+    if blob is None or not blob.acquire():
+        blob = store_blob(url)
+        if not blob.acquire():
+            raise ValueError('The stored file was deleted while it was being used.')
+        # a single INSERT ... ON CONFLICT DO UPDATE: update_or_create() reads and then writes in a transaction,
+        # which SQLite refuses (database is locked) when another thread writes at the same time
+        UrlFetch.objects.bulk_create(
+            [UrlFetch(url_hash=key, url=url, blob=blob)],
+            update_conflicts=True, unique_fields=['url_hash'], update_fields=['url', 'blob', 'fetched']
+        )
+    return blob
+
+
+def attach_blob(image, blob):
+    """
+    Make the image use the file of the blob (nothing is copied) and return the fields that changed.
+    """
+    image.blob = blob
+    image.image.name = blob.file.name
+    image.status = Image.Status.READY
+    update_fields = ['image', 'blob', 'status']
+    # the perceptual hash used to find other bookmarks of the same picture
+    try:
+        with blob.file.open('rb') as fileobj:
+            hash_fields = dedup.hash_fields(dedup.dhash(fileobj))
+    except Exception:
+        # not an image Pillow can read; the image is still stored, it just can't be matched
+        pass
+    else:
+        for field, value in hash_fields.items():
+            setattr(image, field, value)
+        update_fields += list(hash_fields)
+    return update_fields
+
+
+def fetch_image(image):
+    blob = acquire_blob(image.url)
+    try:
+        # in a savepoint, so the reference can still be released when the caller runs in a transaction
+        with transaction.atomic():
+            image.save(update_fields=attach_blob(image, blob))
+    except Exception:
+        # the image doesn't use the blob (it was deleted while the job ran, ...): give the reference back,
+        # `manage.py gc_blobs` never lowers a count and would keep the file forever
+        Blob.release(blob.id)
+        raise
+
+
+def retry_delay(attempts):
+    # 30s, 60s, 120s, ... with the default INGEST_RETRY_DELAY
+    return datetime.timedelta(seconds=settings.INGEST_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def claim_jobs(limit):
+    """
+    Mark up to `limit` runnable jobs as running and return them.
+    A job is claimed with a conditional UPDATE, so two workers never process the same job.
+    """
+    now = timezone.now()
+    stale = now - datetime.timedelta(seconds=settings.INGEST_JOB_TIMEOUT)
+    candidates = ImageIngestJob.objects.filter(
+        Q(status=ImageIngestJob.Status.QUEUED, run_after__lte=now) |
+        Q(status=ImageIngestJob.Status.RUNNING, locked_at__lt=stale)
+    ).values_list('id', 'status', 'locked_at')[:limit]
+
+    claimed = []
+    for job_id, status, locked_at in candidates:
+        updated = ImageIngestJob.objects.filter(
+            id=job_id, status=status, locked_at=locked_at
+        ).update(
+            status=ImageIngestJob.Status.RUNNING,
+            locked_at=now,
+            attempts=F('attempts') + 1
+        )
+        if updated:
+            claimed.append(job_id)
+    return list(ImageIngestJob.objects.filter(id__in=claimed).select_related('image'))
+
+
+def process_job(job):
+    try:
+        try:
+            fetch_image(job.image)
+        except Exception as e:
+            job.last_error = str(e)
+            if job.attempts < settings.INGEST_MAX_ATTEMPTS:
+                # try again later
+                job.status = ImageIngestJob.Status.QUEUED
+                job.run_after = timezone.now() + retry_delay(job.attempts)
+            else:
+                job.status = ImageIngestJob.Status.FAILED
+                Image.objects.filter(id=job.image_id).update(status=Image.Status.FAILED)
+        else:
+            job.status = ImageIngestJob.Status.DONE
+        job.locked_at = None
+        # update() instead of save(): if the image was deleted while the job ran, its job row was deleted with it
+        # and there is nothing to write (save(update_fields=...) would raise and stop the worker)
+        ImageIngestJob.objects.filter(pk=job.pk).update(
+            status=job.status, run_after=job.run_after, locked_at=None, last_error=job.last_error
+        )
+    finally:
+        # worker threads open their own database connections; don't let them go stale
+        close_old_connections()
+    return job
+
+
+def run_workers(concurrency=None, once=False, poll_interval=1):
+    """
+    Process jobs with a bounded pool of worker threads.
+    With once=True it returns when there are no runnable jobs left.
+    """
+    concurrency = concurrency or settings.INGEST_CONCURRENCY
+    processed = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            jobs = claim_jobs(concurrency)
+            if not jobs:
+                if once:
+                    return processed
+                time.sleep(poll_interval)
+                continue
+            processed += len(list(executor.map(process_job, jobs)))
@@ -0,0 +1,46 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from images.dedup import compute_image_hash
+from images.models import Image
+from images.thumbnails import init_worker
+
+
+class Command(BaseCommand):
+    help = 'Compute the perceptual hash of the images stored before duplicate detection existed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.THUMBNAIL_WORKERS,
+                            help='Number of processes hashing images.')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of hashes written per UPDATE batch.')
+
+    def handle(self, *args, **options):
+        pks = list(
+            Image.objects.filter(dhash__isnull=True).exclude(image='').values_list('pk', flat=True)
+        )
+        if not pks:
+            self.stdout.write('There are no images to hash.')
+            return
+        # the worker processes must not inherit the open database connection
+        connections.close_all()
+
+        fields = ['dhash', 'dhash_0', 'dhash_1', 'dhash_2', 'dhash_3']
+        batch = []
+        hashed = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=init_worker) as executor:
+            for pk, values in executor.map(compute_image_hash, pks, chunksize=20):
+                if values is None:
+                    failed += 1
+                    continue
+                batch.append(Image(pk=pk, **values))
+                if len(batch) >= options['batch_size']:
+                    hashed += Image.objects.bulk_update(batch, fields)
+                    batch = []
+                    self.stdout.write(f'{hashed + failed}/{len(pks)} images')
+        if batch:
+            hashed += Image.objects.bulk_update(batch, fields)
+        self.stdout.write(self.style.SUCCESS(f'Hashed {hashed} images ({failed} could not be read).'))
@@ -0,0 +1,52 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from easy_thumbnails.files import get_thumbnailer
+
+from images.models import Blob, Image
+
+
+class Command(BaseCommand):
+    help = 'Delete the stored files (blobs) that are not used by any image anymore.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age', type=int, default=3600,
+            help='Keep blobs created less than MIN_AGE seconds ago (they may be about to be used).'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted.')
+
+    def handle(self, *args, **options):
+        # Raise the reference counts that are lower than the number of images first, so a blob still in use
+        # is never deleted. Higher counts are left alone: a worker may have acquired the blob and not yet
+        # saved its image.
+        image_count = Image.objects.filter(
+            blob_id=OuterRef('pk')
+        ).order_by().values('blob_id').annotate(total=Count('id')).values('total')
+        drifted = Blob.objects.annotate(
+            actual=Coalesce(Subquery(image_count), 0)
+        ).filter(refcount__lt=F('actual'))
+        for blob in drifted.only('id'):
+            Blob.objects.filter(pk=blob.pk).update(refcount=Greatest(F('refcount'), blob.actual))
+
+        cutoff = timezone.now() - datetime.timedelta(seconds=options['min_age'])
+        unused = Blob.objects.filter(refcount=0, created__lt=cutoff, images__isnull=True)
+        deleted = 0
+        freed = 0
+        for blob in unused.iterator():
+            if options['dry_run']:
+                deleted += 1
+                freed += blob.size
+                continue
+            # refcount=0 in the DELETE itself: an ingest worker may have acquired the blob since it was read
+            if Blob.objects.filter(pk=blob.pk, refcount=0).delete()[1].get('images.Blob'):
+                get_thumbnailer(blob.file).delete_thumbnails()
+                blob.file.delete(save=False)
+                deleted += 1
+                freed += blob.size
+
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {deleted} blobs ({freed} bytes).'))
@@ -0,0 +1,41 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from account.models import Profile
+from images.models import Image
+from images.thumbnails import init_worker, generate_thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Create the thumbnails of every alias for the existing images and profile photos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=settings.THUMBNAIL_WORKERS,
+            help='Number of processes generating thumbnails.'
+        )
+
+    def handle(self, *args, **options):
+        jobs = [
+            (Image._meta.label, pk, 'image')
+            for pk in Image.objects.exclude(image='').values_list('pk', flat=True).iterator()
+        ] + [
+            (Profile._meta.label, pk, 'photo')
+            for pk in Profile.objects.exclude(photo='').values_list('pk', flat=True).iterator()
+        ]
+        if not jobs:
+            self.stdout.write('There are no files to process.')
+            return
+        # the worker processes must not inherit the open database connection
+        connections.close_all()
+
+        done = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=init_worker) as executor:
+            for _ in executor.map(generate_thumbnails, *zip(*jobs), chunksize=20):
+                done += 1
+                if done % 100 == 0:
+                    self.stdout.write(f'{done}/{len(jobs)} files')
+        self.stdout.write(self.style.SUCCESS(f'Generated the thumbnails of {done} files.'))
@@ -0,0 +1,63 @@
+import os
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from images import importer
+
+
+class Command(BaseCommand):
+    help = 'Import a collection of bookmarks (CSV or JSON Lines rows of title, url, description) for a user.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file with a title,url,description header, or a .jsonl file.')
+        parser.add_argument('--user', required=True, help='Username of the owner of the imported images.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Format of the file (by default .jsonl/.ndjson files are JSON Lines, others CSV).')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Number of rows downloaded and written to the database at once.')
+        parser.add_argument('--concurrency', type=int,
+                            help='Number of parallel downloads (defaults to INGEST_CONCURRENCY).')
+        parser.add_argument('--checkpoint',
+                            help='File recording the progress of the import (defaults to PATH.checkpoint).')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore the checkpoint and read the file from the start.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'{path} does not exist.')
+        try:
+            user = get_user_model().objects.get(username=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'There is no user {options["user"]}.')
+
+        checkpoint = options['checkpoint'] or f'{path}.checkpoint'
+        state = None if options['restart'] else importer.read_checkpoint(checkpoint)
+        if state is not None:
+            if state.get('user') != user.username:
+                raise CommandError(f'{checkpoint} belongs to the import of another user; use --restart.')
+            self.stdout.write(f'Resuming after row {state["stats"]["rows"]}.')
+            stats = importer.ImportStats(**state['stats'])
+        else:
+            stats = importer.ImportStats()
+
+        def on_chunk(stats):
+            importer.write_checkpoint(checkpoint, {'user': user.username, 'stats': stats.as_dict()})
+            self.stdout.write(
+                f'{stats.rows} rows: {stats.imported} imported ({stats.pending} queued for download), '
+                f'{stats.duplicates} duplicates, {stats.invalid} invalid - {stats.rate():.1f} rows/s'
+            )
+
+        stats = importer.import_bookmarks(
+            user,
+            importer.read_rows(path, options['format']),
+            chunk_size=options['chunk_size'],
+            concurrency=options['concurrency'],
+            stats=stats,
+            on_chunk=on_chunk,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {stats.imported} images from {stats.rows} rows at {stats.rate():.1f} rows/s '
+            f'({stats.pending} downloads queued for run_ingest_workers).'
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from images import search
+
+
+class Command(BaseCommand):
+    help = 'Index every image again with the backend set in IMAGE_SEARCH_BACKEND.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of images read and indexed at once.')
+
+    def handle(self, *args, **options):
+        indexed = search.get_backend().rebuild(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} images.'))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from images.models import Image
+
+
+class Command(BaseCommand):
+    help = 'Recount Image.total_likes from the users_like table and fix the images that drifted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        Like = Image.users_like.through
+        # number of like rows of each image, computed by the database in a correlated subquery
+        like_count = Like.objects.filter(
+            image_id=OuterRef('pk')
+        ).order_by().values('image_id').annotate(total=Count('id')).values('total')
+
+        drifted = Image.objects.annotate(
+            actual_likes=Coalesce(Subquery(like_count), 0)
+        ).exclude(
+            total_likes=F('actual_likes')
+        ).only('id', 'total_likes')
+
+        batch = []
+        fixed = 0
+        for image in drifted.iterator(chunk_size=options['batch_size']):
+            image.total_likes = image.actual_likes
+            batch.append(image)
+            if len(batch) >= options['batch_size']:
+                fixed += Image.objects.bulk_update(batch, ['total_likes'])
+                batch = []
+        if batch:
+            fixed += Image.objects.bulk_update(batch, ['total_likes'])
+
+        self.stdout.write(self.style.SUCCESS(f'Fixed the like count of {fixed} images.'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from images import ingest
+
+
+class Command(BaseCommand):
+    help = 'Download the files of bookmarked images queued by image_create.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int,
+            help='Number of parallel downloads (defaults to INGEST_CONCURRENCY).'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit when there are no runnable jobs left instead of polling for new ones.'
+        )
+
+    def handle(self, *args, **options):
+        processed = ingest.run_workers(
+            concurrency=options['concurrency'],
+            once=options['once']
+        )
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} jobs.'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from images import counters
+
+
+class Command(BaseCommand):
+    help = 'Save the view counters kept in Redis into Image.total_views and drop deleted images from the ranking.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        updated = counters.sync_views(options['batch_size'])
+        removed = counters.prune_ranking(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Saved the views of {updated} images, removed {removed} deleted images from the ranking.'
+        ))
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0004_imageslugcounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='total_views',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
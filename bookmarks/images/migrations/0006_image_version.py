@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 17:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0005_image_total_views'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations
+
+
+# FTS5 virtual table used by images.search.SQLiteFTSBackend; its rowid is the id of the image.
+# Other databases use another IMAGE_SEARCH_BACKEND, so nothing is created for them.
+def create_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS images_image_fts "
+        "USING fts5(title, description, tokenize='porter unicode61')"
+    )
+    # index the existing images
+    schema_editor.execute(
+        'INSERT INTO images_image_fts (rowid, title, description) '
+        'SELECT id, title, description FROM images_image'
+    )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS images_image_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0006_image_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -1,16 +1,30 @@
-from django.db import models
+import hashlib
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
 from django.conf import settings
 from django.utils.text import slugify
 from django.urls import reverse
+from django.utils import timezone
+
+
+# leaves room for a "-<number>" suffix within the 200 characters of Image.slug
+SLUG_BASE_MAX_LENGTH = 188
 
 
 class Image(models.Model):
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'  # waiting for the background worker to download the file
+        READY = 'ready', 'Ready'
+        FAILED = 'failed', 'Failed'
+
     user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='images_created',
                              on_delete=models.CASCADE)
     title = models.CharField(max_length=200)
     slug = models.SlugField(max_length=200, blank=True, unique=True)
     url = models.URLField(max_length=2000)
-    image = models.ImageField(upload_to='images/%Y/%m/%d/')
+    image = models.ImageField(upload_to='images/%Y/%m/%d/', blank=True)
     # In Django models, when you define an ImageField, it creates an attribute that handles file uploads.
     description = models.TextField(blank=True)
     created = models.DateTimeField(auto_now_add=True)
@@ -21,11 +35,29 @@ class Image(models.Model):
     )
     # Denormalization counts example
     total_likes = models.PositiveIntegerField(default=0)    # to store the total count of users who like each image.
+    # Copy of the view counter kept in Redis, written by `manage.py sync_image_views`
+    total_views = models.PositiveIntegerField(default=0)
+    # Incremented on every change shown on the image card; part of the key of its cached HTML (images/fragments.py)
+    version = models.PositiveIntegerField(default=0)
+    # The file is downloaded by the ingestion workers (images/ingest.py), not during the request.
+    status = models.CharField(max_length=10, choices=Status, default=Status.READY)
+    # The stored file shared with the other images of the same content; image.image points to blob.file.
+    blob = models.ForeignKey('Blob', related_name='images', null=True, blank=True, on_delete=models.SET_NULL)
+    # Perceptual hash of the picture and its four 16-bit chunks, used to find near-duplicates (images/dedup.py)
+    dhash = models.BigIntegerField(null=True, blank=True)
+    dhash_0 = models.PositiveIntegerField(null=True, blank=True)
+    dhash_1 = models.PositiveIntegerField(null=True, blank=True)
+    dhash_2 = models.PositiveIntegerField(null=True, blank=True)
+    dhash_3 = models.PositiveIntegerField(null=True, blank=True)
 
     class Meta:
         indexes = [
             models.Index(fields=['-created']),
             models.Index(fields=['-total_likes']),
+            models.Index(fields=['dhash_0']),
+            models.Index(fields=['dhash_1']),
+            models.Index(fields=['dhash_2']),
+            models.Index(fields=['dhash_3']),
         ]
         ordering = ['-created']
     #     Database indexes improve query performance. Consider creating indexes for fields that you frequently
@@ -39,13 +71,16 @@ class Image(models.Model):
         if not self.slug:   # Generate slug only if it's not already set (for new images).
             # Convert title to URL-friendly format
             # Example: "My Blog Post" -> "my-blog-post"
-            base_slug = slugify(self.title)
-            counter = 1
-            while Image.objects.filter(slug=base_slug).exists():    # check for uniqueness of the slug
-                # Append counter for uniqueness
-                base_slug = f'{base_slug}-{counter}'
-                counter += 1
-            self.slug = base_slug
+            base_slug = slugify(self.title)[:SLUG_BASE_MAX_LENGTH].strip('-') or 'image'
+            # Images with the same title get "my-blog-post", "my-blog-post-1", "my-blog-post-2", ...
+            # The next number is kept in ImageSlugCounter, so this costs the same few queries
+            # no matter how many images already use the title.
+            self.slug = ImageSlugCounter.reserve(base_slug)[0]
+
+        # a new version makes the cached card of the image out of date
+        self.version += 1
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
 
         # call parent class's save() method
         super().save(*args, **kwargs)
@@ -54,3 +89,142 @@ class Image(models.Model):
 
     def get_absolute_url(self):
         return reverse('images:detail', args=[self.id, self.slug])
+
+
+
+# The next free number for every slug base, e.g. base="my-blog-post", last=3 means that
+# "my-blog-post", "my-blog-post-1" and "my-blog-post-2" have been handed out.
+class ImageSlugCounter(models.Model):
+    base = models.SlugField(max_length=200, unique=True)
+    last = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.base} ({self.last})'
+
+    @staticmethod
+    def first_free_number(base):
+        """
+        Find the first number after the slugs already used for base (used once, when the counter is created).
+        Number 0 stands for the base slug itself.
+        """
+        slugs = Image.objects.filter(
+            Q(slug=base) | Q(slug__startswith=f'{base}-')
+        ).values_list('slug', flat=True)
+        highest = -1
+        for slug in slugs.iterator():
+            suffix = slug[len(base) + 1:]
+            if slug == base:
+                highest = max(highest, 0)
+            elif suffix.isdigit():
+                highest = max(highest, int(suffix))
+        return highest + 1
+
+    @classmethod
+    def reserve(cls, base, count=1):
+        """
+        Return `count` unused slugs for base.
+        """
+        slugs = []
+        while len(slugs) < count:
+            needed = count - len(slugs)
+            with transaction.atomic():
+                # The UPDATE locks the counter row until the end of the transaction,
+                # so concurrent saves get different numbers instead of an IntegrityError.
+                updated = cls.objects.filter(base=base).update(last=F('last') + needed)
+                if not updated:
+                    try:
+                        with transaction.atomic():
+                            cls.objects.create(base=base, last=cls.first_free_number(base) + needed)
+                    except IntegrityError:
+                        # another request created the counter in the meantime
+                        cls.objects.filter(base=base).update(last=F('last') + needed)
+                last = cls.objects.values_list('last', flat=True).get(base=base)
+
+            candidates = [
+                base if number == 0 else f'{base}-{number}'
+                for number in range(last - needed, last)
+            ]
+            # Slugs of other bases can look the same ("photo-2" is also the base slug of the title "Photo 2"),
+            # so skip the candidates that are already taken and reserve more numbers for them.
+            taken = set(Image.objects.filter(slug__in=candidates).values_list('slug', flat=True))
+            slugs += [slug for slug in candidates if slug not in taken]
+        return slugs
+
+
+# A durable job queue stored in the database.
+# image_create() saves a pending Image and one of these rows; the ingestion workers
+# (manage.py run_ingest_workers) claim queued jobs, download the file and retry failures with backoff.
+class ImageIngestJob(models.Model):
+    class Status(models.TextChoices):
+        QUEUED = 'queued', 'Queued'
+        RUNNING = 'running', 'Running'
+        DONE = 'done', 'Done'
+        FAILED = 'failed', 'Failed'
+
+    image = models.OneToOneField(Image, related_name='ingest_job', on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=Status, default=Status.QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # The job is not picked up before this time (used for the retry backoff)
+    run_after = models.DateTimeField(default=timezone.now)
+    # When a worker claimed the job. Jobs locked for too long belong to a dead worker and are claimed again.
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_after'])]
+        ordering = ['run_after']
+
+    def __str__(self):
+        return f'Ingest job for {self.image}'
+
+
+def blob_path(blob, filename):
+    # blobs/ab/abcdef....jpg: the name only depends on the content
+    extension = filename.rsplit('.', 1)[-1].lower()
+    return f'blobs/{blob.sha256[:2]}/{blob.sha256}.{extension}'
+
+
+# Content-addressed file storage.
+# Identical files are stored once, named after the SHA-256 of their content, and shared by every Image
+# with that content. refcount is the number of images using the blob; `manage.py gc_blobs` deletes the
+# blobs nobody uses anymore.
+class Blob(models.Model):
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to=blob_path, max_length=200)
+    size = models.PositiveIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['refcount', 'created'])]
+
+    def __str__(self):
+        return self.sha256
+
+    def acquire(self):
+        """
+        Add a reference to the blob. Return False if the blob has been deleted in the meantime.
+        """
+        return Blob.objects.filter(pk=self.pk).update(refcount=F('refcount') + 1) == 1
+
+    @staticmethod
+    def release(blob_id):
+        Blob.objects.filter(pk=blob_id).update(refcount=Greatest(F('refcount') - 1, 0))
+
+
+# The blob downloaded for a URL, so bookmarking the same URL again doesn't download it again.
+# The URL is looked up by its hash: the URL itself can be longer than what a unique index accepts.
+class UrlFetch(models.Model):
+    url_hash = models.CharField(max_length=64, unique=True)
+    url = models.URLField(max_length=2000)
+    blob = models.ForeignKey(Blob, related_name='fetches', on_delete=models.CASCADE)
+    fetched = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.url
+
+    @staticmethod
+    def hash_url(url):
+        return hashlib.sha256(url.encode()).hexdigest()
+
@@ -0,0 +1,132 @@
+import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from bookmarks import redis_client
+from bookmarks.redis_client import RedisUnavailable
+from .models import Image
+
+# Image views are counted in three leaderboards (sorted sets of image id -> views):
+#
+#   image_ranking                       all-time views
+#   image_ranking:hour:<YYYYMMDDHH>     views during one hour, kept for a day
+#   image_ranking:day:<YYYYMMDD>        views during one day, kept for a week
+#
+# The rolling "day" and "week" leaderboards are the union of the last 24 hourly
+# and the last 7 daily buckets. Old buckets simply expire.
+#
+# While Redis is unavailable the ranking comes from Image.total_views, the all-time views saved by sync_views().
+ALL_TIME_KEY = 'image_ranking'
+WINDOWS = ['day', 'week', 'all']
+
+
+def hour_key(moment):
+    return f'image_ranking:hour:{moment:%Y%m%d%H}'
+
+
+def day_key(moment):
+    return f'image_ranking:day:{moment:%Y%m%d}'
+
+
+def add_view(pipe, image_id, now=None):
+    """
+    Queue the commands counting a view of the image in every leaderboard on a pipeline.
+    """
+    now = now or timezone.now()
+    pipe.zincrby(ALL_TIME_KEY, 1, image_id)
+    pipe.zincrby(hour_key(now), 1, image_id)
+    pipe.expire(hour_key(now), datetime.timedelta(hours=25))
+    pipe.zincrby(day_key(now), 1, image_id)
+    pipe.expire(day_key(now), datetime.timedelta(days=8))
+
+
+def window_keys(window, now):
+    if window == 'day':
+        return [hour_key(now - datetime.timedelta(hours=hours)) for hours in range(24)]
+    if window == 'week':
+        return [day_key(now - datetime.timedelta(days=days)) for days in range(7)]
+    return [ALL_TIME_KEY]
+
+
+def _queue_top(pipe, window, count):
+    if window == 'all':
+        key = ALL_TIME_KEY
+    else:
+        # add up the buckets of the window into a short-lived key and read its top
+        key = f'image_ranking:{window}'
+        pipe.zunionstore(key, window_keys(window, timezone.now()))
+        pipe.expire(key, 60)
+    pipe.zrange(key, 0, count - 1, desc=True, withscores=True)
+
+
+def top_ids(window='all', count=10):
+    """
+    Return the ids and scores of the `count` most viewed images in the window, most viewed first.
+    Only the top of the sorted set is read from Redis, never the whole set.
+    """
+    pipe = redis_client.r.pipeline(transaction=False)
+    _queue_top(pipe, window, count)
+    ranking = pipe.execute()[-1]
+    return [(int(image_id), int(score)) for image_id, score in ranking]
+
+
+async def atop_ids(window='all', count=10):
+    pipe = redis_client.get_async_client().pipeline(transaction=False)
+    _queue_top(pipe, window, count)
+    ranking = (await pipe.execute())[-1]
+    return [(int(image_id), int(score)) for image_id, score in ranking]
+
+
+def _database_top(count):
+    """
+    The most viewed images of all time according to the database. Used without Redis.
+    """
+    return Image.objects.order_by('-total_views')[:count]
+
+
+def top_images(window='all', count=10):
+    """
+    Return a list of (image, views) for the most viewed images in the window.
+    The result is cached for RANKING_CACHE_TIMEOUT seconds, so a warm call doesn't query the database.
+    """
+    if window not in WINDOWS:
+        window = 'all'
+    cache_key = f'image_ranking:{window}:{count}'
+    most_viewed = cache.get(cache_key)
+    if most_viewed is None:
+        try:
+            ranking = top_ids(window, count)
+        except RedisUnavailable:
+            # not cached: the ranking is read from Redis again as soon as it is back
+            return [(image, image.total_views) for image in _database_top(count)]
+        # in_bulk() returns a dictionary {id: image}, so the images can be put in ranking order
+        # with a dictionary lookup instead of searching the id list for each image
+        images = Image.objects.in_bulk([image_id for image_id, views in ranking])
+        most_viewed = [
+            (images[image_id], views) for image_id, views in ranking if image_id in images
+        ]
+        cache.set(cache_key, most_viewed, settings.RANKING_CACHE_TIMEOUT)
+    return most_viewed
+
+
+async def atop_images(window='all', count=10):
+    """
+    Async version of top_images() for the async ranking view.
+    """
+    if window not in WINDOWS:
+        window = 'all'
+    cache_key = f'image_ranking:{window}:{count}'
+    most_viewed = await cache.aget(cache_key)
+    if most_viewed is None:
+        try:
+            ranking = await atop_ids(window, count)
+        except RedisUnavailable:
+            return [(image, image.total_views) async for image in _database_top(count)]
+        images = await Image.objects.ain_bulk([image_id for image_id, views in ranking])
+        most_viewed = [
+            (images[image_id], views) for image_id, views in ranking if image_id in images
+        ]
+        await cache.aset(cache_key, most_viewed, settings.RANKING_CACHE_TIMEOUT)
+    return most_viewed
@@ -0,0 +1,168 @@
+import re
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from bookmarks.pagination import KeysetPage, decode_cursor, encode_cursor, keyset_paginate
+from .models import Image
+
+# Image search.
+#
+# The search view talks to a backend chosen with IMAGE_SEARCH_BACKEND, so the index can live somewhere else
+# (PostgreSQL, a search server, ...) without touching the views. A backend implements:
+#
+#   index(image)              add or update an image (called from the post_save signal)
+#   index_many(images)        add new images created with bulk_create(), which sends no post_save signal
+#   remove(image_id)          remove an image (called from the post_delete signal)
+#   search(query, cursor, n)  return a KeysetPage of images, best matches first
+#   rebuild(chunk_size)       index every existing image again
+#
+# SQLiteFTSBackend uses an SQLite FTS5 virtual table (created by migration 0007) whose rowid is the image id.
+# FTS5 keeps an inverted index of the words, so a search reads the matching rows only instead of scanning
+# the whole table like title__icontains would.
+
+WORD_RE = re.compile(r'\w+')
+
+
+class SearchBackend:
+    def index(self, image):
+        raise NotImplementedError
+
+    def index_many(self, images):
+        for image in images:
+            self.index(image)
+
+    def remove(self, image_id):
+        raise NotImplementedError
+
+    def search(self, query, cursor=None, per_page=12):
+        raise NotImplementedError
+
+    def rebuild(self, chunk_size=1000):
+        raise NotImplementedError
+
+
+class DatabaseSearchBackend(SearchBackend):
+    """
+    Fallback without an index: title/description icontains, newest images first.
+    """
+    def index(self, image):
+        pass
+
+    def remove(self, image_id):
+        pass
+
+    def search(self, query, cursor=None, per_page=12):
+        words = WORD_RE.findall(query)
+        if not words:
+            return KeysetPage([], None)
+        images = Image.objects.all()
+        for word in words:
+            images = images.filter(Q(title__icontains=word) | Q(description__icontains=word))
+        return keyset_paginate(images, cursor, per_page)
+
+    def rebuild(self, chunk_size=1000):
+        return 0
+
+
+class SQLiteFTSBackend(SearchBackend):
+    table = 'images_image_fts'
+    # bm25() weights of the indexed columns: a word of the title counts more than a word of the description
+    title_weight = 10.0
+    description_weight = 1.0
+
+    def index(self, image):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [image.id])
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, title, description) VALUES (%s, %s, %s)',
+                [image.id, image.title, image.description]
+            )
+
+    def index_many(self, images):
+        # the images are new, so there are no rows of theirs to delete first
+        with connection.cursor() as cursor:
+            self._insert(cursor, [(image.id, image.title, image.description) for image in images])
+
+    def remove(self, image_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [image_id])
+
+    @staticmethod
+    def match_expression(query):
+        # Every word becomes a quoted prefix query ("sun"* matches "sunset"), so the operators and quotes of
+        # the FTS5 query syntax typed by users can't make the query invalid.
+        return ' '.join(f'"{word}"*' for word in WORD_RE.findall(query))
+
+    def search(self, query, cursor=None, per_page=12):
+        """
+        Ranked keyset pagination: the page starts after the (rank, id) of the last row of the previous page.
+        bm25() is computed in the subquery, so the outer query can filter and sort on it.
+        """
+        expression = self.match_expression(query)
+        if not expression:
+            return KeysetPage([], None)
+        sql = f'''
+            SELECT id, rank FROM (
+                SELECT rowid AS id, bm25({self.table}, %s, %s) AS rank
+                FROM {self.table} WHERE {self.table} MATCH %s
+            )
+        '''
+        params = [self.title_weight, self.description_weight, expression]
+        values = decode_cursor(cursor)
+        if values:
+            try:
+                rank, pk = float(values[0]), int(values[1])
+            except (TypeError, ValueError):
+                pass
+            else:
+                sql += ' WHERE rank > %s OR (rank = %s AND id > %s)'
+                params += [rank, rank, pk]
+        # bm25() is lower for better matches; fetch one extra row to know if there is a next page
+        sql += ' ORDER BY rank, id LIMIT %s'
+        params.append(per_page + 1)
+        with connection.cursor() as db_cursor:
+            db_cursor.execute(sql, params)
+            rows = db_cursor.fetchall()
+
+        next_cursor = None
+        if len(rows) > per_page:
+            rows = rows[:per_page]
+            last_id, last_rank = rows[-1]
+            next_cursor = encode_cursor([last_rank, last_id])
+        images = Image.objects.in_bulk([image_id for image_id, rank in rows])
+        return KeysetPage([images[image_id] for image_id, rank in rows if image_id in images], next_cursor)
+
+    def rebuild(self, chunk_size=1000):
+        """
+        Empty the index and fill it again from the images table, reading chunk_size rows at a time.
+        """
+        total = 0
+        rows = Image.objects.order_by().values_list('id', 'title', 'description').iterator(chunk_size=chunk_size)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    total += self._insert(cursor, chunk)
+                    chunk = []
+            total += self._insert(cursor, chunk)
+        return total
+
+    def _insert(self, cursor, rows):
+        if rows:
+            cursor.executemany(f'INSERT INTO {self.table} (rowid, title, description) VALUES (%s, %s, %s)', rows)
+        return len(rows)
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.IMAGE_SEARCH_BACKEND)()
+    return _backend
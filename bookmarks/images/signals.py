@@ -1,12 +1,90 @@
-from django.db.models.signals import m2m_changed
+from collections import Counter
+
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
-from .models import Image
+from .models import Blob, Image
+from .thumbnails import queue_thumbnails
+from . import search
+
+
+def liked_image_ids(sender, instance, reverse, pk_set):
+    """
+    Return the ids of the images whose like rows are about to be removed, one id per row.
+    """
+    if reverse:
+        # user.images_liked.remove(...): instance is a User and pk_set contains image ids
+        likes = sender.objects.filter(user_id=instance.pk)
+        if pk_set is not None:
+            likes = likes.filter(image_id__in=pk_set)
+    else:
+        # image.users_like.remove(...): instance is an Image and pk_set contains user ids
+        likes = sender.objects.filter(image_id=instance.pk)
+        if pk_set is not None:
+            likes = likes.filter(user_id__in=pk_set)
+    return list(likes.values_list('image_id', flat=True))
+
+
+def update_total_likes(image_ids, sign):
+    """
+    Add sign * (number of occurrences) to total_likes of every image in image_ids.
+    """
+    deltas = Counter(image_ids)
+    by_delta = {}
+    for image_id, count in deltas.items():
+        by_delta.setdefault(count * sign, []).append(image_id)
+    for delta, ids in by_delta.items():
+        # UPDATE images_image SET total_likes = MAX(total_likes + delta, 0), version = version + 1 WHERE id IN (...)
+        # The database applies the delta atomically and only the counter columns are written.
+        Image.objects.filter(id__in=ids).update(
+            total_likes=Greatest(F('total_likes') + delta, 0),
+            version=F('version') + 1
+        )
 
 
 @receiver(m2m_changed, sender=Image.users_like.through)
-def users_like_changed(sender, instance, **kwargs):
-    instance.total_likes = instance.users_like.count()
-    instance.save()
+def users_like_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'post_add':
+        # For additions pk_set only contains the rows that were really inserted
+        if reverse:
+            update_total_likes(pk_set, 1)
+        else:
+            update_total_likes([instance.pk] * len(pk_set), 1)
+    elif action in ('pre_remove', 'pre_clear'):
+        # For removals pk_set contains whatever was requested, so count the rows that exist.
+        # The signal is sent inside the same transaction as the DELETE.
+        update_total_likes(liked_image_ids(sender, instance, reverse, pk_set), -1)
+
+
+@receiver(post_save, sender=Image)
+def image_saved(sender, instance, update_fields=None, **kwargs):
+    # create the thumbnails of the new file in the background
+    if update_fields is None or 'image' in update_fields:
+        queue_thumbnails(instance, 'image')
+    # keep the search index up to date; saves that don't touch the text (status, file, ...) are skipped
+    if update_fields is None or {'title', 'description'} & set(update_fields):
+        search.get_backend().index(instance)
+
+
+@receiver(pre_delete, sender=Image)
+def image_deleting(sender, instance, **kwargs):
+    # the instance may have been loaded before the ingestion worker stored its file, read the blob it uses now
+    instance.blob_id = Image.objects.filter(pk=instance.pk).values_list('blob_id', flat=True).first()
+
+
+@receiver(post_delete, sender=Image)
+def image_deleted(sender, instance, **kwargs):
+    search.get_backend().remove(instance.id)
+    # the file is shared with other images; it is deleted by `manage.py gc_blobs` once nobody uses it
+    if instance.blob_id:
+        Blob.release(instance.blob_id)
+
+
+# Instead of counting the likes and saving the whole image on every change (a COUNT query plus a full-row
+# UPDATE that also runs the slug logic of Image.save()), the counter is moved by the number of likes that
+# were added or removed. Concurrent likes can't overwrite each other's count because the database computes
+# total_likes + delta itself. If the counter ever drifts, `manage.py reconcile_likes` recounts it.
 
 # @receiver:
 # A decorator provided by Django to connect a function (the signal handler) to a signal.
@@ -14,6 +92,7 @@ def users_like_changed(sender, instance, **kwargs):
 
 # m2m_changed:
 # Specifies that this function should be called whenever there is a change in a Many-to-Many field.
+# action tells which change is happening (pre_add, post_add, pre_remove, post_remove, pre_clear, post_clear).
 
 # Image.users_like.through references that intermediate model.
 
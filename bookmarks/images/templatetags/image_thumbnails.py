@@ -0,0 +1,12 @@
+from django import template
+
+from images.thumbnails import thumbnail_url
+
+register = template.Library()
+
+
+# Usage: {% load image_thumbnails %} <img src="{{ image.image|alias_url:'grid' }}">
+# The aliases are defined in THUMBNAIL_ALIASES (settings.py) and generated when the file is saved.
+@register.filter
+def alias_url(fieldfile, alias):
+    return thumbnail_url(fieldfile, alias)
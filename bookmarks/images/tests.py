@@ -1,3 +1,336 @@
-from django.test import TestCase
+import datetime
+import hashlib
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from bookmarks.pagination import decode_cursor, encode_cursor, keyset_paginate
+from .models import Blob, Image, ImageIngestJob, ImageSlugCounter
+from . import dedup, ingest
+from .search import SQLiteFTSBackend
+
+
+def make_image(user, title='Sunset', **kwargs):
+    return Image.objects.create(user=user, title=title, url='https://example.com/picture.jpg', **kwargs)
+
+
+def make_blob(content=b'not a picture', refcount=0):
+    blob = Blob(sha256=hashlib.sha256(content).hexdigest(), size=len(content), refcount=refcount)
+    # blob_path() names the file after the hash, in MEDIA_ROOT of the test settings
+    blob.file.save('picture.txt', ContentFile(content), save=False)
+    blob.save()
+    return blob
+
+
+class TotalLikesTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner')
+        self.fans = [User.objects.create_user(f'fan{number}') for number in range(3)]
+        self.image = make_image(self.owner)
+
+    def total_likes(self, image):
+        return Image.objects.values_list('total_likes', flat=True).get(pk=image.pk)
+
+    def test_add_counts_the_new_likes_only(self):
+        self.image.users_like.add(*self.fans)
+        # already liked: no row is inserted, the count doesn't move
+        self.image.users_like.add(self.fans[0])
+        self.assertEqual(self.total_likes(self.image), 3)
+
+    def test_remove_counts_the_existing_likes_only(self):
+        self.image.users_like.add(self.fans[0], self.fans[1])
+        # fans[2] never liked the image
+        self.image.users_like.remove(self.fans[0], self.fans[2])
+        self.assertEqual(self.total_likes(self.image), 1)
+
+    def test_clear(self):
+        self.image.users_like.add(*self.fans)
+        self.image.users_like.clear()
+        self.assertEqual(self.total_likes(self.image), 0)
+
+    def test_reverse_relation(self):
+        other = make_image(self.owner, title='Beach')
+        fan = self.fans[0]
+        fan.images_liked.add(self.image, other)
+        fan.images_liked.remove(self.image)
+        self.assertEqual(self.total_likes(self.image), 0)
+        self.assertEqual(self.total_likes(other), 1)
+        fan.images_liked.clear()
+        self.assertEqual(self.total_likes(other), 0)
+
+    def test_like_changes_the_version(self):
+        version = self.image.version
+        self.image.users_like.add(self.fans[0])
+        self.assertEqual(Image.objects.get(pk=self.image.pk).version, version + 1)
+
+
+class SlugTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner')
+
+    def test_same_title_gets_numbered_slugs(self):
+        slugs = [make_image(self.user, 'Sunset').slug for _ in range(3)]
+        self.assertEqual(slugs, ['sunset', 'sunset-1', 'sunset-2'])
+
+    def test_counter_starts_after_the_existing_slugs(self):
+        # images saved before the counter of the base existed
+        make_image(self.user, slug='beach')
+        make_image(self.user, slug='beach-4')
+        self.assertEqual(ImageSlugCounter.reserve('beach', 2), ['beach-5', 'beach-6'])
+
+    def test_slugs_of_other_bases_are_skipped(self):
+        self.assertEqual(ImageSlugCounter.reserve('photo'), ['photo'])
+        # the title "Photo 2" has the base slug "photo-2", the next number of the base "photo"
+        self.assertEqual(make_image(self.user, 'Photo 2').slug, 'photo-2')
+        self.assertEqual(ImageSlugCounter.reserve('photo', 2), ['photo-1', 'photo-3'])
+
+    def test_reserved_slugs_are_never_handed_out_twice(self):
+        first = ImageSlugCounter.reserve('sunset', 3)
+        second = ImageSlugCounter.reserve('sunset', 3)
+        self.assertEqual(len(set(first + second)), 6)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('owner')
+        self.images = [make_image(user, f'Image {number}') for number in range(7)]
+        # three images created at the same time: the id decides their order
+        same_time = timezone.now()
+        Image.objects.filter(pk__in=[image.pk for image in self.images[2:5]]).update(created=same_time)
+
+    def read_all(self, per_page):
+        ids = []
+        cursor = None
+        while True:
+            page = keyset_paginate(Image.objects.all(), cursor, per_page)
+            ids += [image.id for image in page]
+            if not page.has_next():
+                return ids
+            cursor = page.next_cursor
+
+    def test_pages_return_every_row_once_in_order(self):
+        expected = list(Image.objects.order_by('-created', '-id').values_list('id', flat=True))
+        for per_page in (1, 2, 3, 7):
+            self.assertEqual(self.read_all(per_page), expected)
+
+    def test_ties_are_broken_by_id(self):
+        tied = [image.pk for image in self.images[2:5]]
+        ids = self.read_all(2)
+        self.assertEqual([pk for pk in ids if pk in tied], sorted(tied, reverse=True))
+
+    def test_last_page_has_no_cursor(self):
+        page = keyset_paginate(Image.objects.all(), None, 7)
+        self.assertEqual(len(page), 7)
+        self.assertIsNone(page.next_cursor)
+
+    def test_cursor_round_trip(self):
+        created = timezone.now()
+        self.assertEqual(decode_cursor(encode_cursor([created, 42])), [created.isoformat(), 42])
+
+    def test_invalid_cursor_returns_the_first_page(self):
+        first_page = [image.id for image in keyset_paginate(Image.objects.all(), None, 3)]
+        for cursor in ('not-base64!', encode_cursor(['yesterday', 'x']), encode_cursor([1, 2, 3])):
+            page = keyset_paginate(Image.objects.all(), cursor, 3)
+            self.assertEqual([image.id for image in page], first_page)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('owner')
+        # the post_save signal indexes the images
+        self.title_matches = [make_image(user, 'Sunset over the sea') for _ in range(4)]
+        self.description_matches = [
+            make_image(user, 'Evening', description='A sunset over the sea') for _ in range(3)
+        ]
+        make_image(user, 'Mountains')
+        self.backend = SQLiteFTSBackend()
+
+    def read_all(self, query, per_page):
+        ids = []
+        cursor = None
+        while True:
+            page = self.backend.search(query, cursor, per_page)
+            ids += [image.id for image in page]
+            if not page.has_next():
+                return ids
+            cursor = page.next_cursor
+
+    def test_pages_return_every_match_once_best_first(self):
+        # equal ranks are ordered by id
+        expected = [image.id for image in self.title_matches + self.description_matches]
+        for per_page in (1, 2, 3, 10):
+            self.assertEqual(self.read_all('sunset', per_page), expected)
+
+    def test_prefix_match(self):
+        self.assertEqual(len(self.read_all('suns', 10)), 7)
+
+    def test_query_syntax_is_ignored(self):
+        self.assertEqual(len(self.read_all('sunset" (', 10)), 7)
+        self.assertEqual(len(self.backend.search('!!!')), 0)
+
+    def test_invalid_cursor_returns_the_first_page(self):
+        page = self.backend.search('sunset', encode_cursor(['best', 'x']), 2)
+        self.assertEqual([image.id for image in page], [image.id for image in self.title_matches[:2]])
+
+    def test_deleted_image_leaves_the_index(self):
+        self.title_matches[0].delete()
+        self.assertEqual(len(self.read_all('sunset', 10)), 6)
+
+
+class DuplicateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner')
+        self.value = 0x0123456789abcdef
+
+    def make_copy(self, flipped_bits):
+        value = self.value
+        for bit in flipped_bits:
+            value ^= 1 << bit
+        return make_image(self.user, **dedup.hash_fields(value))
+
+    def test_closest_images_first(self):
+        two_bits = self.make_copy([1, 40])
+        same = self.make_copy([])
+        one_bit = self.make_copy([63])
+        # too far: 4 bits
+        self.make_copy([0, 17, 33, 49])
+        self.assertEqual(dedup.find_duplicates(self.value), [same, one_bit, two_bits])
+        self.assertEqual(dedup.find_duplicates(self.value, exclude_id=same.id, limit=1), [one_bit])
+
+    @override_settings(DUPLICATE_MAX_CANDIDATES=3)
+    def test_candidates_are_capped(self):
+        copies = [self.make_copy([]) for _ in range(5)]
+        duplicates = dedup.find_duplicates(self.value, limit=10)
+        self.assertEqual(len(duplicates), 3)
+        self.assertTrue(set(duplicates) <= set(copies))
+
+
+class ImageCreateTests(TestCase):
+    def setUp(self):
+        # the cached users are deleted after the commit, which a TestCase never reaches
+        cache.clear()
+        self.user = User.objects.create_user('owner')
+        self.client.force_login(self.user)
+        self.data = {'title': 'Sunset', 'url': 'https://example.com/sunset.jpg', 'description': ''}
+
+    def test_new_image_is_queued_for_download(self):
+        response = self.client.post(reverse('images:create'), self.data)
+        image = Image.objects.get()
+        self.assertRedirects(response, image.get_absolute_url(), fetch_redirect_response=False)
+        self.assertEqual(image.status, Image.Status.PENDING)
+        self.assertEqual(image.ingest_job.status, ImageIngestJob.Status.QUEUED)
+
+    def test_no_image_without_its_job(self):
+        with mock.patch.object(ingest, 'enqueue', side_effect=RuntimeError('database is locked')):
+            with self.assertRaises(RuntimeError):
+                self.client.post(reverse('images:create'), self.data)
+        self.assertFalse(Image.objects.exists())
+
+
+class IngestJobTests(TransactionTestCase):
+    # process_job() closes the connections it can't reuse, which a TestCase transaction doesn't survive
+    def setUp(self):
+        self.user = User.objects.create_user('owner')
+        self.image = make_image(self.user, status=Image.Status.PENDING)
+        ingest.enqueue(self.image)
+
+    def test_failed_download_is_retried_later(self):
+        [job] = ingest.claim_jobs(10)
+        with mock.patch.object(ingest, 'fetch_image', side_effect=ValueError('timeout')):
+            ingest.process_job(job)
+        job = ImageIngestJob.objects.get(pk=job.pk)
+        self.assertEqual(job.status, ImageIngestJob.Status.QUEUED)
+        self.assertEqual(job.last_error, 'timeout')
+        self.assertGreater(job.run_after, timezone.now())
+
+    def test_image_deleted_while_its_job_runs(self):
+        [job] = ingest.claim_jobs(10)
+
+        def delete_image(image):
+            # the job row is deleted with the image
+            Image.objects.filter(pk=image.pk).delete()
+            raise ValueError('The image was deleted.')
+
+        with mock.patch.object(ingest, 'fetch_image', side_effect=delete_image):
+            ingest.process_job(job)
+        self.assertFalse(ImageIngestJob.objects.exists())
+        # the worker goes on with the next jobs
+        self.assertEqual(ingest.run_workers(concurrency=1, once=True), 0)
+
+
+class BlobTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner')
+
+    def refcount(self, blob):
+        return Blob.objects.values_list('refcount', flat=True).get(pk=blob.pk)
+
+    def gc_blobs(self):
+        call_command('gc_blobs', stdout=StringIO())
+
+    def make_old(self, blob):
+        Blob.objects.filter(pk=blob.pk).update(created=timezone.now() - datetime.timedelta(hours=2))
+
+    def test_fetching_a_known_url_reuses_its_blob(self):
+        blob = make_blob()
+        with mock.patch.object(ingest, 'store_blob', return_value=blob) as store_blob:
+            self.assertEqual(ingest.acquire_blob('https://example.com/a.jpg'), blob)
+            self.assertEqual(ingest.acquire_blob('https://example.com/a.jpg'), blob)
+        store_blob.assert_called_once()
+        self.assertEqual(self.refcount(blob), 2)
+
+    def test_deleting_an_image_releases_its_blob(self):
+        blob = make_blob(refcount=2)
+        first = make_image(self.user, blob=blob)
+        make_image(self.user, blob=blob)
+        first.delete()
+        self.assertEqual(self.refcount(blob), 1)
+
+    def test_release_never_goes_below_zero(self):
+        blob = make_blob()
+        Blob.release(blob.pk)
+        self.assertEqual(self.refcount(blob), 0)
+
+    def test_failed_save_releases_the_reference(self):
+        blob = make_blob()
+        image = make_image(self.user, status=Image.Status.PENDING)
+        # the image is deleted while the worker downloads its file
+        Image.objects.filter(pk=image.pk).delete()
+        with mock.patch.object(ingest, 'store_blob', return_value=blob):
+            with self.assertRaises(Exception):
+                ingest.fetch_image(image)
+        self.assertEqual(self.refcount(blob), 0)
+
+    def test_gc_deletes_unused_blobs_and_their_files(self):
+        blob = make_blob()
+        self.make_old(blob)
+        storage, name = blob.file.storage, blob.file.name
+        self.gc_blobs()
+        self.assertFalse(Blob.objects.filter(pk=blob.pk).exists())
+        self.assertFalse(storage.exists(name))
+
+    def test_gc_keeps_used_and_recent_blobs(self):
+        used = make_blob(b'used', refcount=1)
+        make_image(self.user, blob=used)
+        self.make_old(used)
+        recent = make_blob(b'recent')
+        self.gc_blobs()
+        self.assertEqual(Blob.objects.filter(pk__in=[used.pk, recent.pk]).count(), 2)
+        used.file.delete(save=False)
+        recent.file.delete(save=False)
+
+    def test_gc_repairs_a_count_lower_than_the_images(self):
+        # the image uses the blob but its reference was lost
+        blob = make_blob()
+        make_image(self.user, blob=blob)
+        self.make_old(blob)
+        self.gc_blobs()
+        self.assertEqual(self.refcount(blob), 1)
+        blob.file.delete(save=False)
@@ -0,0 +1,109 @@
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from easy_thumbnails.alias import aliases
+from easy_thumbnails.files import generate_all_aliases, get_thumbnailer
+
+from account.authentication import invalidate_user
+from account.models import Profile
+
+# Eager thumbnail generation.
+#
+# Every size used by the templates is a named alias (THUMBNAIL_ALIASES in settings.py). The thumbnails of all
+# the aliases are created right after an Image or a Profile photo is saved, in a pool of worker processes, so
+# the templates only have to build the URL of a file that already exists (see templatetags/image_thumbnails.py)
+# instead of opening and resizing the source image while the page is rendered.
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def init_worker():
+    import django
+    from django.db import connections
+
+    # with the "spawn" start method the worker starts from scratch and needs its own Django setup
+    django.setup()
+    # with "fork" it inherits the database connections of the parent process, which must not be shared
+    connections.close_all()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        # The pool is started lazily, from a web worker or an ingestion worker that runs other threads. A forked
+        # child would get a copy of the locks those threads hold at that moment (and never see them released),
+        # so the worker processes are spawned: they start a fresh interpreter and set Django up (init_worker).
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.THUMBNAIL_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker
+        )
+    return _executor
+
+
+def generate_thumbnails(model_label, pk, field_name):
+    """
+    Create the thumbnails of every alias defined for the file field of an object.
+    Runs in a worker process.
+    """
+    model = apps.get_model(model_label)
+    obj = model.objects.filter(pk=pk).first()
+    if obj is None:
+        return 0
+    fieldfile = getattr(obj, field_name)
+    if not fieldfile:
+        return 0
+    try:
+        generate_all_aliases(fieldfile, include_global=True)
+    except Exception:
+        # a broken source file must not stop the other thumbnails; templates fall back to the original file
+        logger.exception('Could not create the thumbnails of %s', fieldfile.name)
+        return 0
+    if any(field.name == 'version' for field in model._meta.fields):
+        # cached fragments (see bookmarks/fragments.py) may still point to the original file; a new version
+        # makes them render again with the thumbnail URLs
+        model.objects.filter(pk=pk).update(version=F('version') + 1)
+        if model is Profile:
+            # update() sends no post_save: the cached request.user.profile would keep the old version
+            invalidate_user(obj.user_id)
+    return len(aliases.all(fieldfile, include_global=True))
+
+
+def queue_thumbnails(instance, field_name):
+    """
+    Generate the thumbnails of a file field in the process pool once the current transaction is committed.
+    """
+    if not getattr(instance, field_name):
+        return
+    model_label = instance._meta.label
+    transaction.on_commit(
+        lambda: get_executor().submit(generate_thumbnails, model_label, instance.pk, field_name)
+    )
+
+
+def thumbnail_url(fieldfile, alias):
+    """
+    Return the URL of the thumbnail of fieldfile for the alias.
+    The thumbnail file name is computed from the alias options, nothing is opened or resized. If the thumbnail
+    hasn't been generated yet, the URL of the original file is returned.
+    """
+    if not fieldfile:
+        return ''
+    thumbnailer = get_thumbnailer(fieldfile)
+    options = aliases.get(alias, target=thumbnailer.alias_target)
+    if options is None:
+        raise KeyError(alias)
+    # the thumbnail name only depends on the source name (THUMBNAIL_PRESERVE_EXTENSIONS), so a single stat
+    # tells if it has been generated
+    name = thumbnailer.get_thumbnail_name(options)
+    storage = thumbnailer.thumbnail_storage
+    if storage.exists(name):
+        return storage.url(name)
+    return fieldfile.url
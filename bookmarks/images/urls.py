@@ -1,14 +1,25 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 app_name = 'images'
 
+# Served by ASGI, the hot views are the async versions (see bookmarks/asgi.py)
+if settings.ASYNC_VIEWS:
+    image_detail, image_like, image_ranking = (
+        views.image_detail_async, views.image_like_async, views.image_ranking_async
+    )
+else:
+    image_detail, image_like, image_ranking = views.image_detail, views.image_like, views.image_ranking
+
 urlpatterns = [
     path('create/', views.image_create, name='create'),
-    path('detail/<int:id>/<slug:slug>/', views.image_detail, name='detail'),
-    path('like/', views.image_like, name='like'),
+    path('detail/<int:id>/<slug:slug>/', image_detail, name='detail'),
+    path('status/<int:id>/', views.image_status, name='status'),
+    path('like/', image_like, name='like'),
     path('', views.image_list, name='list'),
-    path('ranking/', views.image_ranking, name='ranking'),
+    path('ranking/', image_ranking, name='ranking'),
+    path('search/', views.image_search, name='search'),
 
 ]
 
@@ -1,23 +1,25 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.db import transaction
 from django.template import TemplateDoesNotExist
 from django.template.loader import get_template
 
 from .forms import ImageCreateForm
+from .fragments import render_image_cards
 from .models import Image
+from . import counters, dedup, ingest, ranking, search
 
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
-from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
 from django.http import HttpResponse
-from actions.utils import create_action
+from account.decorators import async_login_required
+from actions.utils import create_action, acreate_action
+from bookmarks.pagination import keyset_paginate
+from bookmarks.routers import replica_reads
 
-import redis
-from django.conf import settings
-
-# connect to Redis -- using the local host and local port for Redis
-r = redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db = settings.REDIS_DB)
+# Redis is used through images/counters.py (view counters) and images/ranking.py (leaderboards)
 
 
 @login_required
@@ -37,10 +39,15 @@ def image_create(request):
                 # assign current user to the item. This is how we will know who uploaded each image.
                 new_image.user = request.user
                 print(f"After user assignment: Image ID={new_image.id}, User={new_image.user}")
-                new_image.save()
-                print(f"After SAVE: Image ID={new_image.id}, User={new_image.user}")
-
-                create_action(request.user, 'bookmarked image', new_image)
+                # The image, its download job and the action are written together: a pending image without its
+                # job would never be downloaded.
+                with transaction.atomic():
+                    new_image.save()
+                    print(f"After SAVE: Image ID={new_image.id}, User={new_image.user}")
+                    # download the file in the background
+                    ingest.enqueue(new_image)
+
+                    create_action(request.user, 'bookmarked image', new_image)
                 # After a user submits a form to create an image and the image is saved, the action bookmarked image
                 # is recorded. This logs that the user has bookmarked the new image
 
@@ -54,25 +61,35 @@ def image_create(request):
     else:
         # build form with data provided by the bookmarklet via GET
         form = ImageCreateForm(data=request.GET)
+    # If the URL was already downloaded, offer the existing bookmarks of the same picture
+    duplicates = dedup.duplicates_for_url(request.GET['url']) if request.GET.get('url') else []
     return render(
         request,
         'images/image/create.html',
-        {'section': 'images', 'form': form}
+        {'section': 'images', 'form': form, 'duplicates': duplicates}
     )
 
 
 def image_detail(request, id, slug):
     image = get_object_or_404(Image, id=id, slug=slug)
-    # increment total image views by 1
-    total_views = r.incr(f'image:{image.id}:views')
-    # increment image ranking by 1
-    r.zincrby('image_ranking', 1, image.id)
+    # increment total image views and image ranking by 1 (one round trip to Redis)
+    total_views = counters.record_view(image)
+    # Show the owner the other bookmarks of the same picture (found once the file has been downloaded)
+    duplicates = []
+    if image.dhash is not None and image.user_id == request.user.id:
+        duplicates = dedup.find_duplicates(image.dhash, exclude_id=image.id)
 
     return render(request, 'images/image/detail.html',
-                  {'section': 'images', 'image': image, 'total_views': total_views}
+                  {'section': 'images', 'image': image, 'total_views': total_views, 'duplicates': duplicates}
                   )
 
 
+def image_status(request, id):
+    # polled by the detail page while the image is being downloaded
+    image = get_object_or_404(Image, id=id)
+    return JsonResponse({'status': image.status})
+
+
 @login_required
 @require_POST
 def image_like(request):
@@ -102,6 +119,7 @@ def image_like(request):
 
 
 @login_required
+@replica_reads
 def image_list(request):
     # to debug the template don't exist error
     # try:
@@ -112,63 +130,109 @@ def image_list(request):
     # except TemplateDoesNotExist as e:
     #     print(f"Template error: {e}")
 
-    images = Image.objects.all()
-    paginator = Paginator(images, 6)
-    page = request.GET.get('page')
+    # Keyset pagination: each page starts after the cursor of the previous one, so deep scroll
+    # requests cost the same as the first page and no COUNT(*) query is needed.
+    images = keyset_paginate(Image.objects.all(), request.GET.get('cursor'), 6)
     images_only = request.GET.get('images_only')
-    try:
-        images = paginator.page(page)
-    #   Alternatively can also be used the below code:
-    #   images = paginator.get_page(page)
-
-    except PageNotAnInteger:
-        # If page is not an integer deliver the first page
-        images = paginator.page(1)
-    except EmptyPage:
-        if images_only:
-            # If AJAX request and page out of range return an empty page
-            return HttpResponse('')
-        # If page out of range return last page of results
-        images = paginator.page(paginator.num_pages)
     if images_only:
-        return render(
+        if not images:
+            # If AJAX request and there are no more images return an empty page
+            return HttpResponse('')
+        response = render(
             request,
             'images/image/list_images.html',
-            {'section': 'images', 'images': images}
+            {'section': 'images', 'images': images, 'image_cards': render_image_cards(images)}
         )
+        # the infinite scroll script reads the cursor of the next page from this header
+        response['X-Next-Cursor'] = images.next_cursor or ''
+        return response
     return render(
-        request,'images/image/list.html',{'section': 'images', 'images': images}
+        request,'images/image/list.html',
+        {'section': 'images', 'images': images, 'image_cards': render_image_cards(images)}
     )
 
 
 @login_required
+@replica_reads
 def image_ranking(request):
-    # get image ranking dictionary
-    image_ranking = r.zrange('image_ranking', 0, -1, desc=True)[:10]
-    # r.zrange('image_ranking', 0, -1, desc=True) fetches all members of the Redis sorted set named 'image_ranking'
-    # in descending order (from highest score to lowest).
-    #
-    # These members are image IDs stored as strings (or bytes), so they are converted to integers.
-    image_ranking_ids = [int(id) for id in image_ranking]
-
-    # get most viewed images
-    most_viewed = list(
-        Image.objects.filter(
-            id__in=image_ranking_ids
-        )
+    window = request.GET.get('window', 'all')
+    # get the 10 most viewed images of the window (day, week or all time) with their views
+    most_viewed = ranking.top_images(window, 10)
+    # The ranking service reads only the top 10 ids from the Redis sorted set, loads the images in
+    # one query and caches the result for a short time, so most requests don't touch the database.
+
+    return render(
+        request,
+        'images/image/ranking.html',
+        {'section': 'images', 'most_viewed': most_viewed, 'window': window}
     )
-    # This queries the Django database for Image objects with IDs in the image_ranking_ids list.
-    # Note that this query does not guarantee the order of images.
 
-    most_viewed.sort(key=lambda x: image_ranking_ids.index(x.id))
-    # Since the database query might return images in any order, this sorting step rearranges the images to match
-    # the order specified by image_ranking_ids (which reflects the popularity ranking from Redis).
-    #
-    # Python 'key' function is required when sorting objects that do not have an inherent order or when you want
-    # to sort by a specific attribute.
 
+@login_required
+def image_search(request):
+    query = request.GET.get('q', '').strip()
+    # Best matches first; the next pages start after the rank of the last image (see images/search.py)
+    images = search.get_backend().search(query, request.GET.get('cursor'), 12)
+    image_cards = render_image_cards(images)
+    if request.GET.get('images_only'):
+        if not images:
+            return HttpResponse('')
+        response = render(request, 'images/image/list_images.html', {'image_cards': image_cards})
+        # the infinite scroll script reads the cursor of the next page from this header
+        response['X-Next-Cursor'] = images.next_cursor or ''
+        return response
     return render(
+        request,
+        'images/image/search.html',
+        {'section': 'images', 'query': query, 'images': images, 'image_cards': image_cards}
+    )
+
+
+# Async versions of the hot views, used when the site is served by ASGI (see bookmarks/asgi.py and images/urls.py).
+# They wait for Redis with the async client (bookmarks/redis_client.py) and for the database with the async ORM,
+# so a worker keeps serving other requests during the round trips instead of blocking a thread per request.
+# Templates are rendered with sync_to_async(): rendering may still run queries (likes, profiles, ...).
+
+async def image_detail_async(request, id, slug):
+    image = await aget_object_or_404(Image, id=id, slug=slug)
+    total_views = await counters.arecord_view(image)
+    duplicates = []
+    if image.dhash is not None and image.user_id == (await request.auser()).id:
+        duplicates = await sync_to_async(dedup.find_duplicates)(image.dhash, exclude_id=image.id)
+    return await sync_to_async(render)(
+        request,
+        'images/image/detail.html',
+        {'section': 'images', 'image': image, 'total_views': total_views, 'duplicates': duplicates}
+    )
+
+
+@async_login_required
+@require_POST
+async def image_like_async(request):
+    image_id = request.POST.get('id')
+    action = request.POST.get('action')
+    if image_id and action:
+        try:
+            image = await Image.objects.aget(id=image_id)
+            user = await request.auser()
+            if action == 'like':
+                await image.users_like.aadd(user)
+                await acreate_action(user, 'likes', image)
+            else:
+                await image.users_like.aremove(user)
+            return JsonResponse({'status': 'ok'})
+        except Image.DoesNotExist:
+            pass
+    return JsonResponse({'status': 'error'})
+
+
+@async_login_required
+@replica_reads
+async def image_ranking_async(request):
+    window = request.GET.get('window', 'all')
+    most_viewed = await ranking.atop_images(window, 10)
+    return await sync_to_async(render)(
         request,
         'images/image/ranking.html',
-        {'section': 'images', 'most_viewed':most_viewed}
-    )
\ No newline at end of file
+        {'section': 'images', 'most_viewed': most_viewed, 'window': window}
+    )
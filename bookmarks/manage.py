@@ -6,7 +6,9 @@ import sys
 
 def main():
     """Run administrative tasks."""
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bookmarks.settings')
+    # the tests run with their own settings (fake Redis, local cache, ...), see bookmarks/test_settings.py
+    default_settings = 'bookmarks.test_settings' if sys.argv[1:2] == ['test'] else 'bookmarks.settings'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', default_settings)
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc: